@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""Бенчмарки ru2en.
+
+    python bench_ru2en.py encode [--wav file.wav] [--repeat 5]
+    python bench_ru2en.py e2e [--wav a.wav ...] [--save-baseline base.json | --baseline base.json]
+    python bench_ru2en.py startup [--repeat 5]
+    python bench_ru2en.py rtf --engines gpt-4o-mini-transcribe local:small [--wav a.wav ...] [--live]
+
+e2e гоняет запись через stop_and_process против локального мок-сервера OpenAI:
+без сети, звуковой карты и WinAPI. Подходит для CI.
+"""
+import argparse, contextlib, io, json, os, subprocess, sys, threading, time, tracemalloc
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import ru2en
+
+# ------------ Fixtures -------------
+def synth_speech(sec: float, sr: int = None, seed: int = 0):
+    """Речеподобный сигнал: гармоники основного тона под слоговой огибающей + паузы и шум."""
+    sr = sr or ru2en.SAMPLE_RATE
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sec * sr)) / sr
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4.0 * t), 0, None) ** 2
+    words = (np.sin(2 * np.pi * 0.4 * t) > -0.3).astype(np.float64)
+    x = 6000 * voice * syllables * words + rng.standard_normal(t.size) * 40
+    return np.clip(x, -32768, 32767).astype(np.int16)
+
+def load_fixture(path: str):
+    import soundfile as sf
+    audio, sr = sf.read(path, dtype="int16", always_2d=False)
+    if audio.ndim > 1:
+        audio = audio[:, 0].copy()
+    return audio, sr
+
+# ------------ encode -------------
+def bench_encode(audio, sr: int, repeat: int = 5):
+    """Время кодирования и размер загрузки по каждому формату относительно WAV."""
+    rows = []
+    wav_bytes = None
+    for fmt in ru2en.UPLOAD_FORMATS:
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            name, data = ru2en.encode_audio(audio, fmt, sr)
+            times.append(time.perf_counter() - t0)
+        if fmt == "wav":
+            wav_bytes = len(data)
+        rows.append({"format": fmt, "file": name, "bytes": len(data), "encode_ms": 1000 * float(np.median(times))})
+    for r in rows:
+        r["ratio"] = wav_bytes / r["bytes"] if r["bytes"] else 0.0
+        r["saved_kb"] = (wav_bytes - r["bytes"]) / 1024
+    return rows
+
+def cmd_encode(args):
+    if args.wav:
+        audio, sr = load_fixture(args.wav)
+    else:
+        sr = ru2en.SAMPLE_RATE
+        audio = synth_speech(args.seconds, sr)
+    print(f"clip: {len(audio) / sr:.1f}s @ {sr} Hz")
+    print(f"{'format':<8}{'file':<12}{'bytes':>10}{'ratio':>8}{'saved KB':>10}{'encode ms':>11}")
+    for r in bench_encode(audio, sr, args.repeat):
+        print(f"{r['format']:<8}{r['file']:<12}{r['bytes']:>10}{r['ratio']:>8.2f}{r['saved_kb']:>10.1f}{r['encode_ms']:>11.2f}")
+
+# ------------ Mock OpenAI -------------
+class MockOpenAI:
+    """Локальная замена /audio/transcriptions, /audio/translations и /chat/completions.
+
+    Задержка STT = stt_latency + длительность аудио × stt_rtf + загрузка по upload_mbps.
+    Чат: chat_ttft до первого токена, дальше chat_tps токенов в секунду (в т.ч. SSE-стрим).
+    """
+    def __init__(self, stt_latency=0.25, stt_rtf=0.05, upload_mbps=20.0, chat_ttft=0.3, chat_tps=80.0):
+        self.stt_latency, self.stt_rtf, self.upload_mbps = stt_latency, stt_rtf, upload_mbps
+        self.chat_ttft, self.chat_tps = chat_ttft, chat_tps
+        self.requests = []
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args): pass
+
+            def _json(self, obj, code=200):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._json({"object": "list", "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "bench"}]})
+                else:
+                    self._json({"error": {"message": "not found"}}, 404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?")[0].rstrip("/")
+                mock.requests.append(path)
+                if path.endswith(("/audio/transcriptions", "/audio/translations")):
+                    self._json({"text": mock._stt(body, self.headers.get("Content-Type", ""),
+                                                  english=path.endswith("translations"))})
+                elif path.endswith("/chat/completions"):
+                    mock._chat(self, json.loads(body or b"{}"))
+                else:
+                    self._json({"error": {"message": "not found"}}, 404)
+
+        self._handler = Handler
+        self.server = None
+
+    def _stt(self, body: bytes, content_type: str, english: bool) -> str:
+        t0 = time.perf_counter()
+        msg = BytesParser().parsebytes(b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+        audio = next((part.get_payload(decode=True) for part in msg.get_payload()
+                      if part.get_param("name", header="content-disposition") == "file"), b"")
+        try:
+            import soundfile as sf
+            duration = sf.info(io.BytesIO(audio)).duration
+        except Exception:
+            duration = len(audio) / (2 * ru2en.SAMPLE_RATE)
+        cost = self.stt_latency + duration * self.stt_rtf + len(audio) / (self.upload_mbps * 125_000)
+        time.sleep(max(0.0, cost - (time.perf_counter() - t0)))
+        words = max(1, int(duration * 2.5))
+        word = "word" if english else "слово"
+        return (" ".join([word] * words) + ".").capitalize()
+
+    def _chat(self, handler, req: dict):
+        text = req.get("messages", [{}])[-1].get("content", "")
+        tokens = [w + " " for w in ("Sentence one. " + "word " * max(1, len(text.split()) // 2)).split(" ") if w][:512]
+        time.sleep(self.chat_ttft)
+        model = req.get("model", "mock")
+        if not req.get("stream"):
+            time.sleep(len(tokens) / self.chat_tps)
+            handler._json({"id": "mock", "object": "chat.completion", "created": 0, "model": model,
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": "".join(tokens).strip()}}]})
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+        handler.close_connection = True
+        for tok in tokens:
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]}
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8")); handler.wfile.flush()
+            time.sleep(1 / self.chat_tps)
+        handler.wfile.write(b"data: [DONE]\n\n"); handler.wfile.flush()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown(); self.server.server_close()
+
+# ------------ e2e -------------
+TARGET_WIN, APP_WIN = 1, 2     # окна фейковой оконной системы: куда вставляем и окно ru2en
+
+def _run_clip(audio, on_text=None):
+    """Одна «отпущенная» запись через stop_and_process: без sounddevice, хоткея и WinAPI."""
+    job = ru2en.RecordingJob(TARGET_WIN)
+    job.buffer.write(audio); job.buffer.close(); job.rec_done.set()
+    backend = ru2en.get_input_backend()
+    if isinstance(backend, ru2en.FakeInputBackend):
+        backend.set_foreground(APP_WIN)     # пока шла обработка, фокус ушёл в окно ru2en
+    statuses = []
+    with contextlib.redirect_stdout(io.StringIO()):     # строки [TIME] — в таблицу, не в консоль
+        ru2en.stop_and_process(status_cb=statuses.append, on_done=on_text, job=job)
+    if statuses and statuses[-1].startswith("[ERR]"):
+        raise RuntimeError(statuses[-1])
+    return dict(ru2en.LAST_TIMINGS)
+
+def bench_e2e(clips, mock: MockOpenAI, repeat: int = 5, pipeline: str = "two_hop", paste: bool = False,
+              incremental: bool = False):
+    """Прогоняет клипы repeat раз; медиана/p95 по этапам, пиковая память tracemalloc отдельным прогоном."""
+    ru2en.CFG.update(openai_base_url=mock.base_url, openai_api_key="bench", prewarm_connection=False,
+                     translation_cache=False, stt_cache=False, cache_persist=False, stream_stt=False,
+                     output_mode="english", pipeline_mode=pipeline, style_profile="официальный",
+                     auto_paste=paste, incremental_paste=incremental, metrics_dump_path="")
+    ru2en.invalidate_clients()
+    if paste:
+        # фокус «уехал» в окно ru2en: вставка должна вернуть его и дождаться буфера
+        backend = ru2en.FakeInputBackend(activate_delay=0.03, focus_delay=0.02, clipboard_delay=0.01)
+        backend.add_window(TARGET_WIN, "editor", ctrl=11)
+        backend.add_window(APP_WIN, "ru2en")
+        ru2en.set_input_backend(backend)
+    else:
+        ru2en.paste_text = lambda *a, **k: None
+    _run_clip(clips[0][1])          # прогрев: клиент, соединение, импорты
+    runs = {}
+    for name, audio in clips:
+        for _ in range(repeat):
+            for stage, ms in _run_clip(audio).items():
+                runs.setdefault(stage, []).append(ms)
+    tracemalloc.start()
+    try:
+        peaks = []
+        for name, audio in clips:
+            tracemalloc.reset_peak()
+            _run_clip(audio)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    stages = {k: {"median_ms": float(np.median(v)), "p95_ms": float(np.percentile(v, 95)), "n": len(v)}
+              for k, v in runs.items()}
+    return {"stages": stages, "peak_mib": max(peaks) / 2**20,
+            "meta": {"pipeline": pipeline, "repeat": repeat, "clips": [n for n, _ in clips],
+                     "upload_format": ru2en.CFG.get("upload_format")}}
+
+def compare_baseline(result: dict, baseline: dict, tolerance: float = 0.2, min_ms: float = 25.0):
+    """Этапы, ставшие медленнее базы больше чем на tolerance и на min_ms (шум мелких этапов не в счёт)."""
+    regressions = []
+    for stage, cur in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        delta = cur["median_ms"] - base["median_ms"]
+        if delta > min_ms and cur["median_ms"] > base["median_ms"] * (1 + tolerance):
+            regressions.append((stage, base["median_ms"], cur["median_ms"]))
+    base_peak = baseline.get("peak_mib")
+    if base_peak and result["peak_mib"] > base_peak * (1 + tolerance) and result["peak_mib"] - base_peak > 1.0:
+        regressions.append(("peak_mib", base_peak, result["peak_mib"]))
+    return regressions
+
+def cmd_e2e(args):
+    sr = ru2en.SAMPLE_RATE
+    if args.wav:
+        clips = []
+        for path in args.wav:
+            audio, file_sr = load_fixture(path)
+            if file_sr != sr:
+                sys.exit(f"{path}: нужна частота {sr} Гц (сейчас {file_sr})")
+            clips.append((path, audio))
+    else:
+        clips = [(f"synth{sec:g}s", synth_speech(sec, sr, seed=i)) for i, sec in enumerate(args.seconds)]
+    if args.upload_format:
+        ru2en.CFG["upload_format"] = args.upload_format
+    mock = MockOpenAI(args.stt_latency, args.stt_rtf, args.upload_mbps, args.chat_ttft, args.chat_tps)
+    with mock:
+        res = bench_e2e(clips, mock, args.repeat, args.pipeline, args.paste, args.incremental)
+    print(f"clips: {', '.join(res['meta']['clips'])} | pipeline={args.pipeline} | repeat={args.repeat}")
+    print(f"{'stage':<16}{'median ms':>11}{'p95 ms':>10}")
+    for stage, st in res["stages"].items():
+        print(f"{stage:<16}{st['median_ms']:>11.1f}{st['p95_ms']:>10.1f}")
+    print(f"{'peak MiB':<16}{res['peak_mib']:>11.2f}")
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        print(f"baseline → {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_baseline(res, json.load(f), args.tolerance, args.min_ms)
+        for stage, base, cur in regressions:
+            print(f"REGRESSION {stage}: {base:.1f} → {cur:.1f}")
+        if regressions:
+            return 1
+        print("no regressions vs baseline")
+
+# ------------ rtf -------------
+def bench_rtf(clips, engines, repeat: int = 3):
+    """Real-time factor движков STT: время распознавания / длительность клипа (меньше — быстрее).
+
+    Движок вызывается напрямую, без политики повторов и кэша; загрузка модели — отдельной строкой.
+    """
+    rows = []
+    for engine in engines:
+        transcriber = ru2en.get_transcriber(engine)
+        t0 = time.perf_counter()
+        transcriber.warm()
+        load_ms = (time.perf_counter() - t0) * 1000
+        for name, audio, sr in clips:
+            inp = ru2en.SttInput(audio, sr)
+            ru2en.PIPELINE.run(transcriber.transcribe(inp, engine))     # прогрев: соединение, кэши
+            times, text = [], ""
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                text = ru2en.PIPELINE.run(transcriber.transcribe(ru2en.SttInput(audio, sr), engine))
+                times.append(time.perf_counter() - t0)
+            sec = float(np.median(times))
+            rows.append({"engine": engine, "clip": name, "audio_sec": inp.duration, "load_ms": load_ms,
+                         "median_ms": sec * 1000, "rtf": sec / inp.duration, "text": text})
+    return rows
+
+def cmd_rtf(args):
+    if args.wav:
+        clips = [(path, *load_fixture(path)) for path in args.wav]
+    else:
+        sr = ru2en.SAMPLE_RATE
+        clips = [(f"synth{sec:g}s", synth_speech(sec, sr, seed=i), sr) for i, sec in enumerate(args.seconds)]
+    ru2en.CFG.update(metrics_dump_path="")
+    mock = None
+    if not args.live and not all(ru2en.is_local_model(e) for e in args.engines):
+        # API-движки без --live — против мок-сервера: видна только цена загрузки и кодирования
+        mock = MockOpenAI(args.stt_latency, args.stt_rtf).__enter__()
+        ru2en.CFG.update(openai_base_url=mock.base_url, openai_api_key="bench", prewarm_connection=False)
+        ru2en.invalidate_clients()
+    try:
+        rows = bench_rtf(clips, args.engines, args.repeat)
+    finally:
+        if mock: mock.__exit__(None, None, None)
+    print(f"{'engine':<26}{'clip':<14}{'audio s':>8}{'load ms':>9}{'median ms':>11}{'RTF':>7}")
+    for r in rows:
+        print(f"{r['engine']:<26}{os.path.basename(r['clip'])[:13]:<14}{r['audio_sec']:>8.1f}{r['load_ms']:>9.0f}"
+              f"{r['median_ms']:>11.1f}{r['rtf']:>7.3f}")
+    if args.show_text:
+        for r in rows:
+            print(f"[{r['engine']} | {r['clip']}] {r['text']}")
+
+# ------------ startup -------------
+# холодный старт: импорт модуля → хоткей зарегистрирован → тяжёлые модули догружены
+_STARTUP_SCRIPT = """
+import sys
+import ru2en
+ru2en.set_input_backend(ru2en.FakeInputBackend())
+ru2en.start_hotkey_thread_if_enabled()
+print("HOTKEY", flush=True)
+ru2en.preload_modules().join()
+print("LOADED", flush=True)
+"""
+
+def import_profile(top: int = 10):
+    """python -X importtime -c 'import ru2en': (всего мс, [(мс, прямой импорт ru2en)] по убыванию)."""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", "import ru2en"],
+                       capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    children, total = [], 0.0
+    for line in r.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 0:              # модуль верхнего уровня; его импорты идут строками выше
+            if name.strip() == "ru2en":
+                total = int(cumulative) / 1000
+                break
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1000, name.strip()))
+    return total, sorted(children, reverse=True)[:top]
+
+def bench_startup(repeat: int = 5):
+    """Медианы: запуск интерпретатора → хоткей активен → всё догружено (мс)."""
+    hotkey, loaded = [], []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        p = subprocess.Popen([sys.executable, "-c", _STARTUP_SCRIPT], stdout=subprocess.PIPE, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        for line in p.stdout:
+            if line.startswith("HOTKEY"): hotkey.append((time.perf_counter() - t0) * 1000)
+            elif line.startswith("LOADED"): loaded.append((time.perf_counter() - t0) * 1000)
+        p.wait()
+    return {"hotkey_ms": float(np.median(hotkey)), "loaded_ms": float(np.median(loaded))}
+
+def cmd_startup(args):
+    total, rows = import_profile(args.top)
+    print(f"import ru2en: {total:.1f} ms (-X importtime, cumulative)")
+    for ms, name in rows:
+        print(f"  {ms:>8.1f} ms  {name}")
+    res = bench_startup(args.repeat)
+    print(f"cold start → hotkey live: {res['hotkey_ms']:.0f} ms | heavy modules loaded: {res['loaded_ms']:.0f} ms")
+    if args.max_hotkey_ms and res["hotkey_ms"] > args.max_hotkey_ms:
+        print(f"REGRESSION hotkey start {res['hotkey_ms']:.0f} ms > {args.max_hotkey_ms:.0f} ms")
+        return 1
+
+# ------------- Main -------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="bench_ru2en", description="Бенчмарки ru2en")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("encode", help="время кодирования против экономии байтов по форматам загрузки")
+    p.add_argument("--wav", help="фикстура WAV вместо синтетической речи")
+    p.add_argument("--seconds", type=float, default=30.0)
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=cmd_encode)
+    p = sub.add_parser("e2e", help="путь запись → текст против локального мок-сервера OpenAI")
+    p.add_argument("--wav", nargs="+", help="фикстуры WAV (16 кГц) вместо синтетической речи")
+    p.add_argument("--seconds", type=float, nargs="+", default=[3.0, 10.0, 30.0])
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--pipeline", choices=["two_hop", "one_shot"], default="two_hop")
+    p.add_argument("--upload-format", choices=list(ru2en.UPLOAD_FORMATS))
+    p.add_argument("--paste", action="store_true", help="вставка через PasteEngine на фейковой оконной системе")
+    p.add_argument("--incremental", action="store_true", help="вставка по предложениям (incremental_paste)")
+    p.add_argument("--stt-latency", type=float, default=0.25, help="базовая задержка STT, с")
+    p.add_argument("--stt-rtf", type=float, default=0.05, help="секунд обработки на секунду аудио")
+    p.add_argument("--upload-mbps", type=float, default=20.0)
+    p.add_argument("--chat-ttft", type=float, default=0.3, help="до первого токена, с")
+    p.add_argument("--chat-tps", type=float, default=80.0, help="токенов в секунду")
+    p.add_argument("--save-baseline", help="сохранить результат как базу для сравнения")
+    p.add_argument("--baseline", help="сравнить с базой; код выхода 1 при регрессии")
+    p.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление медианы (доля)")
+    p.add_argument("--min-ms", type=float, default=25.0, help="разница меньше — шум, не регрессия")
+    p.set_defaults(func=cmd_e2e)
+    p = sub.add_parser("startup", help="время импорта и холодного старта до активного хоткея")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--top", type=int, default=10, help="сколько самых тяжёлых импортов показать")
+    p.add_argument("--max-hotkey-ms", type=float, default=0, help="код выхода 1, если хоткей стартует дольше")
+    p.set_defaults(func=cmd_startup)
+    p = sub.add_parser("rtf", help="real-time factor движков STT (API и локальных)")
+    p.add_argument("--engines", nargs="+", default=["gpt-4o-mini-transcribe", "local:small"],
+                   help="значения stt_model; local:<размер> — faster-whisper на CPU")
+    p.add_argument("--wav", nargs="+", help="фикстуры WAV вместо синтетической речи")
+    p.add_argument("--seconds", type=float, nargs="+", default=[3.0, 10.0, 30.0])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--live", action="store_true", help="API-движки — к настоящему API (ключ из конфига)")
+    p.add_argument("--stt-latency", type=float, default=0.25, help="мок: базовая задержка STT, с")
+    p.add_argument("--stt-rtf", type=float, default=0.05, help="мок: секунд обработки на секунду аудио")
+    p.add_argument("--show-text", action="store_true", help="напечатать распознанный текст")
+    p.set_defaults(func=cmd_rtf)
+    args = ap.parse_args(argv)
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,57 @@
 # -*- coding: utf-8 -*-
-import os, json, time, re, queue, tempfile, platform, threading
+import os, io, sys, json, time, re, queue, shutil, asyncio, argparse, functools, importlib, subprocess, contextvars, sqlite3, hashlib, itertools, unicodedata, threading, random, abc
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
-import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import pyperclip
-from pynput.keyboard import Controller as KeyController, Key
-
-import tkinter as tk
-from tkinter import ttk, messagebox
+# -------- Lazy imports ----------
+class _LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту.
+
+    После загрузки подменяет себя в globals() настоящим модулем — горячие пути
+    не платят за прокси. Хоткей регистрируется до тяжёлых импортов (openai, numpy, звук).
+    """
+    def __init__(self, name: str, alias: str):
+        self._name, self._alias = name, alias
+
+    def _load(self):
+        mod = importlib.import_module(self._name)
+        globals()[self._alias] = mod
+        return mod
+
+    def __getattr__(self, item):
+        if item.startswith("__"): raise AttributeError(item)
+        return getattr(self._load(), item)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+np        = _LazyModule("numpy", "np")
+sd        = _LazyModule("sounddevice", "sd")
+sf        = _LazyModule("soundfile", "sf")
+pyperclip = _LazyModule("pyperclip", "pyperclip")
+keyboard  = _LazyModule("pynput.keyboard", "keyboard")
+openai    = _LazyModule("openai", "openai")
+
+def preload_modules(aliases=("openai", "np", "sf", "sd", "pyperclip", "keyboard")) -> threading.Thread:
+    """Догружает тяжёлые модули в фоне, чтобы первая запись не ждала импорта."""
+    def run():
+        for alias in aliases:
+            mod = globals().get(alias)
+            if isinstance(mod, _LazyModule):
+                try: mod._load()
+                except Exception as e: print(f"[WARN] import {mod._name}: {e}")
+    t = threading.Thread(target=run, name="ru2en-preload", daemon=True)
+    t.start()
+    return t
 
-from openai import OpenAI
+try:
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+except ImportError:     # пакетный режим и тесты работают без GUI
+    tk = ttk = messagebox = None
 
 # -------- WinAPI / pywin32 ----------
 import ctypes
@@ -33,26 +73,99 @@ AttachThreadInput = user32.AttachThreadInput if user32 else None
 GetGUIThreadInfo  = user32.GetGUIThreadInfo if user32 else None
 GetCursorPos      = user32.GetCursorPos if user32 else None
 ScreenToClient    = user32.ScreenToClient if user32 else None
+PostThreadMessageW = user32.PostThreadMessageW if user32 else None
+GetClipboardSequenceNumber = user32.GetClipboardSequenceNumber if user32 else None
 
 WM_HOTKEY = 0x0312
 WM_PASTE  = 0x0302
+WM_QUIT   = 0x0012
 MOD_CONTROL= 0x0002
 MOD_SHIFT  = 0x0004
 HK_ID = 1
+PYNPUT_HOTKEY = "<ctrl>+<space>"   # тот же Ctrl+Пробел для бэкендов на pynput
 
 # ------------ Config -------------
 CFG_PATH = Path.home() / "ru2en.json"
 DEFAULT_CFG = {
-    "stt_model": "gpt-4o-mini-transcribe",  # или "gpt-4o-transcribe"
+    "stt_model": "gpt-4o-mini-transcribe",  # или "gpt-4o-transcribe" | "local:small" (faster-whisper на CPU)
     "output_mode": "english",               # "english" | "russian"
     "style_model": "gpt-4o-mini",           # "gpt-4o-mini" | "gpt-5-mini" | "gpt-5-nano"
     "style_profile": "нейтральный",
+    "pipeline_mode": "two_hop",             # EN: "two_hop" (STT → LLM) | "one_shot" (сразу английский из аудио)
+    "translate_model": "whisper-1",         # модель /audio/translations для one_shot
     "auto_paste": True,                     # автопастить сразу
+    "incremental_paste": False,             # EN: вставлять перевод по предложениям по мере генерации
+    "translation_cache": True,              # кэшировать переводы повторяющихся фраз
+    "cache_max_entries": 512,               # LRU в памяти
+    "cache_max_disk_entries": 20000,        # записей в ru2en_cache.sqlite3
+    "cache_ttl_sec": 30 * 24 * 3600,
+    "cache_persist": True,                  # хранить кэш на диске рядом с конфигом
+    "stt_cache": True,                      # кэш STT по отпечатку аудио
     "global_hotkey_enabled": True,
     "openai_api_key": "",
+    "openai_base_url": "",                  # пусто — api.openai.com (или OPENAI_BASE_URL)
+    "openai_timeout_sec": 60.0,
+    "openai_max_retries": 2,                # повторы запроса при 429/5xx/обрыве (с backoff и jitter)
+    "stt_timeout_sec": 30.0,                # дедлайн одной попытки STT (для короткой записи)
+    "stt_timeout_per_audio_sec": 0.25,      # + столько секунд дедлайна на секунду аудио
+    "style_timeout_sec": 20.0,              # дедлайн попытки стиля; в потоке — до первого чанка и между чанками
+    "style_timeout_per_kchar_sec": 10.0,    # + столько секунд дедлайна на 1000 символов текста (без потока)
+    "retry_backoff_sec": 0.5,               # база экспоненциальной паузы между повторами
+    "retry_backoff_max_sec": 8.0,           # потолок паузы между повторами
+    "hedge_requests": False,                # после p95 задержки слать второй запрос и брать первый ответ
+    "hedge_min_samples": 20,                # замеров модели, после которых p95 считается надёжным
+    "stt_fallback_models": ["gpt-4o-mini-transcribe"],  # запасные STT-модели по порядку
+    "style_fallback_models": [],            # запасные модели стиля по порядку
+    "stream_usage": True,                   # просить usage в потоке (stream_options) — для метрик кэша промпта
+    "save_failed_audio": True,              # сохранять запись, если STT не удался
+    "local_stt_device": "cpu",              # локальный STT (stt_model "local:<размер или путь>"): "cpu" | "cuda"
+    "local_stt_compute_type": "int8",       # квантование CTranslate2: "int8" | "int8_float32" | "float32"
+    "local_stt_threads": 0,                 # потоков CPU на распознавание (0 — по числу ядер)
+    "local_stt_workers": 1,                 # сколько кусков распознаются локально одновременно
+    "local_stt_beam_size": 1,               # 1 — жадный поиск, быстрее всего
+    "local_stt_language": "ru",             # язык речи (пусто — автоопределение)
+    "local_stt_model_dir": "",              # куда скачивать модели (пусто — кэш Hugging Face)
+    "speculative_translation": False,       # при stream_stt переводить готовые предложения, пока идёт запись
+    "parallel_translation": False,          # длинный текст переводить группами предложений параллельно
+    "translate_group_chars": 600,           # примерный размер группы предложений, символов
+    "translate_concurrency": 4,             # сколько групп переводятся одновременно
+    "translate_context_sentences": 2,       # предыдущих предложений в контексте группы
+    "local_mt_model": "",                   # папка Marian/OPUS-MT ru→en в формате CTranslate2 (пусто — только LLM)
+    "local_mt_styles": ["нейтральный"],     # стили, которые переводит локальная модель; прочие — LLM
+    "local_mt_threads": 0,                  # потоков CPU на перевод (0 — по числу ядер)
+    "local_mt_batch_size": 32,              # предложений в одном батче
+    "local_mt_beam_size": 2,
+    "openai_keepalive_sec": 120.0,          # сколько держать простаивающее соединение
+    "prewarm_connection": True,             # поднимать TLS-соединение заранее (старт и начало записи)
     "sample_rate": 16000,
     "channels": 1,
-    "dtype": "int16"
+    "dtype": "int16",
+    "upload_format": "flac",                # "flac" | "ogg" (Opus) | "wav" — формат загрузки в STT
+    "stream_stt": False,                    # распознавать сегментами прямо во время записи
+    "stream_segment_sec": 8.0,              # целевая длина сегмента для стримингового STT
+    "stt_chunk_sec": 300.0,                 # длинная запись режется на куски не длиннее (в тишине)
+    "stt_max_upload_mb": 24,                # лимит размера одной загрузки в STT (API — 25 МБ)
+    "stt_chunk_overlap_sec": 1.0,           # перекрытие кусков, если тишины на границе нет
+    "stt_chunk_concurrency": 4,             # сколько кусков распознаются одновременно
+    "buffer_initial_sec": 60,               # предвыделенный объём буфера записи (растёт при нехватке)
+    "prearm_stream": False,                 # держать микрофон открытым: старт записи без открытия устройства
+    "prearm_preroll_sec": 0.3,              # сколько звука до нажатия хоткея попадает в запись
+    "prearm_idle_sec": 120.0,               # закрыть устройство после стольких секунд без записи
+    "max_parallel_jobs": 2,                 # сколько записей обрабатываются одновременно
+    "job_deadline_sec": 180.0,              # предел на обработку одной записи (STT + стиль)
+    "paste_focus_timeout_sec": 0.5,         # дедлайн ожидания окна/фокуса перед Ctrl+V
+    "paste_clipboard_timeout_sec": 0.3,     # дедлайн ожидания смены буфера обмена
+    "paste_profiles": True,                 # запоминать тайминги вставки по приложениям
+    "input_backend": "auto",                # "auto" | "win32" | "x11" (pynput + xdotool) | "clipboard"
+    "batch_concurrency": 4,                 # параллельных файлов в `python -m ru2en batch`
+    "metrics_dump_path": "",                # файл метрик после каждого задания: .json или .prom (Prometheus)
+    "metrics_port": 0,                      # >0 — http://127.0.0.1:<порт>/metrics и /metrics.json
+    "vad_trim": True,                       # обрезать тишину по краям и сжимать длинные паузы
+    "vad_on_rms": 300,                      # порог RMS начала речи (int16)
+    "vad_off_rms": 150,                     # порог RMS конца речи (гистерезис)
+    "vad_min_speech_sec": 0.12,             # короче — щелчок/шум, а не речь
+    "vad_max_pause_sec": 0.6,               # внутренние паузы длиннее сжимаются до этой длины
+    "vad_pad_sec": 0.15,                    # запас тишины вокруг речи
 }
 def load_cfg():
     if CFG_PATH.exists():
@@ -71,65 +184,1176 @@ CFG = load_cfg()
 
 # ------------ Globals -------------
 SAMPLE_RATE = int(CFG["sample_rate"]); CHANNELS = int(CFG["channels"]); DTYPE = CFG["dtype"]
-recording_flag = threading.Event()
-audio_q = queue.Queue()
-frames = []
-kb = KeyController()
+_kb = None
+
+def get_kb():
+    global _kb
+    if _kb is None: _kb = keyboard.Controller()
+    return _kb
+_active_job = None          # RecordingJob, которая сейчас пишет звук
+_jobs_lock = threading.Lock()
 
 ROOT = None
 GUI_HWND = None
 _last_window_hwnd = None    # окно чата на старте записи (через хоткей)
-_last_focus_hwnd  = None    # конкретный контрол для вставки (если нашли)
 _last_text = ""
+_last_clip = None           # {"raw", "pipeline", "window_hwnd"} последней записи — для «перестилизовать»
 
 _hotkey_thread = None
+_hotkey_tid = None          # поток цикла сообщений WinAPI (для WM_QUIT при остановке)
 _hotkey_stop_evt = threading.Event()
 
 # ------------ Audio --------------
-def sd_callback(indata, frames_count, time_info, status):
-    if status: pass
-    audio_q.put(bytes(indata))
-
-def start_recording(status_cb=None):
-    """Старт записи. Хоткей уже сохранил активный hwnd чата в _last_window_hwnd."""
-    global frames
-    frames = []
-    while not audio_q.empty():
-        try: audio_q.get_nowait()
-        except queue.Empty: break
-    recording_flag.set()
+class AudioBuffer:
+    """Предвыделенный растущий буфер int16 для записи.
+
+    Аудиоколбэк пишет блоки прямо в общий массив (одна копия из буфера драйвера),
+    потребители получают view без копирования. При нехватке места массив растёт в 1.5 раза.
+    Уже выданные view остаются валидными: они держат ссылку на прежний массив.
+
+    stop() будит поток записи, но запись ещё принимается: блоки, которые драйвер отдаёт
+    при остановке потока, не теряются. close() — после остановки потока.
+    """
+    def __init__(self, initial_sec: float = 60.0, sr: int = None):
+        self._initial = max(1, int(initial_sec * (sr or SAMPLE_RATE) * CHANNELS))
+        self._data = np.empty(self._initial, dtype=np.int16)
+        self._len = 0           # сэмплов в _data
+        self._base = 0          # абсолютный индекс _data[0] (после discard)
+        self._stopping = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def write(self, block):
+        n = len(block)
+        with self._cond:
+            if self._closed: return
+            end = self._len + n
+            if end > len(self._data):
+                grown = np.empty(max(end, int(len(self._data) * 1.5)), dtype=np.int16)
+                grown[:self._len] = self._data[:self._len]
+                self._data = grown
+            self._data[self._len:end] = block
+            self._len = end
+            self._cond.notify_all()
+
+    def __len__(self):
+        """Всего записано сэмплов (с учётом отброшенных) — позиции абсолютные."""
+        return self._base + self._len
+
+    @property
+    def start(self) -> int:
+        """Первый ещё хранимый абсолютный сэмпл."""
+        return self._base
+
+    def view(self, start: int = None, end: int = None):
+        """Срез записанного аудио без копирования (только для чтения). Позиции абсолютные."""
+        with self._cond:
+            lo = max(0, (self._base if start is None else start) - self._base)
+            hi = self._len if end is None else max(lo, min(end - self._base, self._len))
+            v = self._data[lo:hi]
+        v.flags.writeable = False
+        return v
+
+    def discard(self, upto: int):
+        """Отбрасывает аудио до абсолютной позиции upto: память длинной записи не растёт.
+
+        Хвост копируется в новый массив — выданные ранее view остаются валидными.
+        """
+        with self._cond:
+            k = min(max(0, upto - self._base), self._len)
+            if not k: return
+            rest = self._len - k
+            data = np.empty(max(self._initial, int(rest * 1.5)), dtype=np.int16)
+            data[:rest] = self._data[k:self._len]
+            self._data, self._len, self._base = data, rest, self._base + k
+
+    def wait_for(self, n: int) -> bool:
+        """Ждёт, пока в буфере наберётся n сэмплов; False — запись остановлена раньше."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self) >= n or self._stopping or self._closed)
+            return len(self) >= n
+
+    def wait_stopped(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopping or self._closed)
+
+    def stop(self):
+        """Просьба остановить запись; хвост от драйвера ещё дописывается до close()."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+class ArmedInput:
+    """Постоянно открытый входной поток с кольцом pre-roll.
+
+    Хоткей не открывает устройство, а подключает буфер задания: в него сразу копируются
+    последние preroll_sec из кольца, дальше колбэк пишет прямо в буфер. Без записи колбэк
+    только обновляет кольцо; после idle_sec простоя устройство закрывается.
+    """
+    def __init__(self, preroll_sec: float = 0.3, idle_sec: float = 120.0, sr: int = None):
+        self.sr = sr or SAMPLE_RATE
+        self._ring = np.zeros(max(1, int(preroll_sec * self.sr * CHANNELS)), dtype=np.int16)
+        self._ring_pos = 0
+        self._ring_filled = 0
+        self.idle_sec = idle_sec
+        self._target = None
+        self._stream = None
+        self._lock = threading.Lock()
+        self._blocks = threading.Condition(self._lock)     # сигнал «колбэк отдал блок»
+        self._block_count = 0
+        self._open_lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._timer = None
+
+    def _callback(self, indata, frames_count, time_info, status):
+        block = np.frombuffer(indata, dtype=np.int16)
+        with self._lock:
+            target = self._target
+            if target is None:
+                self._push_ring(block)
+        if target is not None:
+            target.write(block)     # после close() AudioBuffer сам игнорирует запись
+        with self._lock:
+            self._block_count += 1
+            self._blocks.notify_all()
+
+    def _push_ring(self, block):
+        n = len(self._ring)
+        if len(block) >= n:
+            self._ring[:] = block[-n:]; self._ring_pos = 0
+        else:
+            end = self._ring_pos + len(block)
+            if end <= n:
+                self._ring[self._ring_pos:end] = block
+            else:
+                k = n - self._ring_pos
+                self._ring[self._ring_pos:] = block[:k]; self._ring[:end - n] = block[k:]
+            self._ring_pos = end % n
+        self._ring_filled = min(n, self._ring_filled + len(block))
+
+    def _ring_snapshot(self):
+        if self._ring_filled < len(self._ring):
+            return self._ring[:self._ring_filled].copy()
+        return np.concatenate((self._ring[self._ring_pos:], self._ring[:self._ring_pos]))
+
+    def preroll(self):
+        """Копия последних сэмплов кольца в хронологическом порядке."""
+        with self._lock:
+            return self._ring_snapshot()
+
+    @property
+    def is_open(self) -> bool:
+        return self._stream is not None
+
+    def open(self):
+        """Открывает устройство, если закрыто (100–300 мс один раз, а не на каждое нажатие)."""
+        with self._open_lock:
+            if self._stream is not None:
+                return
+            t0 = time.perf_counter()
+            # колбэк берёт _lock, поэтому устройство стартуем без него
+            stream = sd.RawInputStream(samplerate=self.sr, blocksize=0, dtype=DTYPE,
+                                       channels=CHANNELS, callback=self._callback)
+            stream.start()
+            self._stream = stream
+        METRICS.observe("rec_open", (time.perf_counter() - t0) * 1000)
+        self._schedule_idle()
+
+    def close(self):
+        with self._open_lock:
+            with self._lock:
+                stream, self._stream, self._target = self._stream, None, None
+                self._ring_filled = self._ring_pos = 0
+                if self._timer: self._timer.cancel(); self._timer = None
+            if stream is not None:
+                try: stream.stop(); stream.close()
+                except Exception: pass
+
+    def attach(self, buf: AudioBuffer):
+        """Начало записи: pre-roll в буфер и переключение колбэка на него."""
+        self.open()
+        with self._lock:
+            buf.write(self._ring_snapshot())
+            self._ring_filled = self._ring_pos = 0
+            self._target = buf
+
+    def detach(self, buf: AudioBuffer, drain_sec: float = 0.1):
+        """Конец записи. Ждём ещё один блок колбэка: в нём звук, который драйвер держал в момент стопа."""
+        with self._lock:
+            if self._target is buf and self._stream is not None and drain_sec:
+                seen = self._block_count
+                self._blocks.wait_for(lambda: self._block_count > seen or self._stream is None, drain_sec)
+            if self._target is buf: self._target = None
+            self._last_used = time.monotonic()
+        self._schedule_idle()
+
+    def _schedule_idle(self):
+        if not self.idle_sec:
+            return
+        with self._lock:
+            if self._timer: self._timer.cancel()
+            self._timer = threading.Timer(self.idle_sec, self._idle_check)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _idle_check(self):
+        with self._lock:
+            busy = self._target is not None or time.monotonic() - self._last_used < self.idle_sec * 0.99
+        if busy:
+            self._schedule_idle()
+        else:
+            self.close()
+
+_armed_input = None
+
+def get_armed_input():
+    """Общий pre-armed поток, если включён prearm_stream; иначе None."""
+    global _armed_input
+    if not CFG.get("prearm_stream"):
+        return None
+    if _armed_input is None:
+        _armed_input = ArmedInput(float(CFG.get("prearm_preroll_sec", 0.3)), float(CFG.get("prearm_idle_sec", 120.0)))
+    return _armed_input
+
+def arm_input():
+    """Открывает pre-armed поток заранее (старт приложения), чтобы первое нажатие уже было с pre-roll."""
+    armed = get_armed_input()
+    if armed is None:
+        return
+    try: armed.open()
+    except Exception as e: print(f"[WARN] pre-armed поток: {e}")
+
+def _record_until_stopped(buf, streamer):
+    # спим до стопа (buf.stop()); в стриминге просыпаемся на каждый готовый сегмент
+    if streamer:
+        while buf.wait_for(streamer.next_cut_at):
+            streamer.pump()
+    else:
+        buf.wait_stopped()
+
+def start_recording(status_cb=None, job=None):
+    """Запись в буфер задания до его остановки. Окно чата уже сохранено в job.window_hwnd."""
+    job = job or RecordingJob(status_cb=status_cb)
+    buf = job.buffer
+    transcribe = functools.partial(stt_pcm_async, pipeline=job.pipeline)
+    # без стриминга — нарезка длинной записи по лимиту STT: обычная фраза до него не доходит
+    limit = chunk_limit_sec()
+    segment = float(CFG.get("stream_segment_sec", 8.0)) if CFG.get("stream_stt") else limit
+    streamer = job.streamer = StreamingSTT(buf, min(segment, limit), transcribe, discard_after_sec=limit)
+    if speculation_enabled(job.pipeline):
+        job.speculation = SpeculativeTranslation(CFG["style_profile"])
+        streamer.on_text = job.speculation.update
+
+    def callback(indata, frames_count, time_info, status):
+        buf.write(np.frombuffer(indata, dtype=np.int16))
+
+    armed = get_armed_input()
     try:
-        with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=0, dtype=DTYPE,
-                               channels=CHANNELS, callback=sd_callback):
-            if status_cb: status_cb("Запись… Говорите по-русски. Ещё раз Ctrl+Пробел — стоп.")
-            while recording_flag.is_set():
-                try:
-                    frames.append(np.frombuffer(audio_q.get(timeout=0.1), dtype=np.int16))
-                except queue.Empty:
-                    pass
+        if armed is not None:
+            armed.attach(buf)
+            try:
+                if status_cb: status_cb("Запись… Говорите по-русски. Ещё раз Ctrl+Пробел — стоп.")
+                _record_until_stopped(buf, streamer)
+            finally:
+                armed.detach(buf)
+        else:
+            t0 = time.perf_counter()
+            with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=0, dtype=DTYPE,
+                                   channels=CHANNELS, callback=callback):
+                METRICS.observe("rec_open", (time.perf_counter() - t0) * 1000)
+                if status_cb: status_cb("Запись… Говорите по-русски. Ещё раз Ctrl+Пробел — стоп.")
+                _record_until_stopped(buf, streamer)
     except Exception as e:
         if status_cb: status_cb(f"[ERR] Аудио: {e}")
+    finally:
+        buf.close()
+        job.rec_done.set()
+    return job
 
 def save_wav(np_audio, path):
     sf.write(path, np_audio, SAMPLE_RATE, subtype="PCM_16")
 
+def failed_audio_dir():
+    return CFG_PATH.with_name("ru2en_failed")
+
+def save_failed_audio(audio_np):
+    """Сохраняет запись, которую не удалось распознать, чтобы её можно было отправить заново.
+    Возвращает путь или None."""
+    if not CFG.get("save_failed_audio", True) or audio_np is None or not len(audio_np):
+        return None
+    try:
+        d = failed_audio_dir()
+        d.mkdir(parents=True, exist_ok=True)
+        path = d / time.strftime("ru2en_%Y%m%d_%H%M%S.wav")
+        n = itertools.count(1)
+        while path.exists():
+            path = d / time.strftime(f"ru2en_%Y%m%d_%H%M%S_{next(n)}.wav")
+        save_wav(audio_np, str(path))
+        return path
+    except Exception as e:
+        print(f"[WARN] Не удалось сохранить запись: {e}")
+        return None
+
+# формат → (контейнер soundfile, подтип, имя файла для API)
+UPLOAD_FORMATS = {
+    "wav":  ("WAV",  "PCM_16", "audio.wav"),
+    "flac": ("FLAC", "PCM_16", "audio.flac"),
+    "ogg":  ("OGG",  "OPUS",   "audio.ogg"),
+}
+
+def encode_audio(np_audio, fmt: str = None, sr: int = None):
+    """Кодирует PCM int16 в памяти. Возвращает (имя файла, байты) для загрузки в API.
+
+    Если libsndfile не умеет выбранный формат (например, собран без Opus), откатываемся на WAV.
+    """
+    fmt = (fmt or CFG.get("upload_format") or "flac").lower()
+    if fmt not in UPLOAD_FORMATS or not sf.check_format(*UPLOAD_FORMATS[fmt][:2]):
+        fmt = "wav"
+    container, subtype, name = UPLOAD_FORMATS[fmt]
+    bio = io.BytesIO()
+    sf.write(bio, np_audio, sr or SAMPLE_RATE, format=container, subtype=subtype)
+    return name, bio.getvalue()
+
+# ------------ VAD -------------
+VAD_FRAME_SEC = 0.02
+
+def frame_rms(audio_np, hop: int):
+    """RMS неперекрывающихся кадров по hop сэмплов (хвост короче кадра отбрасывается)."""
+    n = len(audio_np) // hop
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    x = audio_np[:n * hop].astype(np.float32).reshape(n, hop)
+    return np.sqrt(np.einsum("ij,ij->i", x, x) / hop)
+
+def vad_segments(audio_np, sr: int = None):
+    """Участки речи [(start_sec, end_sec), ...] по RMS кадров с гистерезисом.
+
+    Речь начинается, когда RMS кадра выше vad_on_rms, и длится, пока он не опустится ниже
+    vad_off_rms. Пороги поднимаются над шумовым полом записи. Участки короче
+    vad_min_speech_sec (щелчки) отбрасываются.
+    """
+    sr = sr or SAMPLE_RATE
+    hop = max(1, int(VAD_FRAME_SEC * sr))
+    rms = frame_rms(audio_np, hop)
+    if rms.size == 0:
+        return []
+    base_on, base_off = float(CFG.get("vad_on_rms", 300)), float(CFG.get("vad_off_rms", 150))
+    # шумовой пол поднимает пороги, но не выше 4× базовых: иначе речь без пауз сама станет «шумом»
+    floor = float(np.percentile(rms, 10))
+    on = max(base_on, min(floor * 3.0, base_on * 4))
+    off = min(on, max(base_off, min(floor * 1.8, base_off * 4)))
+
+    # гистерезис без цикла: состояние = последнее «событие» (выше on → 1, ниже off → 0)
+    ev = np.full(rms.size, -1, dtype=np.int8)
+    ev[rms < off] = 0
+    ev[rms >= on] = 1
+    last = np.maximum.accumulate(np.where(ev >= 0, np.arange(rms.size), 0))
+    active = ev[last] == 1
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    keep = (ends - starts) * hop >= float(CFG.get("vad_min_speech_sec", 0.12)) * sr
+    return [(s * hop / sr, e * hop / sr) for s, e in zip(starts[keep], ends[keep])]
+
+def trim_silence(audio_np, sr: int = None):
+    """Обрезает тишину по краям и сжимает длинные паузы.
+
+    Возвращает (audio, segments): аудио для отправки и участки речи с отметками
+    времени исходной записи. Пустой список участков — в записи нет речи.
+    """
+    sr = sr or SAMPLE_RATE
+    segs = vad_segments(audio_np, sr)
+    if not segs:
+        return audio_np[:0], []
+    pad = int(float(CFG.get("vad_pad_sec", 0.15)) * sr)
+    max_pause = int(float(CFG.get("vad_max_pause_sec", 0.6)) * sr)
+    pieces, cur_s, cur_e = [], None, None
+    for s, e in segs:
+        s = max(0, int(s * sr) - pad); e = min(len(audio_np), int(e * sr) + pad)
+        if cur_e is not None and s - cur_e <= max_pause:
+            cur_e = max(cur_e, e); continue
+        if cur_e is not None:
+            pieces.append((cur_s, cur_e))
+        cur_s, cur_e = s, e
+    pieces.append((cur_s, cur_e))
+    if len(pieces) == 1:
+        s, e = pieces[0]
+        return audio_np[s:e], segs
+    # длинную паузу оставляем длиной max_pause: её края у соседних кусков уже есть (pad)
+    gap = np.zeros(max(0, max_pause - 2 * pad), dtype=audio_np.dtype)
+    out = []
+    for i, (s, e) in enumerate(pieces):
+        if i: out.append(gap)
+        out.append(audio_np[s:e])
+    return np.concatenate(out), segs
+
+# ------------ Async core -------------
+class PipelineLoop:
+    """Один поток с event loop: STT и стиль всех заданий идут здесь корутинами.
+
+    Хоткей, GUI и пакетный режим отдают сюда задания через submit(); run() — синхронная
+    обёртка для потоков вне цикла. Параллелизм заданий ограничен семафором max_parallel_jobs.
+    """
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._slots = None
+        self._slots_n = 0
+        self._futures = set()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+                self._thread = threading.Thread(target=run, name="ru2en-loop", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        """Запускает корутину на цикле; возвращает concurrent.futures.Future (можно отменить)."""
+        fut = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        self._futures.add(fut)
+        fut.add_done_callback(self._futures.discard)
+        return fut
+
+    def run(self, coro, timeout: float = None):
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("PIPELINE.run() из потока event loop — используйте await.")
+        return self.submit(coro).result(timeout)
+
+    def slots(self) -> asyncio.Semaphore:
+        """Семафор заданий (создаётся в потоке цикла; пересоздаётся при смене лимита)."""
+        n = max(1, int(CFG.get("max_parallel_jobs", 2)))
+        if self._slots is None or self._slots_n != n:
+            self._slots, self._slots_n = asyncio.Semaphore(n), n
+        return self._slots
+
+    @property
+    def active(self) -> int:
+        return len(self._futures)
+
+    def cancel_all(self) -> int:
+        return sum(1 for f in list(self._futures) if f.cancel())
+
+    def stop(self):
+        self.cancel_all()
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._loop = None
+
+PIPELINE = PipelineLoop()
+
+# ------------ Metrics -------------
+LAST_TIMINGS = {}   # этап → мс для последней обработки
+# мс по этапам текущего задания: вложенные этапы (encode, paste_keys, …) пишутся сюда
+# и из asyncio.to_thread — контекст копируется в поток
+_stage_timings = contextvars.ContextVar("ru2en_stage_timings", default=None)
+
+class Metrics:
+    """Гистограммы длительности этапов по (этап, модель) и счётчики заданий/аудио.
+
+    Перцентили считаются по последним WINDOW замерам серии, корзины — за всё время
+    (формат гистограммы Prometheus).
+    """
+    BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    WINDOW = 1000
+    QUANTILES = (50, 95, 99)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}       # (stage, model) → {"count", "sum", "buckets", "recent"}
+        self._counters = {}     # (name, ((label, value), …)) → число
+        self.last = {}          # этапы последнего задания
+        self.last_label = ""
+        self.runs = 0
+
+    def observe(self, stage: str, ms: float, model: str = ""):
+        with self._lock:
+            s = self._series.get((stage, model))
+            if s is None:
+                s = self._series[(stage, model)] = {"count": 0, "sum": 0.0, "buckets": [0] * len(self.BUCKETS_MS),
+                                                    "recent": deque(maxlen=self.WINDOW)}
+            s["count"] += 1; s["sum"] += ms
+            s["recent"].append(ms)
+            for i, b in enumerate(self.BUCKETS_MS):
+                if ms <= b: s["buckets"][i] += 1
+
+    def series(self, stage: str, model: str = ""):
+        """Копия серии {"count", "recent"} или None — для решений по перцентилям (хеджирование)."""
+        with self._lock:
+            s = self._series.get((stage, model))
+            return None if s is None else {"count": s["count"], "recent": list(s["recent"])}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def finish_run(self, timings: dict, label: str, status: str = "ok"):
+        """Итог задания: total/first_text в гистограммы, счётчик заданий, «последний запуск» для GUI."""
+        for stage in ("total", "first_text"):
+            if stage in timings: self.observe(stage, timings[stage])
+        self.inc("jobs_total", pipeline=label, status=status)
+        self.last, self.last_label = dict(timings), label
+        self.runs += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {}
+            for (stage, model), s in sorted(self._series.items()):
+                q = np.percentile(np.fromiter(s["recent"], float), self.QUANTILES) if s["recent"] else [0.0] * 3
+                stages.setdefault(stage, {})[model or "-"] = {
+                    "count": s["count"], "sum_ms": round(s["sum"], 1),
+                    **{f"p{p}_ms": round(float(v), 1) for p, v in zip(self.QUANTILES, q)}}
+            counters = {}
+            for (name, labels), v in sorted(self._counters.items()):
+                tag = ",".join(f"{k}={val}" for k, val in labels)
+                counters.setdefault(name, {})[tag or "-"] = round(v, 3)
+        return {"runs": self.runs, "stages": stages, "counters": counters,
+                "last": {"label": self.last_label, **{k: round(v, 1) for k, v in self.last.items()}}}
+
+    def to_prometheus(self) -> str:
+        def lbl(**kv):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in kv.items() if v != "") + "}"
+        h, q = "ru2en_stage_duration_seconds", "ru2en_stage_duration_quantile_seconds"
+        lines = [f"# HELP {h} Длительность этапов обработки.", f"# TYPE {h} histogram"]
+        quant = [f"# HELP {q} Перцентили по последним {self.WINDOW} замерам.", f"# TYPE {q} gauge"]
+        with self._lock:
+            for (stage, model), s in sorted(self._series.items()):
+                for b, n in zip(self.BUCKETS_MS, s["buckets"]):
+                    lines.append(f"{h}_bucket{lbl(stage=stage, model=model, le=b / 1000)} {n}")
+                lines.append(f"{h}_bucket{lbl(stage=stage, model=model, le='+Inf')} {s['count']}")
+                lines.append(f"{h}_sum{lbl(stage=stage, model=model)} {s['sum'] / 1000:.6f}")
+                lines.append(f"{h}_count{lbl(stage=stage, model=model)} {s['count']}")
+                if s["recent"]:
+                    vals = np.percentile(np.fromiter(s["recent"], float), self.QUANTILES)
+                    for p, v in zip(self.QUANTILES, vals):
+                        quant.append(f"{q}{lbl(stage=stage, model=model, quantile=p / 100)} {v / 1000:.6f}")
+            counters = sorted(self._counters.items())
+        lines += quant
+        seen = set()
+        for (name, labels), v in counters:
+            if name not in seen:
+                seen.add(name); lines.append(f"# TYPE ru2en_{name} counter")
+            lines.append(f"ru2en_{name}{lbl(**dict(labels))} {v:g}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """JSON или Prometheus text (по расширению .prom/.txt); запись атомарная."""
+        path = Path(path).expanduser()
+        body = self.to_prometheus() if path.suffix in (".prom", ".txt") else \
+            json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(body, encoding="utf-8")
+        os.replace(tmp, path)
+
+METRICS = Metrics()
+
+@contextmanager
+def _timed(timings, stage: str, model: str = "", only_ok: bool = False):
+    """Замер этапа: в словарь задания (None — в текущий _stage_timings) и в METRICS.
+
+    only_ok=True — упавшие и отменённые попытки не пишутся: по этим сериям решает хеджирование.
+    """
+    timings = _stage_timings.get() if timings is None else timings
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        if ok or not only_ok:
+            ms = (time.perf_counter() - t0) * 1000
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + ms
+            METRICS.observe(stage, ms, model)
+
+def format_timings(timings: dict) -> str:
+    return " ".join(f"{k}={v:.0f}ms" for k, v in timings.items())
+
+def _record_run(timings: dict, label: str, status: str = "ok"):
+    LAST_TIMINGS.clear(); LAST_TIMINGS.update(timings)
+    METRICS.finish_run(timings, label, status)
+    print(f"[TIME] {label}: {format_timings(timings)}")
+    dump = CFG.get("metrics_dump_path")
+    if dump:
+        try: METRICS.dump(dump)
+        except OSError as e: print(f"[WARN] metrics dump: {e}")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, ctype = json.dumps(METRICS.snapshot(), ensure_ascii=False).encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, ctype = METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404); return
+        self.send_response(200)
+        self.send_header("Content-Type", f"{ctype}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+_metrics_server = None
+
+def start_metrics_server(port: int = None):
+    """Локальный HTTP: /metrics (Prometheus) и /metrics.json. Порт 0/пусто в конфиге — выключено;
+    явный port=0 — свободный порт от ОС (см. server.server_address)."""
+    global _metrics_server
+    if _metrics_server is not None:
+        return _metrics_server
+    if port is None:
+        port = int(CFG.get("metrics_port", 0) or 0)
+        if not port:
+            return None
+    try:
+        _metrics_server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    except OSError as e:
+        print(f"[WARN] metrics server :{port}: {e}")
+        return None
+    threading.Thread(target=_metrics_server.serve_forever, name="ru2en-metrics", daemon=True).start()
+    return _metrics_server
+
+def stop_metrics_server():
+    global _metrics_server
+    if _metrics_server is not None:
+        _metrics_server.shutdown(); _metrics_server.server_close()
+        _metrics_server = None
+
 # ------------ OpenAI -------------
-def get_client():
-    key = (CFG.get("openai_api_key") or os.getenv("OPENAI_API_KEY") or "").strip()
+_clients = {}                   # (key, base_url) → клиент; один пул соединений на процесс
+_clients_lock = threading.Lock()
+_last_prewarm = 0.0
+PREWARM_MIN_INTERVAL = 15.0
+
+def _api_key() -> str:
+    return (CFG.get("openai_api_key") or os.getenv("OPENAI_API_KEY") or "").strip()
+
+def _base_url():
+    return (CFG.get("openai_base_url") or os.getenv("OPENAI_BASE_URL") or "").strip() or None
+
+def _http_client():
+    """httpx-клиент с долгим keep-alive; None — оставляем openai его собственный пул."""
+    try:
+        import httpx
+        from openai import DefaultAsyncHttpxClient
+        limits = httpx.Limits(max_connections=20, max_keepalive_connections=10,
+                              keepalive_expiry=float(CFG.get("openai_keepalive_sec", 120.0)))
+        return DefaultAsyncHttpxClient(limits=limits)
+    except Exception:
+        return None
+
+def get_async_client():
+    """Общий AsyncOpenAI для ключа и base_url: соединения и TLS переиспользуются между вызовами.
+
+    Использовать только в потоке PIPELINE. Повторы делает call_with_policy, у клиента они выключены.
+    """
+    key = _api_key()
     if not key:
         raise RuntimeError("Не задан OpenAI API ключ. Введите его.")
-    return OpenAI(api_key=key)
+    ck = (key, _base_url())
+    with _clients_lock:
+        client = _clients.get(ck)
+        if client is None:
+            client = _clients[ck] = openai.AsyncOpenAI(
+                api_key=key, base_url=ck[1],
+                timeout=float(CFG.get("openai_timeout_sec", 60.0)),
+                max_retries=0, http_client=_http_client())
+    return client
+
+def invalidate_clients():
+    """Сбрасывает кэш клиентов (смена ключа). Старые клиенты не закрываем: в них могут идти запросы."""
+    with _clients_lock:
+        _clients.clear()
+
+def prewarm_client():
+    """В фоне создаёт клиент и открывает соединение к API, пока пользователь ещё говорит."""
+    global _last_prewarm
+    if not CFG.get("prewarm_connection", True) or not _api_key():
+        return
+    now = time.monotonic()
+    if now - _last_prewarm < PREWARM_MIN_INTERVAL:
+        return
+    _last_prewarm = now
+    async def run():
+        try: await get_async_client().with_options(max_retries=0, timeout=5.0).models.list()
+        except Exception: pass
+    PIPELINE.submit(run())
 
 CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
 def looks_like_russian(text: str) -> bool:
     return bool(CYRILLIC_RE.search(text))
 
-def stt_transcribe(path: str) -> str:
-    client = get_client()
-    model = CFG["stt_model"]
-    with open(path, "rb") as f:
-        r = client.audio.transcriptions.create(file=f, model=model)
-    return (r.text or "").strip()
+# ------------ Request policy -------------
+RETRY_STATUS = {408, 409, 429}          # плюс все 5xx
+FALLBACK_STATUS = {403, 404}            # модель недоступна ключу — сразу следующая
+
+def _status_of(e) -> int:
+    return int(getattr(e, "status_code", 0) or 0)
+
+def is_retryable(e) -> bool:
+    """429/5xx, обрыв соединения и таймаут попытки — повторяем; 400/401 и прочее — нет."""
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    status = _status_of(e)
+    if status:
+        return status in RETRY_STATUS or status >= 500
+    return isinstance(e, openai.APIConnectionError)
+
+def backoff_delay(attempt: int, e=None) -> float:
+    """Пауза перед повтором: Retry-After сервера или экспонента с полным jitter."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    cap = float(CFG.get("retry_backoff_max_sec", 8.0))
+    if retry_after is not None:
+        return min(max(retry_after, 0.0), cap)
+    base = float(CFG.get("retry_backoff_sec", 0.5))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def hedge_delay(stage: str, model: str):
+    """Через сколько секунд слать дублирующий запрос: p95 этапа по модели, None — не хеджировать."""
+    if not CFG.get("hedge_requests"):
+        return None
+    s = METRICS.series(stage, model)
+    if s is None or s["count"] < int(CFG.get("hedge_min_samples", 20)):
+        return None
+    return float(np.percentile(np.fromiter(s["recent"], float), 95)) / 1000
+
+async def _hedged(make, delay, stage: str):
+    """Первая попытка; если она не ответила за delay — вторая параллельно, берём первый успех."""
+    first = asyncio.ensure_future(make())
+    if delay is None:
+        return await first
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            METRICS.inc("hedged_requests_total", stage=stage)
+            tasks.add(asyncio.ensure_future(make()))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                error = t.exception()
+        raise error
+    finally:
+        for t in tasks: t.cancel()
+
+def _stage_error(stage: str, e):
+    """Таймаут попытки → ошибка этапа: иначе его примут за дедлайн всего задания."""
+    if isinstance(e, asyncio.TimeoutError):
+        return RuntimeError(f"{stage}: нет ответа вовремя")
+    return e
+
+async def iter_with_deadline(stream, gap: float):
+    """Чанки потока: до первого и между соседними — не дольше gap секунд (None — без предела)."""
+    it = stream.__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(it.__anext__(), gap or None)
+        except StopAsyncIteration:
+            return
+        yield chunk
+
+async def call_with_policy(stage: str, models, call, timeout: float, hedge: bool = True, retry_if=None):
+    """Запрос к API по политике: дедлайн на попытку, повторы с backoff на 429/5xx/обрывах,
+    хеджирование после p95 и переход по цепочке моделей.
+
+    call(model) — корутина одной попытки; timeout — секунды или функция model → секунды/None.
+    retry_if() → False запрещает повтор
+    (например, поток уже отдал часть текста).
+    """
+    attempts = 1 + max(0, int(CFG.get("openai_max_retries", 2)))
+    models = list(dict.fromkeys(m for m in models if m))
+    error = None
+    for i, model in enumerate(models):
+        if i:
+            METRICS.inc("fallback_total", stage=stage, model=model)
+            print(f"[WARN] {stage}: переход на запасную модель {model}")
+        limit = timeout(model) if callable(timeout) else timeout
+        make = lambda model=model, limit=limit: asyncio.wait_for(call(model), limit or None)
+        for attempt in range(attempts):
+            try:
+                return await _hedged(make, hedge_delay(stage, model) if hedge else None, stage)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                if retry_if is not None and not retry_if():
+                    raise _stage_error(stage, e) from e
+                if not is_retryable(e) or attempt + 1 == attempts:
+                    break
+                METRICS.inc("retries_total", stage=stage, model=model)
+                await asyncio.sleep(backoff_delay(attempt, e))
+        if not (is_retryable(error) or _status_of(error) in FALLBACK_STATUS):
+            break
+    raise _stage_error(stage, error) from error
+
+# ------------ Transcribers -------------
+class SttInput:
+    """Аудио одного запроса STT. Для загрузки кодируется один раз на все попытки и модели."""
+    def __init__(self, audio_np, sr: int = None):
+        self.audio, self.sr = audio_np, sr or SAMPLE_RATE
+        self._file = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / self.sr
+
+    async def upload(self):
+        async with self._lock:
+            if self._file is None:
+                with _timed(None, "encode"):
+                    self._file = await asyncio.to_thread(encode_audio, self.audio, None, self.sr)
+        return self._file
+
+class Transcriber(abc.ABC):
+    """Движок STT. transcribe — корутина на PIPELINE; translate=True — сразу английский (one_shot)."""
+    name = ""
+
+    def timeout(self, duration_sec: float):
+        """Дедлайн одной попытки, None — без дедлайна (остаётся job_deadline_sec)."""
+        return float(CFG.get("stt_timeout_sec", 30.0)) + \
+            duration_sec * float(CFG.get("stt_timeout_per_audio_sec", 0.25))
+
+    def warm(self):
+        """Подготовка заранее (загрузка модели); по умолчанию ничего."""
+
+    @abc.abstractmethod
+    async def transcribe(self, inp: SttInput, model: str, translate: bool = False) -> str:
+        """Текст распознанного inp моделью model."""
+
+class OpenAITranscriber(Transcriber):
+    """/audio/transcriptions и /audio/translations через общий AsyncOpenAI."""
+    name = "openai"
+
+    async def transcribe(self, inp: SttInput, model: str, translate: bool = False) -> str:
+        client = get_async_client()
+        file = await inp.upload()
+        with _timed(None, "stt_request", model, only_ok=True):
+            if translate:
+                r = await client.audio.translations.create(file=file, model=model)
+            else:
+                r = await client.audio.transcriptions.create(file=file, model=model)
+        return (r.text or "").strip()
+
+class FasterWhisperTranscriber(Transcriber):
+    """Локальный STT: faster-whisper (CTranslate2) с int8-квантованием.
+
+    Модель грузится один раз и остаётся в памяти. Распознавание идёт в своём пуле потоков:
+    CTranslate2 отпускает GIL, цикл PIPELINE не блокируется.
+    """
+    name = "faster-whisper"
+
+    def __init__(self, model_ref: str):
+        self.model_ref = model_ref      # размер ("small", "large-v3") или путь к модели CTranslate2
+        self._model = None
+        self._lock = threading.Lock()
+        self._workers = max(1, int(CFG.get("local_stt_workers", 1)))
+        self._pool = ThreadPoolExecutor(self._workers, thread_name_prefix="ru2en-stt")
+
+    def timeout(self, duration_sec: float):
+        return None     # время на CPU растёт с длиной записи; сети, которая может зависнуть, нет
+
+    def warm(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from faster_whisper import WhisperModel
+                except ImportError as e:
+                    raise RuntimeError("Локальный STT: установите faster-whisper (pip install faster-whisper)") from e
+                with _timed(None, "stt_load", self.name):
+                    self._model = WhisperModel(
+                        self.model_ref, device=CFG.get("local_stt_device", "cpu"),
+                        compute_type=CFG.get("local_stt_compute_type", "int8"),
+                        cpu_threads=int(CFG.get("local_stt_threads", 0)), num_workers=self._workers,
+                        download_root=CFG.get("local_stt_model_dir") or None)
+        return self._model
+
+    def _run(self, audio_np, sr: int, translate: bool) -> str:
+        model = self.warm()
+        pcm = audio_np.astype(np.float32) / 32768.0
+        if sr != 16000:     # Whisper работает на 16 кГц
+            n = int(len(pcm) * 16000 / sr)
+            pcm = np.interp(np.linspace(0, len(pcm) - 1, n), np.arange(len(pcm)), pcm).astype(np.float32)
+        segments, _ = model.transcribe(
+            pcm, language=CFG.get("local_stt_language") or None, task="translate" if translate else "transcribe",
+            beam_size=int(CFG.get("local_stt_beam_size", 1)), condition_on_previous_text=False)
+        return " ".join(seg.text.strip() for seg in segments).strip()
+
+    async def transcribe(self, inp: SttInput, model: str, translate: bool = False) -> str:
+        loop = asyncio.get_running_loop()
+        with _timed(None, "stt_local", model):
+            return await loop.run_in_executor(self._pool, self._run, inp.audio, inp.sr, translate)
+
+# префикс значения stt_model → движок; без префикса — OpenAI
+TRANSCRIBER_ENGINES = {"local": FasterWhisperTranscriber}
+_transcribers = {}
+_transcribers_lock = threading.Lock()
+
+def is_local_model(model: str) -> bool:
+    engine, sep, _ = model.partition(":")
+    return bool(sep) and engine in TRANSCRIBER_ENGINES
+
+def get_transcriber(model: str) -> Transcriber:
+    """Движок для значения stt_model: один экземпляр на модель, локальная модель остаётся загруженной."""
+    key = model if is_local_model(model) else ""
+    with _transcribers_lock:
+        t = _transcribers.get(key)
+        if t is None:
+            engine, _, ref = model.partition(":")
+            t = _transcribers[key] = TRANSCRIBER_ENGINES[engine](ref) if key else OpenAITranscriber()
+    return t
+
+def prewarm_transcriber():
+    """Локальную модель грузим в фоне заранее: первая запись не ждёт загрузки."""
+    model = stt_model_for(CFG.get("pipeline_mode", "two_hop"))
+    if not is_local_model(model):
+        return
+    def run():
+        try: get_transcriber(model).warm()
+        except Exception as e: print(f"[WARN] {e}")
+    threading.Thread(target=run, name="ru2en-stt-warm", daemon=True).start()
+
+def stt_model_for(pipeline: str) -> str:
+    return CFG.get("translate_model", "whisper-1") if pipeline == "one_shot" else CFG["stt_model"]
+
+async def stt_pcm_async(audio_np, sr: int = None, pipeline: str = "two_hop") -> str:
+    """STT куска PCM int16 движком из stt_model. one_shot — сразу английский.
+
+    Повторы, хеджирование и запасные модели — call_with_policy. У /audio/translations
+    запасными могут быть только локальные модели: прочие STT-модели не переводят.
+    """
+    inp = SttInput(audio_np, sr)
+    translate = pipeline == "one_shot"
+
+    async def attempt(model):
+        return await get_transcriber(model).transcribe(inp, model, translate)
+
+    fallbacks = list(CFG.get("stt_fallback_models") or [])
+    if translate:
+        fallbacks = [m for m in fallbacks if is_local_model(m)]
+    return await call_with_policy("stt_request", [stt_model_for(pipeline)] + fallbacks, attempt,
+                                  lambda model: get_transcriber(model).timeout(inp.duration))
+
+def one_shot_active() -> bool:
+    return CFG.get("output_mode","english").lower() != "russian" and CFG.get("pipeline_mode") == "one_shot"
+
+def _join_transcripts(parts) -> str:
+    return re.sub(r"\s+", " ", " ".join(p.strip() for p in parts if p and p.strip())).strip()
+
+# ------------ Streaming STT -------------
+CUT_FRAME_SEC = 0.02   # шаг поиска тихого места для разреза сегмента
+MIN_SEGMENT_SEC = 0.1  # короче этого API не принимает аудио
+
+def _quiet_cut(audio_np, search_from: int, sr: int = None, with_level: bool = False):
+    """Индекс самого тихого 20-мс кадра в audio_np[search_from:] — там и режем сегмент.
+
+    with_level=True возвращает (индекс, тихо ли там): на сплошной речи тишины может не быть.
+    """
+    hop = max(1, int(CUT_FRAME_SEC * (sr or SAMPLE_RATE)))
+    rms = frame_rms(audio_np[search_from:], hop)
+    if rms.size < 2:
+        return (len(audio_np), True) if with_level else len(audio_np)
+    i = int(np.argmin(rms))
+    cut = search_from + i * hop + hop // 2
+    return (cut, bool(rms[i] < float(CFG.get("vad_off_rms", 150)))) if with_level else cut
+
+def chunk_limit_sec(sr: int = None) -> float:
+    """Предел куска STT: stt_chunk_sec и размер загрузки (по худшему случаю — WAV)."""
+    by_size = float(CFG.get("stt_max_upload_mb", 24)) * 1e6 / (2 * CHANNELS * (sr or SAMPLE_RATE))
+    return max(1.0, min(float(CFG.get("stt_chunk_sec", 300)), by_size))
+
+def plan_chunks(audio_np, sr: int = None, max_sec: float = None):
+    """Границы кусков [(start, end, overlapped)]: режем в тишине последних 40% окна;
+    без тишины — с перекрытием stt_chunk_overlap_sec, дубли убирает _stitch_transcripts."""
+    sr = sr or SAMPLE_RATE
+    size = max(1, int((max_sec or chunk_limit_sec(sr)) * sr))
+    overlap = int(float(CFG.get("stt_chunk_overlap_sec", 1.0)) * sr)
+    chunks, pos, n = [], 0, len(audio_np)
+    prev_overlapped = False
+    while n - pos > size:
+        cut, quiet = _quiet_cut(audio_np[pos:pos + size], int(size * 0.6), sr, with_level=True)
+        cut = pos + max(1, cut)
+        chunks.append((pos, cut, prev_overlapped))
+        prev_overlapped = not quiet and overlap > 0
+        pos = max(pos + 1, cut - overlap) if prev_overlapped else cut
+    chunks.append((pos, n, prev_overlapped))
+    return chunks
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def _stitch_transcripts(parts, overlapped) -> str:
+    """Склейка кусков по порядку. Там, где куски перекрываются, убираем из начала следующего
+    самое длинное совпадение (до 12 слов) с концом предыдущего."""
+    out = []
+    for text, ov in zip(parts, overlapped):
+        text = (text or "").strip()
+        if ov and out and text:
+            prev = [w.lower() for w in _WORD_RE.findall(out[-1])][-12:]
+            words = list(_WORD_RE.finditer(text))
+            for k in range(min(len(prev), len(words)), 0, -1):
+                if [m.group().lower() for m in words[:k]] == prev[-k:]:
+                    text = text[words[k - 1].end():].lstrip(" ,.;:!?…-—")
+                    break
+        out.append(text)
+    return _join_transcripts(out)
+
+class PartialTranscript(str):
+    """Склейка, в которой часть кусков не распознана («[…]»). Вставлять можно, кэшировать — нет:
+    повтор той же записи должен заново распознать упавшие куски."""
+
+def _collect_chunk_results(results) -> tuple:
+    """Результаты gather(return_exceptions=True) → (тексты, были ли ошибки).
+    Упавшие куски → «[…]», остальные сохраняем. Если упали все — пробрасываем первую ошибку."""
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors and len(errors) == len(results):
+        raise errors[0]
+    for e in errors:
+        METRICS.inc("stt_chunk_errors_total")
+        print(f"[WARN] STT кусок не распознан: {type(e).__name__}: {e}")
+    return ["[…]" if isinstance(r, BaseException) else r for r in results], bool(errors)
+
+def _stitch_chunk_results(results, overlapped) -> str:
+    texts, failed = _collect_chunk_results(results)
+    text = _stitch_transcripts(texts, overlapped)
+    return PartialTranscript(text) if failed else text
+
+async def stt_chunked_async(audio_np, sr: int = None, pipeline: str = "two_hop") -> str:
+    """STT записи любой длины: куски ниже лимитов API идут параллельно, текст — по порядку."""
+    chunks = plan_chunks(audio_np, sr)
+    if len(chunks) == 1:
+        return await stt_pcm_async(audio_np, sr, pipeline)
+    sem = asyncio.Semaphore(max(1, int(CFG.get("stt_chunk_concurrency", 4))))
+    async def one(a, b):
+        async with sem:
+            return await stt_pcm_async(audio_np[a:b], sr, pipeline)
+    results = await asyncio.gather(*(one(a, b) for a, b, _ in chunks), return_exceptions=True)
+    return _stitch_chunk_results(results, [ov for _, _, ov in chunks])
+
+class StreamingSTT:
+    """Режет живую запись на сегменты и распознаёт каждый, пока пользователь ещё говорит.
+
+    Сегменты — view на AudioBuffer без копирования. К моменту стопа в работе
+    остаётся только последний короткий сегмент.
+    """
+    def __init__(self, buf: AudioBuffer, segment_sec: float, transcribe=None, discard_after_sec: float = 0):
+        self.buf = buf
+        self.transcribe = transcribe or stt_pcm_async   # корутинная функция: audio → текст
+        self.seg_len = max(1, int(segment_sec * SAMPLE_RATE))
+        self.overlap = int(float(CFG.get("stt_chunk_overlap_sec", 1.0)) * SAMPLE_RATE)
+        # длинная запись: распознанное аудио выбрасываем, память остаётся постоянной
+        self.discard_after = int(discard_after_sec * SAMPLE_RATE)
+        self._pos = 0
+        self._futures = []
+        self._overlapped = []
+        self._next_overlapped = False
+        self.on_text = None     # (текст распознанных по порядку сегментов) — для спекулятивного перевода
+
+    @property
+    def discarded(self) -> bool:
+        return self.buf.start > 0
+
+    @property
+    def next_cut_at(self) -> int:
+        return self._pos + self.seg_len
+
+    def pump(self):
+        """Отправляет все сегменты, которые уже целиком записаны."""
+        while len(self.buf) >= self.next_cut_at:
+            audio = self.buf.view(self._pos, self.next_cut_at)
+            # режем в тишине последних 40% сегмента, чтобы не разрубить слово;
+            # на сплошной речи — с перекрытием, дубли слов уберёт склейка
+            cut, quiet = _quiet_cut(audio, int(self.seg_len * 0.6), with_level=True)
+            self._submit(audio[:cut])
+            overlapped = not quiet and 0 < self.overlap < cut
+            self._pos += cut - self.overlap if overlapped else cut
+            self._next_overlapped = overlapped
+            if self.discard_after and len(self.buf) > self.discard_after:
+                self.buf.discard(self._pos)
+
+    def _submit(self, audio_np):
+        speech, segs = trim_silence(audio_np)
+        if not segs:
+            return
+        if CFG.get("vad_trim", True):
+            audio_np = speech
+        if len(audio_np) < MIN_SEGMENT_SEC * SAMPLE_RATE:
+            return
+        self._overlapped.append(self._next_overlapped)
+        f = PIPELINE.submit(self.transcribe(audio_np))
+        self._futures.append(f)
+        f.add_done_callback(self._segment_done)
+
+    def _segment_done(self, _):
+        if self.on_text is None:
+            return
+        parts = []
+        for f in list(self._futures):
+            if not f.done() or f.cancelled() or f.exception() is not None:
+                break
+            parts.append(f.result())
+        if parts:
+            try: self.on_text(_stitch_transcripts(parts, self._overlapped[:len(parts)]))
+            except Exception as e: print(f"[WARN] спекулятивный перевод: {e}")
+
+    @property
+    def submitted(self) -> int:
+        return len(self._futures)
+
+    def _flush_tail(self):
+        self.pump()
+        if len(self.buf) > self._pos:
+            self._submit(self.buf.view(self._pos))
+            self._pos = len(self.buf)
+
+    def finish(self) -> str:
+        """Отправляет хвост и склеивает частичные расшифровки в исходном порядке."""
+        self._flush_tail()
+        results = []
+        for f in self._futures:
+            try: results.append(f.result())
+            except Exception as e: results.append(e)
+        return _stitch_chunk_results(results, self._overlapped) if results else ""
+
+    async def finish_async(self) -> str:
+        self._flush_tail()
+        try:
+            results = await asyncio.gather(*(asyncio.wrap_future(f) for f in self._futures), return_exceptions=True)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+        return _stitch_chunk_results(results, self._overlapped) if results else ""
+
+    def cancel(self):
+        for f in self._futures: f.cancel()
 
 STYLE_MAP = {
     "официальный": "formal, professional; no greetings",
@@ -139,38 +1363,587 @@ STYLE_MAP = {
     "лаконичный": "concise, to-the-point; no greetings",
     "академический": "academic, precise, hedged; no greetings",
 }
+# профили, для которых английский из one_shot уже готов и второй проход LLM не нужен
+STYLE_PASSTHROUGH = {"нейтральный"}
+
+def style_needs_pass(profile: str) -> bool:
+    return profile not in STYLE_PASSTHROUGH
+
+PROMPT_VERSION = 2      # поднимать при любой правке текста шаблонов: от него зависят ключи кэша переводов
+
+# общий для всех профилей статический префикс: провайдер кэширует его между запросами
+PROMPT_RULES = (
+    "You rewrite text in STRICT LITERAL MODE to match the requested style WITHOUT changing meaning.\n"
+    "HARD CONSTRAINTS:\n"
+    "1) Do NOT add or remove information.\n"
+    "2) Preserve named entities, numbers, code, URLs, and technical terms exactly.\n"
+    "3) Sentence alignment 1:1.\n"
+    "4) Keep length close to original; no fluff.\n"
+    "5) Output plain text only."
+)
+PROMPT_GOALS = {
+    True: "Translate the text to English literally, then match the style without altering meaning.",
+    False: "Keep the language as is; only adjust form to the requested style, without altering meaning.",
+}
+
+class PromptTemplate:
+    """Шаблон прохода стиля для профиля.
+
+    Всё постоянное — правила, стиль, цель — в system-сообщении, байт в байт одинаковом для
+    всех запросов профиля. Меняющийся текст идёт последним, в user.
+    """
+    def __init__(self, profile: str, style_hint: str, version: int = PROMPT_VERSION):
+        self.profile, self.style_hint, self.version = profile, style_hint, version
+        self.id = f"{profile}@v{version}"
+        self._system = {en: f"{PROMPT_RULES}\n\nStyle: {style_hint}\nGoal: {goal}"
+                        for en, goal in PROMPT_GOALS.items()}
+
+    def system(self, force_english: bool) -> str:
+        return self._system[bool(force_english)]
+
+    def user(self, text: str, context: str = "") -> str:
+        if context:     # группа длинного текста: предыдущие предложения — только для связности
+            return f"Preceding context (for reference only, do not output it):\n{context}\n\nText:\n{text}"
+        return f"Text:\n{text}"
+
+    def messages(self, text: str, force_english: bool, context: str = "") -> list:
+        return [{"role": "system", "content": self.system(force_english)},
+                {"role": "user", "content": self.user(text, context)}]
+
+PROMPT_TEMPLATES = {profile: PromptTemplate(profile, hint) for profile, hint in STYLE_MAP.items()}
+
+def get_prompt(profile: str) -> PromptTemplate:
+    return PROMPT_TEMPLATES.get(profile) or PROMPT_TEMPLATES["нейтральный"]
+
+def _record_usage(usage, model: str):
+    """Токены промпта и сколько из них провайдер взял из кэша префикса."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    METRICS.inc("prompt_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model)
+    METRICS.inc("prompt_cached_tokens_total", getattr(details, "cached_tokens", 0) or 0, model=model)
+
+_no_stream_usage = set()    # base_url серверов, отвергших stream_options (400)
+
+def _stream_usage_kwargs() -> dict:
+    if not CFG.get("stream_usage", True) or _base_url() in _no_stream_usage:
+        return {}
+    return {"stream_options": {"include_usage": True}}
+
+def _style_request(text: str, target_style_ru: str, force_english: bool, model: str = None,
+                   context: str = "") -> dict:
+    """Параметры chat.completions.create для прохода стиля/перевода."""
+    model = model or CFG["style_model"]
+    req = {"model": model, "messages": get_prompt(target_style_ru).messages(text, force_english, context)}
+    if not model.startswith("gpt-5"):
+        req.update(temperature=0.0, top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0)
+    return req
+
+async def style_pass_async(text: str, target_style_ru: str, force_english: bool, on_piece=None,
+                           context: str = "") -> str:
+    """Проход стиля/перевода. С on_piece читает токены потоком и отдаёт готовые предложения.
+
+    Промпт требует выравнивания предложений 1:1, поэтому границы предложений — безопасные
+    точки сброса. context — предыдущие предложения текста, в ответ они не входят.
+    """
+    client = get_async_client()
+    models = [CFG["style_model"]] + list(CFG.get("style_fallback_models") or [])
+    gap = float(CFG.get("style_timeout_sec", 20.0))
+    out = []
+
+    async def attempt(model):
+        req = _style_request(text, target_style_ru, force_english, model, context)
+        with _timed(None, "style_request", model, only_ok=True):
+            if on_piece is None:
+                resp = await client.chat.completions.create(**req)
+                _record_usage(getattr(resp, "usage", None), model)
+                return resp.choices[0].message.content.strip()
+            # длинная генерация законна: дедлайн — на первый чанк и паузы между чанками
+            # usage приходит последним чанком без choices
+            usage_kw = _stream_usage_kwargs()
+            try:
+                stream = await asyncio.wait_for(client.chat.completions.create(
+                    stream=True, **usage_kw, **req), gap or None)
+            except Exception as e:
+                if not usage_kw or _status_of(e) != 400:
+                    raise
+                # OpenAI-совместимый сервер не знает stream_options: больше не просим
+                _no_stream_usage.add(_base_url())
+                stream = await asyncio.wait_for(client.chat.completions.create(stream=True, **req), gap or None)
+            pending = ""
+            async for chunk in iter_with_deadline(stream, gap):
+                _record_usage(getattr(chunk, "usage", None), model)
+                if not chunk.choices:
+                    continue
+                pending += chunk.choices[0].delta.content or ""
+                ready, pending = split_complete_sentences(pending)
+                for piece in ready:
+                    if not out: piece = piece.lstrip()
+                    if piece:
+                        out.append(piece); on_piece(piece)
+            tail = pending.rstrip() if out else pending.strip()
+            if tail:
+                out.append(tail); on_piece(tail)
+            return "".join(out).strip()
+
+    timeout = None if on_piece else gap + len(text) / 1000 * float(CFG.get("style_timeout_per_kchar_sec", 10.0))
+    # вставленные куски не отзовёшь: поток повторяем, только пока он ничего не отдал
+    return await call_with_policy("style_request", models, attempt, timeout,
+                                  hedge=on_piece is None, retry_if=lambda: not out)
+
 def literal_rewrite_or_translate(text: str, target_style_ru: str, force_english: bool) -> str:
-    client = get_client()
-    style_hint = STYLE_MAP.get(target_style_ru, STYLE_MAP["нейтральный"])
-    sysmsg = (
-        "You rewrite text in STRICT LITERAL MODE to match the requested style WITHOUT changing meaning.\n"
-        "HARD CONSTRAINTS:\n"
-        "1) Do NOT add or remove information.\n"
-        "2) Preserve named entities, numbers, code, URLs, and technical terms exactly.\n"
-        "3) Sentence alignment 1:1.\n"
-        "4) Keep length close to original; no fluff.\n"
-        "5) Output plain text only."
-    )
-    user_goal = ("Translate the text to English literally, then match the style without altering meaning."
-                 if force_english else
-                 "Keep the language as is; only adjust form to the requested style, without altering meaning.")
-    user_prompt = f"Goal: {user_goal}\nStyle: {style_hint}\nText:\n{text}"
-
-    model = CFG["style_model"]
-    if model.startswith("gpt-5"):
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role":"system","content":sysmsg},
-                      {"role":"user","content":user_prompt}]
-        )
-    else:
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[{"role":"system","content":sysmsg},
-                      {"role":"user","content":user_prompt}],
-            temperature=0.0, top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0
-        )
-    return resp.choices[0].message.content.strip()
+    return PIPELINE.run(style_pass_async(text, target_style_ru, force_english))
+
+# конец предложения, за которым уже пришёл пробел/перевод строки — значит, оно завершено
+SENTENCE_END_RE = re.compile(r"[.!?…]+[\"»”')\]]*(?=\s)")
+
+def split_complete_sentences(buf: str):
+    """(готовые куски, остаток). Пробелы между предложениями уходят в начало следующего куска."""
+    last = None
+    for m in SENTENCE_END_RE.finditer(buf):
+        last = m
+    if last is None:
+        return [], buf
+    return [buf[:last.end()]], buf[last.end():]
+
+def literal_rewrite_or_translate_stream(text: str, target_style_ru: str, force_english: bool, on_piece) -> str:
+    """Как literal_rewrite_or_translate, но каждое готовое предложение сразу уходит в on_piece."""
+    return PIPELINE.run(style_pass_async(text, target_style_ru, force_english, on_piece))
+
+# ------------ Translators -------------
+# граница предложений: любой перевод строки или пробел после конца предложения (с закрывающей кавычкой)
+SENTENCE_SPLIT_RE = re.compile(r"(\s*\n\s*|(?<=[.!?…])\s+|(?<=[.!?…][\"»”')\]])\s+)")
+
+def split_sentences(text: str):
+    """Текст → [(разделитель перед предложением, предложение)]. Разделитель — исходный пробельный
+    промежуток, так что переносы строк и пустые строки между абзацами переживают перевод."""
+    parts = SENTENCE_SPLIT_RE.split(text.strip())
+    if parts == [""]:
+        return []
+    return list(zip([""] + parts[1::2], parts[::2]))
+
+class Translator(abc.ABC):
+    """Движок перевода/стиля. translate — корутина на PIPELINE; on_piece получает готовые предложения."""
+    name = ""
+
+    def warm(self):
+        """Подготовка заранее (загрузка модели); по умолчанию ничего."""
+
+    @abc.abstractmethod
+    async def translate(self, text: str, target_style_ru: str, force_english: bool, on_piece=None) -> str:
+        """Перевод/стилизация text; готовые предложения по порядку уходят в on_piece."""
+
+def sentence_groups(text: str, max_chars: int, context_sentences: int = 0):
+    """Группы подряд идущих предложений ≈ max_chars: [(разделитель перед группой, текст, контекст)].
+
+    Контекст — context_sentences предложений перед группой; разделитель — исходный пробельный
+    промежуток из текста (у первой группы пустой).
+    """
+    flat = split_sentences(text)
+    bounds, start, size = [], 0, 0
+    for i, (_, sent) in enumerate(flat):
+        if i > start and size + len(sent) > max_chars:
+            bounds.append((start, i)); start, size = i, 0
+        size += len(sent) + 1
+    if flat:
+        bounds.append((start, len(flat)))
+    groups = []
+    for a, b in bounds:
+        body = flat[a][1] + "".join(sep + sent for sep, sent in flat[a + 1:b])
+        context = " ".join(sent for _, sent in flat[max(0, a - context_sentences):a])
+        groups.append((flat[a][0], body, context))
+    return groups
+
+class ChatTranslator(Translator):
+    """Проход стиля/перевода моделью style_model через chat.completions.
+
+    С parallel_translation длинный текст идёт группами предложений параллельно: время
+    генерации определяет самая длинная группа, а не весь текст.
+    """
+    @property
+    def name(self):
+        return CFG["style_model"]
+
+    async def translate(self, text, target_style_ru, force_english, on_piece=None):
+        if CFG.get("parallel_translation"):
+            groups = sentence_groups(text, int(CFG.get("translate_group_chars", 600)),
+                                     int(CFG.get("translate_context_sentences", 2)))
+            if len(groups) > 1:
+                return await self._translate_groups(groups, target_style_ru, force_english, on_piece)
+        return await style_pass_async(text, target_style_ru, force_english, on_piece)
+
+    async def _translate_groups(self, groups, target_style_ru, force_english, on_piece):
+        sem = asyncio.Semaphore(max(1, int(CFG.get("translate_concurrency", 4))))
+
+        async def one(i, body, context):
+            async with sem:
+                # первая группа идёт потоком — её предложения вставляются сразу
+                return await style_pass_async(body, target_style_ru, force_english,
+                                              on_piece if i == 0 else None, context)
+
+        tasks = [asyncio.ensure_future(one(i, body, context)) for i, (_, body, context) in enumerate(groups)]
+        out = []
+        try:
+            for i, (task, (sep, _, _)) in enumerate(zip(tasks, groups)):
+                piece = await task
+                if i:
+                    piece = sep + piece
+                    if on_piece: on_piece(piece)
+                out.append(piece)
+        finally:
+            for t in tasks: t.cancel()
+        METRICS.inc("translate_groups_total", len(groups))
+        return "".join(out).strip()
+
+class MarianTranslator(Translator):
+    """Локальный ru→en: Marian/OPUS-MT в CTranslate2 + SentencePiece, батч по предложениям.
+
+    Модель грузится один раз и остаётся в памяти; перевод — в своём потоке (CTranslate2 отпускает GIL).
+    В папке модели нужны source.spm и target.spm (ct2-transformers-converter --copy_files).
+    """
+    def __init__(self, model_dir: str):
+        self.model_dir = Path(model_dir).expanduser()
+        self.name = "local:" + self.model_dir.name
+        self._model = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(1, thread_name_prefix="ru2en-mt")
+
+    def warm(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    import ctranslate2, sentencepiece
+                except ImportError as e:
+                    raise RuntimeError("Локальный перевод: установите ctranslate2 и sentencepiece") from e
+                with _timed(None, "mt_load", self.name):
+                    translator = ctranslate2.Translator(str(self.model_dir), device="cpu",
+                                                        intra_threads=int(CFG.get("local_mt_threads", 0)))
+                    src = sentencepiece.SentencePieceProcessor(model_file=str(self.model_dir / "source.spm"))
+                    tgt = sentencepiece.SentencePieceProcessor(model_file=str(self.model_dir / "target.spm"))
+                self._model = (translator, src, tgt)
+        return self._model
+
+    def _run(self, sentences):
+        translator, src, tgt = self.warm()
+        batch = [src.encode(s, out_type=str) + ["</s>"] for s in sentences]
+        results = translator.translate_batch(batch, max_batch_size=int(CFG.get("local_mt_batch_size", 32)),
+                                             beam_size=int(CFG.get("local_mt_beam_size", 2)))
+        return [tgt.decode(r.hypotheses[0]).strip() for r in results]
+
+    async def translate(self, text, target_style_ru, force_english, on_piece=None):
+        flat = split_sentences(text)
+        if not flat:
+            return ""
+        loop = asyncio.get_running_loop()
+        with _timed(None, "mt_local", self.name):
+            done = await loop.run_in_executor(self._pool, self._run, [sent for _, sent in flat])
+        out = []
+        for (sep, _), piece in zip(flat, done):
+            piece = sep + piece
+            out.append(piece)
+            if on_piece: on_piece(piece)
+        return "".join(out)
+
+_translators = {}
+_translators_lock = threading.Lock()
+_local_mt_failed = set()    # папки моделей, которые не загрузились: дальше сразу LLM
+
+def get_translator(target_style_ru: str, force_english: bool) -> Translator:
+    """Локальная модель — для перевода ru→en в стилях local_mt_styles; остальное — LLM."""
+    model_dir = CFG.get("local_mt_model") or ""
+    local = (model_dir and force_english and model_dir not in _local_mt_failed
+             and target_style_ru in (CFG.get("local_mt_styles") or []))
+    key = model_dir if local else ""
+    with _translators_lock:
+        t = _translators.get(key)
+        if t is None:
+            t = _translators[key] = MarianTranslator(model_dir) if local else ChatTranslator()
+    return t
+
+async def resolve_translator_async(target_style_ru: str, force_english: bool) -> Translator:
+    """Движок, который действительно переведёт: если локальная модель не загрузилась — LLM."""
+    translator = get_translator(target_style_ru, force_english)
+    if isinstance(translator, MarianTranslator):
+        try:
+            await asyncio.to_thread(translator.warm)
+        except Exception as e:
+            print(f"[WARN] {e}. Перевод через {CFG['style_model']}.")
+            _local_mt_failed.add(CFG.get("local_mt_model"))
+            translator = get_translator(target_style_ru, force_english)
+    return translator
+
+async def translate_async(text: str, target_style_ru: str, force_english: bool, on_piece=None) -> str:
+    """Перевод/стиль выбранным движком."""
+    translator = await resolve_translator_async(target_style_ru, force_english)
+    return await translator.translate(text, target_style_ru, force_english, on_piece)
+
+def prewarm_translator():
+    """Локальную модель перевода грузим в фоне заранее."""
+    translator = get_translator(CFG.get("style_profile", "нейтральный"), True)
+    if not isinstance(translator, MarianTranslator):
+        return
+    def run():
+        try: translator.warm()
+        except Exception as e: print(f"[WARN] {e}")
+    threading.Thread(target=run, name="ru2en-mt-warm", daemon=True).start()
+
+# ------------ Cache -------------
+class ResultCache:
+    """LRU в памяти + опциональное хранилище SQLite с ограничением по числу записей и TTL."""
+    PRUNE_EVERY = 64
+
+    def __init__(self, table: str, max_entries: int, ttl_sec: float = 0, db_path=None, max_disk_entries: int = 0):
+        self.table = table
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_sec or 0)
+        self.max_disk_entries = int(max_disk_entries or 0)
+        self.hits = self.misses = 0
+        self._mem = OrderedDict()       # key → (created, value)
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                 "(k TEXT PRIMARY KEY, v TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)")
+            except Exception as e:
+                print(f"[WARN] Кэш {table}: диск недоступен ({e}), только память.")
+                self._db = None
+
+    def _fresh(self, created: float, now: float) -> bool:
+        return self.ttl <= 0 or now - created <= self.ttl
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            e = self._mem.get(key)
+            if e is not None:
+                if self._fresh(e[0], now):
+                    self._mem.move_to_end(key); self.hits += 1
+                    return e[1]
+                del self._mem[key]
+            if self._db is not None:
+                row = self._db.execute(f"SELECT v, created FROM {self.table} WHERE k=?", (key,)).fetchone()
+                if row and self._fresh(row[1], now):
+                    self._db.execute(f"UPDATE {self.table} SET used=? WHERE k=?", (now, key))
+                    self._remember(key, row[1], row[0]); self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is None:
+                return
+            self._db.execute(f"INSERT OR REPLACE INTO {self.table} (k, v, created, used) VALUES (?,?,?,?)",
+                             (key, value, now, now))
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _remember(self, key, created, value):
+        self._mem[key] = (created, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def _prune(self, now: float):
+        if self.ttl > 0:
+            self._db.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl,))
+        if self.max_disk_entries > 0:
+            self._db.execute(f"DELETE FROM {self.table} WHERE k IN (SELECT k FROM {self.table} "
+                             f"ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._mem)}
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None: self._db.execute(f"DELETE FROM {self.table}")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None: self._db.close(); self._db = None
+
+def cache_db_path():
+    return CFG_PATH.with_name("ru2en_cache.sqlite3")
+
+def _make_cache(table: str):
+    return ResultCache(table, CFG.get("cache_max_entries", 512), CFG.get("cache_ttl_sec", 0),
+                       cache_db_path() if CFG.get("cache_persist", True) else None,
+                       CFG.get("cache_max_disk_entries", 0))
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+def translation_cache_key(text: str, style_profile: str, style_model: str, force_english: bool,
+                          prompt_id: str = "") -> str:
+    raw = json.dumps([normalize_text(text), style_profile, style_model, bool(force_english), prompt_id],
+                     ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+_translation_cache = None
+
+def get_translation_cache():
+    global _translation_cache
+    if not CFG.get("translation_cache", True):
+        return None
+    if _translation_cache is None:
+        _translation_cache = _make_cache("translations")
+    return _translation_cache
+
+_stt_cache = None
+
+def get_stt_cache():
+    global _stt_cache
+    if not CFG.get("stt_cache", True):
+        return None
+    if _stt_cache is None:
+        _stt_cache = _make_cache("stt")
+    return _stt_cache
+
+def stt_cache_key(audio_np, pipeline: str, sr: int = None) -> str:
+    """Отпечаток обрезанного PCM + модель: та же запись не загружается повторно."""
+    model = stt_model_for(pipeline)
+    h = hashlib.blake2b(np.ascontiguousarray(audio_np).data, digest_size=16)
+    h.update(f"|{pipeline}|{model}|{sr or SAMPLE_RATE}".encode("utf-8"))
+    return h.hexdigest()
+
+async def stt_cached_async(audio_np, pipeline: str, sr: int = None) -> str:
+    """STT без стриминга через кэш отпечатков. Длинное аудио режется на куски."""
+    cache = get_stt_cache()
+    key = stt_cache_key(audio_np, pipeline, sr)
+    raw = cache.get(key) if cache is not None else None
+    if raw is None:
+        raw = await stt_chunked_async(audio_np, sr, pipeline)
+        if cache is not None and raw and not isinstance(raw, PartialTranscript): cache.put(key, raw)
+    return raw
+
+async def translate_cached_async(text: str, target_style_ru: str, force_english: bool, on_piece=None) -> str:
+    """Проход стиля/перевода через кэш. Повтор знакомой фразы не ходит в API."""
+    cache = get_translation_cache()
+    def key_for(translator):
+        return translation_cache_key(text, target_style_ru, translator.name, force_english,
+                                     get_prompt(target_style_ru).id)
+    expected = get_translator(target_style_ru, force_english)
+    key = key_for(expected)
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            if on_piece: on_piece(hit)
+            return hit
+    translator = await resolve_translator_async(target_style_ru, force_english)
+    if translator is not expected:
+        key = key_for(translator)   # локальная модель не загрузилась: ответ LLM — под ключ LLM
+    out = await translator.translate(text, target_style_ru, force_english, on_piece)
+    if cache is not None and out:
+        cache.put(key, out)
+    return out
+
+def translate_cached(text: str, target_style_ru: str, force_english: bool, on_piece=None) -> str:
+    return PIPELINE.run(translate_cached_async(text, target_style_ru, force_english, on_piece))
+
+# ------------ Speculative translation -------------
+def speculation_enabled(pipeline: str) -> bool:
+    return bool(CFG.get("speculative_translation") and CFG.get("stream_stt") and pipeline == "two_hop"
+                and CFG.get("output_mode", "english").lower() != "russian")
+
+class SpeculativeTranslation:
+    """Перевод устойчивого префикса расшифровки, пока пользователь ещё говорит.
+
+    Устойчивый префикс — завершённые предложения сегментов, распознанных по порядку. Каждая
+    новая порция предложений сразу уходит в перевод; к стопу остаётся перевести только хвост.
+    Порции, чей исходный текст потом изменился, отменяются и выбрасываются.
+    """
+    def __init__(self, target_style_ru: str, force_english: bool = True):
+        self.style, self.force_english = target_style_ru, force_english
+        self._chunks = []       # [(исходный текст порции, future перевода)]
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @staticmethod
+    def _norm(text: str) -> str:
+        return " ".join(text.split())
+
+    def _match(self, norm: str):
+        """Сколько порций подряд совпадают с началом norm и где они кончаются."""
+        pos = 0
+        for k, (src, _) in enumerate(self._chunks):
+            rest = norm[pos:].lstrip()
+            if not rest.startswith(src):
+                return k, pos
+            pos = len(norm) - len(rest) + len(src)
+        return len(self._chunks), pos
+
+    def _discard_from(self, k: int):
+        for _, f in self._chunks[k:]:
+            f.cancel()
+            METRICS.inc("speculation_total", result="discarded")
+        del self._chunks[k:]
+
+    def update(self, stable_text: str):
+        """Новый устойчивый текст (из потока PIPELINE): переводим появившиеся предложения."""
+        ready, _ = split_complete_sentences(stable_text + " ")
+        if not ready:
+            return
+        norm = self._norm(ready[0])
+        with self._lock:
+            if self._closed:
+                return
+            k, pos = self._match(norm)
+            self._discard_from(k)
+            src = norm[pos:].strip()
+            if src:
+                self._chunks.append((src, PIPELINE.submit(
+                    translate_cached_async(src, self.style, self.force_english))))
+
+    async def finish_async(self, final_text: str, target_style_ru: str, force_english: bool, on_piece=None) -> str:
+        """Итоговый перевод: готовые порции по порядку + перевод хвоста. Корутина на PIPELINE."""
+        norm = self._norm(final_text)
+        with self._lock:
+            self._closed = True
+            same = (target_style_ru, force_english) == (self.style, self.force_english)
+            k, _ = self._match(norm) if same else (0, 0)
+            self._discard_from(k)
+            chunks = list(self._chunks)
+        out, pos = [], 0
+        try:
+            for src, f in chunks:
+                try:
+                    text = await asyncio.wrap_future(f)
+                except Exception:
+                    break
+                METRICS.inc("speculation_total", result="used")
+                text = text.strip()
+                if on_piece and text: on_piece(text if not out else " " + text)
+                out.append(text)
+                rest = norm[pos:].lstrip()
+                pos = len(norm) - len(rest) + len(src)
+            tail = norm[pos:].strip()
+            if tail:
+                started = False
+                def put(piece):
+                    nonlocal started
+                    if out and not started: piece = " " + piece.lstrip()
+                    started = True
+                    on_piece(piece)
+                out.append(await translate_cached_async(tail, target_style_ru, force_english,
+                                                        put if on_piece else None))
+        finally:
+            self.cancel()
+        return " ".join(p.strip() for p in out if p.strip())
+
+    def cancel(self):
+        with self._lock:
+            self._closed = True
+            for _, f in self._chunks:
+                if not f.done(): f.cancel()
 
 # ------------ Win helpers -------------
 def _get_foreground_hwnd():
@@ -218,46 +1991,6 @@ def _child_from_point(hwnd_parent, pt_screen):
     except Exception:
         return hwnd_parent or None
 
-def _set_foreground_and_focus(hwnd_target, candidate_focus_hwnd=None):
-    if not (win32gui and win32api and win32process): 
-        return False
-    try:
-        if AllowSetForegroundWindow:
-            try: AllowSetForegroundWindow(-1)
-            except Exception: pass
-
-        win32gui.ShowWindow(hwnd_target, 5)
-        time.sleep(0.08)
-        try:
-            win32gui.SetForegroundWindow(hwnd_target)
-            time.sleep(0.08)
-        except Exception:
-            pass
-
-        cur_tid = win32api.GetCurrentThreadId()
-        tgt_tid, _ = win32process.GetWindowThreadProcessId(hwnd_target)
-        try:
-            AttachThreadInput(cur_tid, tgt_tid, True)
-            win32gui.SetForegroundWindow(hwnd_target)
-            time.sleep(0.08)
-            focus_hwnd = candidate_focus_hwnd or _get_focus_control_from_thread(hwnd_target)
-            if not focus_hwnd and GetCursorPos:
-                pt = wintypes.POINT()
-                if GetCursorPos(ctypes.byref(pt)):
-                    focus_hwnd = _child_from_point(hwnd_target, (pt.x, pt.y))
-            if focus_hwnd:
-                try:
-                    win32gui.SetFocus(focus_hwnd)
-                    time.sleep(0.05)
-                    return True
-                except Exception:
-                    return True
-            return True
-        finally:
-            AttachThreadInput(cur_tid, tgt_tid, False)
-    except Exception:
-        return False
-
 def _wm_paste(hwnd):
     if not (win32gui and hwnd): return False
     try:
@@ -288,116 +2021,860 @@ def _ctrl_v_win():
 
 def _ctrl_v_pynput():
     try:
-        with kb.pressed(Key.ctrl):
+        kb = get_kb()
+        with kb.pressed(keyboard.Key.ctrl):
             kb.press('v'); kb.release('v')
         return True
     except Exception:
         return False
 
-# ------------ Paste pipeline -------------
-def _determine_focus_control():
-    """Окно и контрол для вставки: берём окно, замеченное при старте записи."""
-    global _last_focus_hwnd
-    hwnd_win = _last_window_hwnd or _get_foreground_hwnd()
-    if not hwnd_win:
-        return None, None
-    focus_hwnd = _get_focus_control_from_thread(hwnd_win)
-    if not focus_hwnd and GetCursorPos:
-        pt = wintypes.POINT()
-        if GetCursorPos(ctypes.byref(pt)):
-            focus_hwnd = _child_from_point(hwnd_win, (pt.x, pt.y))
-    _last_focus_hwnd = focus_hwnd
-    return hwnd_win, focus_hwnd
-
-def paste_text(text: str):
-    """Буфер → возврат фокуса → Ctrl+V (WinAPI) → Ctrl+V (pynput)."""
-    hwnd_win, focus_hwnd = _determine_focus_control()
-    if hwnd_win:
-        _set_foreground_and_focus(hwnd_win, focus_hwnd)
-        time.sleep(0.06)
+# ------------ Input backends -------------
+class InputBackend:
+    """Платформенный ввод: глобальный хоткей, окна/фокус и вставка.
 
-    try:
+    Методы окон и вставки не ждут — готовность проверяет PasteEngine. Базовый вариант —
+    хоткей через pynput, буфер обмена и Ctrl+V без управления окнами.
+    """
+    name = "clipboard"
+
+    def __init__(self):
+        self._listener = None
+
+    def start_hotkey(self, on_hotkey) -> bool:
+        """Регистрирует Ctrl+Пробел; on_hotkey вызывается из потока бэкенда."""
+        if self._listener is not None:
+            return True
+        try:
+            from pynput.keyboard import GlobalHotKeys
+            self._listener = GlobalHotKeys({PYNPUT_HOTKEY: on_hotkey})
+            self._listener.start()
+            return True
+        except Exception as e:
+            print(f"[WARN] pynput хоткей недоступен: {e}")
+            return False
+
+    def stop_hotkey(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def foreground(self):
+        return None
+
+    def focus_control(self, win):
+        """Контрол, в который пойдёт вставка (запоминается на старте вставки)."""
+        return None
+
+    def current_focus(self, win):
+        """Контрол, у которого фокус прямо сейчас."""
+        return self.focus_control(win)
+
+    def app_id(self, win) -> str:
+        return ""
+
+    def activate(self, win, ctrl=None):
+        pass
+
+    def clipboard_seq(self):
+        """Номер изменения буфера; None — платформа его не даёт (ждём паузу из профиля)."""
+        return None
+
+    def set_clipboard(self, text: str):
         pyperclip.copy(text)
-    except Exception as e:
-        print(f"[WARN] pyperclip.copy: {e}")
-    time.sleep(0.22)
 
-    release_modifiers()
-    time.sleep(0.02)
+    def release_modifiers(self):
+        pass
+
+    def send_paste(self) -> bool:
+        return _ctrl_v_pynput()
+
+class WinInputBackend(InputBackend):
+    name = "win32"
+
+    def start_hotkey(self, on_hotkey) -> bool:
+        global _hotkey_thread
+        if _hotkey_thread and _hotkey_thread.is_alive(): return True
+        _hotkey_stop_evt.clear()
+        _hotkey_thread = threading.Thread(target=hotkey_message_loop, args=(on_hotkey,), daemon=True)
+        _hotkey_thread.start()
+        return True
+
+    def stop_hotkey(self):
+        _hotkey_stop_evt.set()
+        # WM_QUIT в поток хоткея, иначе GetMessageW не проснётся до следующего сообщения
+        try:
+            if PostThreadMessageW and _hotkey_tid: PostThreadMessageW(_hotkey_tid, WM_QUIT, 0, 0)
+        except Exception:
+            pass
+
+    def foreground(self):
+        return _get_foreground_hwnd()
+
+    def focus_control(self, win):
+        focus = _get_focus_control_from_thread(win)
+        if not focus and GetCursorPos:
+            pt = wintypes.POINT()
+            if GetCursorPos(ctypes.byref(pt)):
+                focus = _child_from_point(win, (pt.x, pt.y))
+        return focus
+
+    def current_focus(self, win):
+        return _get_focus_control_from_thread(win)
+
+    def app_id(self, win) -> str:
+        try: return win32gui.GetClassName(win)
+        except Exception: return ""
+
+    def activate(self, win, ctrl=None):
+        """Окно на передний план и фокус на контрол: AttachThreadInput к потоку окна."""
+        if AllowSetForegroundWindow:
+            try: AllowSetForegroundWindow(-1)
+            except Exception: pass
+        try:
+            win32gui.ShowWindow(win, 5)
+            cur_tid = win32api.GetCurrentThreadId()
+            tgt_tid, _ = win32process.GetWindowThreadProcessId(win)
+            AttachThreadInput(cur_tid, tgt_tid, True)
+            try:
+                win32gui.SetForegroundWindow(win)
+                if ctrl: win32gui.SetFocus(ctrl)
+            finally:
+                AttachThreadInput(cur_tid, tgt_tid, False)
+        except Exception:
+            pass
+
+    def clipboard_seq(self):
+        return GetClipboardSequenceNumber() if GetClipboardSequenceNumber else None
+
+    def release_modifiers(self):
+        release_modifiers()
+
+    def send_paste(self) -> bool:
+        # WM_PASTE не используем, чтобы избежать двойной вставки в приложениях типа Notepad++
+        return _ctrl_v_win() or _ctrl_v_pynput()
+
+class X11InputBackend(InputBackend):
+    """Linux/X11: хоткей через pynput, окна через xdotool. Под Wayland окна недоступны —
+    остаётся вставка в текущее окно."""
+    name = "x11"
+
+    def __init__(self):
+        super().__init__()
+        self.xdotool = shutil.which("xdotool")
+
+    def _xdo(self, *args):
+        """stdout xdotool или None, если его нет или команда не удалась."""
+        if not self.xdotool:
+            return None
+        try:
+            r = subprocess.run([self.xdotool, *map(str, args)], capture_output=True, text=True, timeout=1.0)
+            return r.stdout.strip() if r.returncode == 0 else None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    def foreground(self):
+        out = self._xdo("getactivewindow") or ""
+        return int(out) if out.isdigit() else None
+
+    def app_id(self, win) -> str:
+        return self._xdo("getwindowclassname", win) or ""
+
+    def activate(self, win, ctrl=None):
+        self._xdo("windowactivate", win)
+
+    def release_modifiers(self):
+        try:
+            kb = get_kb()
+            for k in (keyboard.Key.ctrl, keyboard.Key.alt, keyboard.Key.shift): kb.release(k)
+        except Exception:
+            pass
+
+    def send_paste(self) -> bool:
+        return _ctrl_v_pynput() or self._xdo("key", "--clearmodifiers", "ctrl+v") is not None
 
-    # Пробуем Ctrl+V как основной и самый надежный метод.
-    # WM_PASTE убран, чтобы избежать двойной вставки в приложениях типа Notepad++.
-    if not _ctrl_v_win():
-        _ctrl_v_pynput() # Фоллбэк на pynput, если WinAPI не сработал
+class FakeInputBackend(InputBackend):
+    """Оконная система и хоткей в памяти для тестов и бенчмарков: окна «догоняют» запросы с задержкой."""
+    name = "fake"
+
+    def __init__(self, activate_delay=0.0, focus_delay=0.0, clipboard_delay=0.0):
+        super().__init__()
+        self._on_hotkey = None
+        self.windows = {}           # win → {"app", "ctrl", "activate_delay", "focus_delay"}
+        self.clipboard_delay = clipboard_delay
+        self.activate_delay, self.focus_delay = activate_delay, focus_delay
+        self.pasted = []            # (win, ctrl, text) — куда реально ушёл Ctrl+V
+        self._fg = None
+        self._pending = []          # (время, действие)
+        self._clip, self._seq = "", 0
+        self._lock = threading.Lock()
+
+    def add_window(self, win, app="app", ctrl=None, activate_delay=None, focus_delay=None):
+        self.windows[win] = {"app": app, "ctrl": ctrl, "focus": None,
+                             "activate_delay": self.activate_delay if activate_delay is None else activate_delay,
+                             "focus_delay": self.focus_delay if focus_delay is None else focus_delay}
+        return win
+
+    def _later(self, delay, action):
+        with self._lock:
+            self._pending.append((time.perf_counter() + delay, action))
+
+    def _tick(self):
+        now = time.perf_counter()
+        with self._lock:
+            due = [a for t, a in self._pending if t <= now]
+            self._pending = [(t, a) for t, a in self._pending if t > now]
+        for action in due: action()
+
+    def set_foreground(self, win):
+        self._fg = win
+
+    def foreground(self):
+        self._tick(); return self._fg
+
+    def focus_control(self, win):
+        self._tick(); w = self.windows.get(win)
+        return w and (w["focus"] or w["ctrl"])
+
+    def current_focus(self, win):
+        self._tick(); w = self.windows.get(win)
+        return w and w["focus"]
+
+    def app_id(self, win) -> str:
+        return self.windows.get(win, {}).get("app", "")
+
+    def activate(self, win, ctrl=None):
+        w = self.windows[win]
+        self._later(w["activate_delay"], lambda: self.set_foreground(win))
+        if ctrl: self._later(w["activate_delay"] + w["focus_delay"], lambda: w.update(focus=ctrl))
+
+    def clipboard_seq(self):
+        self._tick(); return self._seq
+
+    def set_clipboard(self, text: str):
+        def apply():
+            self._clip = text; self._seq += 1
+        self._later(self.clipboard_delay, apply)
+
+    def send_paste(self) -> bool:
+        self._tick()
+        w = self.windows.get(self._fg, {})
+        self.pasted.append((self._fg, w.get("focus"), self._clip))
+        return True
+
+    def start_hotkey(self, on_hotkey) -> bool:
+        self._on_hotkey = on_hotkey
+        return True
+
+    def stop_hotkey(self):
+        self._on_hotkey = None
+
+    def press_hotkey(self):
+        """Нажатие Ctrl+Пробел — как из потока хоткея."""
+        if self._on_hotkey: self._on_hotkey()
+
+_input_backend = None
+
+def get_input_backend() -> InputBackend:
+    """Бэкенд из input_backend: auto | win32 | x11 | clipboard."""
+    global _input_backend
+    if _input_backend is None:
+        kind = CFG.get("input_backend", "auto")
+        if kind == "auto":
+            kind = "win32" if (win32gui and win32api and win32process) else \
+                   "x11" if sys.platform.startswith("linux") else "clipboard"
+        _input_backend = {"win32": WinInputBackend, "x11": X11InputBackend}.get(kind, InputBackend)()
+    return _input_backend
+
+def set_input_backend(backend: InputBackend, profile_path=None):
+    """Подменяет платформенный бэкенд (тесты, бенчмарки); возвращает новый PasteEngine."""
+    global _input_backend, _paste_engine
+    _input_backend = backend
+    _paste_engine = PasteEngine(backend, profile_path)
+    return _paste_engine
+
+
+# ------------ Paste engine -------------
+def _poll(cond, timeout: float, first_wait: float = 0.0) -> bool:
+    """Ждёт cond() с нарастающим шагом 2→20 мс до дедлайна. True — условие выполнилось."""
+    t_end = time.perf_counter() + timeout
+    if first_wait > 0:
+        time.sleep(min(first_wait, timeout))
+    step = 0.002
+    while True:
+        if cond(): return True
+        left = t_end - time.perf_counter()
+        if left <= 0: return False
+        time.sleep(min(step, left)); step = min(step * 2, 0.02)
+
+class PasteEngine:
+    """Вставка по готовности вместо фиксированных пауз: окно на переднем плане, фокус
+    на нужном контроле, номер буфера обмена сменился — и сразу Ctrl+V.
+
+    Сколько каждое условие занимает у конкретного приложения, запоминается (EWMA):
+    первая проверка делается около ожидаемого момента, дедлайн растягивается для медленных.
+    """
+    ALPHA = 0.3
+    SAVE_EVERY_SEC = 10.0
+    NO_SEQ_SETTLE_SEC = 0.05        # без номера буфера — короткая пауза вместо опроса
+
+    def __init__(self, backend: InputBackend, profile_path=None):
+        self.backend = backend
+        self.profile_path = profile_path
+        self.profiles = {}          # app → {этап: ewma_ms, "n": …, "timeouts": …}
+        self._lock = threading.Lock()
+        self._dirty, self._saved_at = False, 0.0
+        if profile_path and Path(profile_path).exists():
+            try: self.profiles = json.loads(Path(profile_path).read_text(encoding="utf-8"))
+            except (OSError, ValueError): pass
+
+    def _wait(self, app: str, stage: str, cond, base_timeout: float) -> bool:
+        prof = self.profiles.get(app, {})
+        expect = prof.get(stage, 0.0) / 1000
+        t0 = time.perf_counter()
+        ok = _poll(cond, max(base_timeout, min(3 * expect, 2.0)), first_wait=0.7 * expect)
+        self._learn(app, stage, (time.perf_counter() - t0) * 1000, ok)
+        return ok
+
+    def _learn(self, app: str, stage: str, ms: float, ok: bool):
+        if not app or not CFG.get("paste_profiles", True):
+            return
+        prof = self.profiles.setdefault(app, {})
+        prev = prof.get(stage)
+        prof[stage] = round(ms if prev is None else prev + self.ALPHA * (ms - prev), 2)
+        prof["n"] = prof.get("n", 0) + 1
+        if not ok: prof["timeouts"] = prof.get("timeouts", 0) + 1
+        self._dirty = True
+
+    def save_profiles(self, force: bool = False):
+        if not (self.profile_path and self._dirty):
+            return
+        if not force and time.monotonic() - self._saved_at < self.SAVE_EVERY_SEC:
+            return
+        try:
+            Path(self.profile_path).write_text(json.dumps(self.profiles, ensure_ascii=False, indent=1), encoding="utf-8")
+            self._dirty, self._saved_at = False, time.monotonic()
+        except OSError as e:
+            print(f"[WARN] paste profiles: {e}")
+
+    def paste(self, text: str, win=None, restore_focus: bool = True) -> bool:
+        """True — все условия выполнились до Ctrl+V; False — вставили по истечении дедлайна."""
+        be = self.backend
+        with self._lock:
+            ready = True
+            win = win or _last_window_hwnd or be.foreground()
+            app = be.app_id(win) if win else ""
+            focus_timeout = float(CFG.get("paste_focus_timeout_sec", 0.5))
+            if restore_focus and win:
+                with _timed(None, "paste_focus"):
+                    ctrl = be.focus_control(win)
+                    if be.foreground() != win or (ctrl and be.current_focus(win) != ctrl):
+                        be.activate(win, ctrl)
+                        ready = self._wait(app, "activate", lambda: be.foreground() == win, focus_timeout)
+                        if ctrl and ready:
+                            ready = self._wait(app, "focus", lambda: be.current_focus(win) == ctrl, focus_timeout)
+            with _timed(None, "paste_clipboard"):
+                seq0 = be.clipboard_seq()
+                try:
+                    be.set_clipboard(text)
+                except Exception as e:
+                    print(f"[WARN] clipboard: {e}")
+                if seq0 is None:
+                    time.sleep(self.NO_SEQ_SETTLE_SEC)
+                else:
+                    ready &= self._wait(app, "clipboard", lambda: be.clipboard_seq() != seq0,
+                                        float(CFG.get("paste_clipboard_timeout_sec", 0.3)))
+            with _timed(None, "paste_keys"):
+                be.release_modifiers()
+                be.send_paste()
+            self.save_profiles()
+            return ready
+
+_paste_engine = None
+
+def paste_profiles_path():
+    return CFG_PATH.with_name("ru2en_paste_profiles.json")
+
+def get_paste_engine() -> PasteEngine:
+    global _paste_engine
+    if _paste_engine is None:
+        _paste_engine = PasteEngine(get_input_backend(),
+                                    paste_profiles_path() if CFG.get("paste_profiles", True) else None)
+    return _paste_engine
+
+def paste_text(text: str, restore_focus: bool = True, hwnd_win=None):
+    """Буфер → возврат фокуса → Ctrl+V, каждое действие — как только цель готова."""
+    return get_paste_engine().paste(text, hwnd_win, restore_focus)
+
+# ------------ Jobs -------------
+class PasteOrder:
+    """Вставки идут строго в порядке нажатий хоткея, даже если поздняя запись обработалась раньше."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._issued = 0
+        self._next = 1
+        self._released = set()
+
+    def reserve(self) -> int:
+        with self._cond:
+            self._issued += 1
+            return self._issued
+
+    def wait_turn(self, seq: int):
+        with self._cond:
+            self._cond.wait_for(lambda: self._next >= seq)
+
+    def release(self, seq: int):
+        """Задание вставило текст или сошло с дистанции — пропускаем следующее."""
+        with self._cond:
+            self._released.add(seq)
+            while self._next in self._released:
+                self._released.discard(self._next)
+                self._next += 1
+            self._cond.notify_all()
+
+PASTE_ORDER = PasteOrder()
+
+class RecordingJob:
+    """Одна запись: свой буфер, свой поток записи, окно для вставки и место в очереди вставок."""
+    _ids = itertools.count(1)
+
+    def __init__(self, window_hwnd=None, status_cb=None, on_done=None):
+        self.id = next(self._ids)
+        self.seq = PASTE_ORDER.reserve()
+        self.window_hwnd = window_hwnd
+        self.status_cb = status_cb
+        self.on_done = on_done
+        self.buffer = AudioBuffer(float(CFG.get("buffer_initial_sec", 60)))
+        self.streamer = None
+        self.speculation = None     # SpeculativeTranslation при stream_stt + speculative_translation
+        self.pipeline = "one_shot" if one_shot_active() else "two_hop"
+        self.rec_done = threading.Event()
+        self.future = None          # обработка на PIPELINE (можно отменить)
+
+    def stop(self):
+        """Останавливает запись; поток записи остановит аудиопоток, допишет хвост и закроет буфер."""
+        self.buffer.stop()
+
+    def cancel(self) -> bool:
+        self.stop()
+        return bool(self.future and self.future.cancel())
+
+    def status(self, msg: str):
+        if self.status_cb: self.status_cb(f"#{self.id}: {msg}" if _jobs_running > 1 else msg)
+
+def begin_job(status_cb=None, on_done=None):
+    """Старт новой записи. Предыдущая может ещё обрабатываться в пуле."""
+    global _active_job, _last_window_hwnd
+    with _jobs_lock:
+        if _active_job is not None:
+            return _active_job
+        hwnd = get_input_backend().foreground()
+        _last_window_hwnd = hwnd
+        job = _active_job = RecordingJob(hwnd, status_cb, on_done)
+    threading.Thread(target=start_recording, kwargs={"status_cb": job.status_cb, "job": job}, daemon=True).start()
+    prewarm_client()
+    prewarm_transcriber()
+    prewarm_translator()
+    return job
+
+def end_job():
+    """Стоп текущей записи и передача её в пул обработки."""
+    global _active_job
+    with _jobs_lock:
+        job, _active_job = _active_job, None
+    if job is None:
+        return None
+    job.stop()
+    job.future = PIPELINE.submit(process_job_async(job))
+    return job
+
+def cancel_jobs() -> int:
+    """Отменяет текущую запись и всю незавершённую обработку (зависшие запросы в том числе)."""
+    global _active_job
+    with _jobs_lock:
+        job, _active_job = _active_job, None
+    if job is not None:
+        job.stop()
+        PASTE_ORDER.release(job.seq)
+    return PIPELINE.cancel_all()
+
+# ------------ Incremental paste -------------
+class IncrementalPaster:
+    """Вставляет куски текста по мере готовности в отдельном потоке, не тормозя чтение токенов.
+
+    Фокус возвращается только перед первым куском. В конце весь текст кладётся в буфер,
+    чтобы ручной Ctrl+V вставил его целиком, если приложение заблокировало автовставку.
+    """
+    def __init__(self, seq: int = None, window_hwnd=None):
+        self.seq = seq
+        self.window_hwnd = window_hwnd
+        self._q = queue.Queue()
+        self._pieces = []
+        self.first_paste_at = None
+        # контекст задания: вложенные замеры paste_focus/paste_clipboard/paste_keys — в его тайминги
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._run,), daemon=True)
+        self._thread.start()
+
+    def put(self, piece: str):
+        self._q.put(piece)
+
+    def _run(self):
+        while True:
+            piece = self._q.get()
+            if piece is None: break
+            if not self._pieces and self.seq is not None:
+                PASTE_ORDER.wait_turn(self.seq)
+            paste_text(piece, restore_focus=not self._pieces, hwnd_win=self.window_hwnd)
+            self._pieces.append(piece)
+            if self.first_paste_at is None: self.first_paste_at = time.perf_counter()
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+        try: get_input_backend().set_clipboard("".join(self._pieces))
+        except Exception: pass
 
 # ------------ Processing -------------
-def stop_and_process(status_cb=None, on_done=None):
-    recording_flag.clear()
+_jobs_running = 0               # задания, которые сейчас обрабатываются на PIPELINE
+
+async def process_job_async(job, status_cb=None, on_done=None):
+    """Обработка остановленной записи: VAD → STT → стиль → вставка в очередь хоткеев.
+
+    Корутина на PIPELINE: отменяется через job.future/cancel_jobs(), ограничена job_deadline_sec.
+    """
+    global _jobs_running
+    t_start = time.perf_counter()
+    timings = {}
+    _stage_timings.set(timings)
+    status_cb = status_cb or job.status
+    on_done = on_done or job.on_done
+    _jobs_running += 1
+    result = "error"
     try:
-        mode_label = "Русский (без перевода)" if CFG.get("output_mode","english").lower()=="russian" \
-                     else "Английский (перевод и стиль)"
-        if status_cb: status_cb(f"Обработка… Режим: {mode_label}")
-
-        if not frames:
-            if status_cb: status_cb("Ничего не записано."); return
-        audio_np = np.concatenate(frames, axis=0).astype(np.int16)
-        duration_sec = len(audio_np) / SAMPLE_RATE
-        if duration_sec < 0.5:
-            if status_cb: status_cb(f"Запись слишком короткая ({duration_sec:.1f}с). Повторите."); return
-        if audio_np.size == 0 or np.max(np.abs(audio_np)) < 200:
-            if status_cb: status_cb("Тишина/слишком тихо. Повторите."); return
-
-        with tempfile.TemporaryDirectory() as td:
-            wav = str(Path(td) / "input.wav")
-            save_wav(audio_np, wav)
-
-            raw = stt_transcribe(wav)
-            if not raw:
-                if status_cb: status_cb("Пустой результат STT."); return
-
-            if CFG.get("output_mode","english").lower() == "russian":
-                final_text = raw.strip()
+        slots = PIPELINE.slots()
+        with _timed(timings, "queue"):
+            await slots.acquire()
+        try:
+            delivered = await asyncio.wait_for(_process_job(job, timings, t_start, status_cb, on_done),
+                                               float(CFG.get("job_deadline_sec", 180.0)) or None)
+        finally:
+            slots.release()
+        result = "ok" if delivered else "empty"
+    except asyncio.CancelledError:
+        result = "cancelled"
+        if job.streamer: job.streamer.cancel()
+        if status_cb: status_cb("Отменено.")
+        raise
+    except asyncio.TimeoutError:
+        result = "timeout"
+        if job.streamer: job.streamer.cancel()
+        if status_cb: status_cb(f"[ERR] Превышено время обработки ({CFG.get('job_deadline_sec')} с).")
+    except Exception as e:
+        if status_cb: status_cb(f"[ERR] {e}")
+    finally:
+        _jobs_running -= 1
+        if job.speculation: job.speculation.cancel()
+        PASTE_ORDER.release(job.seq)
+        timings["total"] = (time.perf_counter() - t_start) * 1000
+        _record_run(timings, job.pipeline, result)
+
+async def _process_job(job, timings, t_start, status_cb, on_done):
+    pipeline = job.pipeline
+    buf, streamer = job.buffer, job.streamer
+    mode_label = "Русский (без перевода)" if CFG.get("output_mode","english").lower()=="russian" \
+                 else "Английский (перевод и стиль)"
+    if status_cb: status_cb(f"Обработка… Режим: {mode_label}")
+    # поток записи дописывает хвост и закрывает устройство
+    with _timed(timings, "rec_stop"):
+        await asyncio.to_thread(job.rec_done.wait, 2.0)
+
+    if not len(buf):
+        if streamer: streamer.cancel()
+        if status_cb: status_cb("Ничего не записано."); return False
+    # длинная запись: начало уже распознано и выброшено из буфера, в нём только хвост
+    long_take = bool(streamer and streamer.discarded)
+    audio_np = buf.view()
+    duration_sec = len(buf) / SAMPLE_RATE
+    METRICS.inc("audio_seconds_total", duration_sec, kind="recorded")
+    if duration_sec < 0.5:
+        if streamer: streamer.cancel()
+        if status_cb: status_cb(f"Запись слишком короткая ({duration_sec:.1f}с). Повторите."); return False
+    if not long_take:
+        with _timed(timings, "vad"):
+            speech, segs = trim_silence(audio_np)
+        if not segs:
+            if streamer: streamer.cancel()
+            if status_cb: status_cb("Тишина/слишком тихо. Повторите."); return False
+        METRICS.inc("audio_seconds_total", sum(e - s for s, e in segs), kind="speech")
+        if CFG.get("vad_trim", True):
+            audio_np = speech
+
+    cache = get_stt_cache() if not long_take else None
+    stt_key = stt_cache_key(audio_np, pipeline) if cache is not None else None
+    raw = cache.get(stt_key) if cache is not None else None
+    try:
+        with _timed(timings, "stt", stt_model_for(pipeline)):
+            if raw is not None:
+                if streamer: streamer.cancel()
+            elif streamer and streamer.submitted:
+                # сегменты уже распознаются по ходу записи; ждём только хвост
+                raw = await streamer.finish_async()
             else:
-                force_en = looks_like_russian(raw)
-                final_text = literal_rewrite_or_translate(raw, CFG["style_profile"], force_english=force_en)
-
-        global _last_text
-        _last_text = final_text
-        if on_done: on_done(final_text)
+                if streamer: streamer.cancel()
+                raw = await stt_chunked_async(audio_np, pipeline=pipeline)
+    except Exception as e:
+        path = await asyncio.to_thread(save_failed_audio, buf.view())
+        if path is None: raise
+        raise RuntimeError(f"STT: {e}. Запись сохранена: {path}") from e
+    if not raw:
+        if status_cb: status_cb("Пустой результат STT."); return False
+    if cache is not None and not isinstance(raw, PartialTranscript): cache.put(stt_key, raw)
+
+    global _last_clip
+    _last_clip = {"raw": raw, "pipeline": pipeline, "window_hwnd": job.window_hwnd}
+    await _deliver_async(raw, pipeline, timings, t_start, status_cb, on_done, job.seq, job.window_hwnd,
+                         job.speculation)
+    return True
+
+def stop_and_process(status_cb=None, on_done=None, job=None):
+    """Синхронная обёртка: без job останавливает текущую запись и ждёт её обработки."""
+    global _active_job
+    if job is None:
+        with _jobs_lock:
+            job, _active_job = _active_job, None
+        if job is None:
+            if status_cb: status_cb("Ничего не записано."); return
+        job.stop()
+    try:
+        PIPELINE.run(process_job_async(job, status_cb, on_done))
+    except CancelledError:
+        pass
 
-        if CFG["auto_paste"]:
-            paste_text(final_text)
-            if status_cb: status_cb("Вставлено в активное поле.")
-        else:
-            if status_cb: status_cb("Готово. Используйте Ctrl+V вручную.")
+async def _deliver_async(raw: str, pipeline: str, timings: dict, t_start: float, status_cb=None, on_done=None,
+                         seq: int = None, window_hwnd=None, speculation=None):
+    """Стиль/перевод готовой расшифровки и вставка, когда подойдёт очередь seq.
+
+    speculation — перевод, начатый во время записи: остаётся досчитать только хвост.
+    """
+    def translate(force_en, on_piece=None):
+        if speculation is not None:
+            return speculation.finish_async(raw, CFG["style_profile"], force_en, on_piece)
+        return translate_cached_async(raw, CFG["style_profile"], force_en, on_piece)
+
+    pasted = False
+    if CFG.get("output_mode","english").lower() == "russian":
+        final_text = raw.strip()
+    elif pipeline == "one_shot" and not style_needs_pass(CFG["style_profile"]):
+        final_text = raw.strip()
+    elif CFG["auto_paste"] and CFG.get("incremental_paste"):
+        # предложения вставляются, пока модель дописывает остальные
+        force_en = looks_like_russian(raw)
+        paster = IncrementalPaster(seq, window_hwnd)
+        try:
+            with _timed(timings, "style", get_translator(CFG["style_profile"], force_en).name):
+                final_text = await translate(force_en, paster.put)
+        finally:
+            with _timed(timings, "paste"):
+                await asyncio.to_thread(paster.close)
+        if paster.first_paste_at:
+            timings["first_text"] = (paster.first_paste_at - t_start) * 1000
+        pasted = True
+    else:
+        force_en = looks_like_russian(raw)
+        with _timed(timings, "style", get_translator(CFG["style_profile"], force_en).name):
+            final_text = await translate(force_en)
+
+    global _last_text
+    _last_text = final_text
+    if on_done: on_done(final_text)
+
+    if pasted:
+        if status_cb: status_cb("Вставлено в активное поле.")
+    elif CFG["auto_paste"]:
+        if seq is not None:
+            with _timed(timings, "paste_wait"):
+                await asyncio.to_thread(PASTE_ORDER.wait_turn, seq)
+        with _timed(timings, "paste"):
+            await asyncio.to_thread(paste_text, final_text, True, window_hwnd)
+        if status_cb: status_cb("Вставлено в активное поле.")
+    else:
+        if status_cb: status_cb("Готово. Используйте Ctrl+V вручную.")
+
+async def restyle_async(status_cb=None, on_done=None):
+    """Повторно оформляет последнюю запись с текущим профилем стиля — без повторного STT."""
+    t_start = time.perf_counter()
+    timings = {}
+    _stage_timings.set(timings)
+    clip = _last_clip
+    if not clip:
+        if status_cb: status_cb("Нет последней записи."); return
+    seq = PASTE_ORDER.reserve()
+    result = "error"
+    try:
+        if status_cb: status_cb(f"Перестилизация… Стиль: {CFG['style_profile']}")
+        await _deliver_async(clip["raw"], clip["pipeline"], timings, t_start, status_cb, on_done,
+                             seq, clip.get("window_hwnd"))
+        result = "ok"
+    except asyncio.CancelledError:
+        result = "cancelled"
+        if status_cb: status_cb("Отменено.")
+        raise
     except Exception as e:
         if status_cb: status_cb(f"[ERR] {e}")
+    finally:
+        PASTE_ORDER.release(seq)
+        timings["total"] = (time.perf_counter() - t_start) * 1000
+        _record_run(timings, "restyle", result)
 
-# ------------ Hotkey (WinAPI) -------------
+def restyle_last_clip(status_cb=None, on_done=None):
+    try:
+        PIPELINE.run(restyle_async(status_cb, on_done))
+    except CancelledError:
+        pass
+
+# ------------ Batch -------------
+BATCH_EXTS = {".wav", ".flac", ".ogg", ".oga", ".opus", ".mp3", ".aiff", ".aif"}
+
+def decode_audio_file(path):
+    """Файл → (моно int16, частота). Многоканальное аудио сводится в моно."""
+    audio, sr = sf.read(str(path), dtype="int16", always_2d=True)
+    if audio.shape[1] > 1:
+        audio = audio.mean(axis=1).astype(np.int16)
+    else:
+        audio = audio[:, 0]
+    return np.ascontiguousarray(audio), sr
+
+async def process_file_async(path) -> dict:
+    """Один файл пакета: декодирование → VAD → STT → стиль. Без вставки и GUI."""
+    timings, t0 = {}, time.perf_counter()
+    _stage_timings.set(timings)
+    rec = {"file": str(path), "status": "ok"}
+    pipeline = "one_shot" if one_shot_active() else "two_hop"
+    try:
+        with _timed(timings, "decode"):
+            audio, sr = await asyncio.to_thread(decode_audio_file, path)
+        rec["duration_sec"] = round(len(audio) / sr, 3)
+        METRICS.inc("audio_seconds_total", rec["duration_sec"], kind="recorded")
+        with _timed(timings, "vad"):
+            speech, segs = await asyncio.to_thread(trim_silence, audio, sr)
+        if not segs:
+            rec["status"] = "silence"
+            return rec
+        if CFG.get("vad_trim", True):
+            audio = speech
+        rec["speech_sec"] = round(sum(e - s for s, e in segs), 3)
+        METRICS.inc("audio_seconds_total", rec["speech_sec"], kind="speech")
+        with _timed(timings, "stt", stt_model_for(pipeline)):
+            raw = await stt_cached_async(audio, pipeline, sr)
+        rec["raw"] = raw
+        if isinstance(raw, PartialTranscript):
+            rec["status"] = "partial"      # не «ok»: повторный запуск пакета распознает файл заново
+        if CFG.get("output_mode","english").lower() == "russian" or not raw or \
+                (pipeline == "one_shot" and not style_needs_pass(CFG["style_profile"])):
+            rec["text"] = raw
+        else:
+            force_en = looks_like_russian(raw)
+            with _timed(timings, "style", get_translator(CFG["style_profile"], force_en).name):
+                rec["text"] = await translate_cached_async(raw, CFG["style_profile"], force_en)
+    except Exception as e:
+        rec.update(status="error", error=f"{type(e).__name__}: {e}")
+    finally:
+        timings["total"] = (time.perf_counter() - t0) * 1000
+        rec["timings_ms"] = {k: round(v, 1) for k, v in timings.items()}
+        METRICS.finish_run(timings, "batch", rec["status"])
+    return rec
+
+def _batch_done_files(out_path) -> set:
+    """Файлы, уже обработанные в прошлых запусках (ошибки и частичные расшифровки переделываем)."""
+    done = set()
+    if not out_path.exists():
+        return done
+    for line in out_path.read_text(encoding="utf-8").splitlines():
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue   # недописанная строка после прерванного запуска
+        if rec.get("status") in ("ok", "silence"):
+            done.add(rec.get("file"))
+    return done
+
+async def run_batch_async(todo, out, concurrency: int, progress=print) -> dict:
+    """Файлы пакета корутинами на PIPELINE; строки JSONL пишутся по мере готовности."""
+    counts = {"ok": 0, "silence": 0, "partial": 0, "error": 0}
+    sem = asyncio.Semaphore(max(1, concurrency))
+    async def one(p):
+        async with sem:
+            return await process_file_async(p)
+    for i, task in enumerate(asyncio.as_completed([one(p) for p in todo]), 1):
+        rec = await task
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n"); out.flush()
+        counts[rec["status"]] += 1
+        if progress:
+            progress(f"[{i}/{len(todo)}] {rec['status']:<7} {Path(rec['file']).name} "
+                     f"{rec['timings_ms']['total'] / 1000:.1f}s {rec.get('error', '')}".rstrip())
+    return counts
+
+def run_batch(src_dir, out_path=None, concurrency: int = None, recursive: bool = False, progress=print) -> dict:
+    """Пакетная обработка каталога с записью результатов в JSONL.
+
+    Запуск можно прервать и повторить: уже обработанные файлы пропускаются.
+    """
+    src = Path(src_dir)
+    out_path = Path(out_path) if out_path else src / "ru2en_batch.jsonl"
+    files = sorted(p for p in (src.rglob("*") if recursive else src.iterdir())
+                   if p.is_file() and p.suffix.lower() in BATCH_EXTS)
+    done = _batch_done_files(out_path)
+    todo = [p for p in files if str(p) not in done]
+    workers = max(1, int(concurrency or CFG.get("batch_concurrency", 4)))
+    if progress: progress(f"[batch] {len(todo)} из {len(files)} файлов, параллельно: {workers} → {out_path}")
+    with open(out_path, "a", encoding="utf-8") as out:
+        counts = PIPELINE.run(run_batch_async(todo, out, workers, progress))
+    counts.update(total=len(files), skipped=len(files) - len(todo))
+    return counts
+
+def batch_main(argv) -> int:
+    ap = argparse.ArgumentParser(prog="python -m ru2en batch",
+                                 description="Пакетная расшифровка/перевод каталога аудиофайлов в JSONL.")
+    ap.add_argument("dir", help="каталог с аудио (wav, flac, ogg, mp3, …)")
+    ap.add_argument("--out", help="JSONL с результатами (по умолчанию <dir>/ru2en_batch.jsonl)")
+    ap.add_argument("-j", "--concurrency", type=int, default=None, help="параллельных файлов")
+    ap.add_argument("-r", "--recursive", action="store_true", help="обходить подкаталоги")
+    ap.add_argument("--mode", choices=["english", "russian"], help="режим вывода (по умолчанию из конфига)")
+    ap.add_argument("--style", choices=list(STYLE_MAP), help="профиль стиля (по умолчанию из конфига)")
+    ap.add_argument("--metrics", help="куда выгрузить метрики этапов: .json или .prom (по умолчанию metrics_dump_path)")
+    args = ap.parse_args(argv)
+    if args.mode: CFG["output_mode"] = args.mode
+    if args.style: CFG["style_profile"] = args.style
+    counts = run_batch(args.dir, args.out, args.concurrency, args.recursive)
+    metrics_path = args.metrics or CFG.get("metrics_dump_path")
+    if metrics_path: METRICS.dump(metrics_path)
+    print(f"[batch] готово: ok={counts['ok']} тишина={counts['silence']} ошибки={counts['error']} "
+          f"пропущено={counts['skipped']}")
+    return 1 if counts["error"] else 0
+
+# ------------ Hotkey -------------
 def _toggle_record_hotkey_threadsafe():
-    """WM_HOTKEY → безопасно дергаем GUI-цикл."""
+    """Хоткей бэкенда → безопасно дергаем GUI-цикл. Стоп отдаёт запись в пул и сразу освобождает хоткей."""
     if ROOT is None:
-        if not recording_flag.is_set():
-            global _last_window_hwnd
-            _last_window_hwnd = _get_foreground_hwnd()
-            threading.Thread(target=start_recording, kwargs={"status_cb": None}, daemon=True).start()
-        else:
-            threading.Thread(target=stop_and_process, kwargs={"status_cb": None, "on_done": None}, daemon=True).start()
+        if _active_job is None: begin_job()
+        else: end_job()
         return
 
     def run():
         if hasattr(ROOT, "_pull_cfg"): ROOT._pull_cfg()
-        if not recording_flag.is_set():
-            global _last_window_hwnd
-            _last_window_hwnd = _get_foreground_hwnd()
-            threading.Thread(target=start_recording, kwargs={"status_cb": ROOT.status}, daemon=True).start()
+        if _active_job is None:
+            begin_job(status_cb=ROOT.status, on_done=ROOT.on_done)
         else:
-            threading.Thread(target=stop_and_process, kwargs={"status_cb": ROOT.status, "on_done": ROOT.on_done}, daemon=True).start()
+            end_job()
     ROOT.after(0, run)
 
-def hotkey_message_loop():
+def hotkey_message_loop(on_hotkey=None):
+    """Цикл сообщений WinAPI для WinInputBackend: RegisterHotKey → WM_HOTKEY."""
+    global _hotkey_tid
+    on_hotkey = on_hotkey or _toggle_record_hotkey_threadsafe
     if not (RegisterHotKey and GetMessageW):
         print("[WARN] WinAPI хоткей недоступен."); return
+    _hotkey_tid = win32api.GetCurrentThreadId() if win32api else None
     if not RegisterHotKey(None, HK_ID, MOD_CONTROL, 0x20):
         print("[WARN] RegisterHotKey: не удалось зарегистрировать Ctrl+Пробел. Конфликт или нет прав.")
         return
@@ -412,35 +2889,33 @@ def hotkey_message_loop():
             time.sleep(0.05)
             continue
         if msg.message == WM_HOTKEY and msg.wParam == HK_ID:
-            _toggle_record_hotkey_threadsafe()
+            on_hotkey()
         TranslateMessage(ctypes.byref(msg))
         DispatchMessageW(ctypes.byref(msg))
     UnregisterHotKey(None, HK_ID)
 
 def start_hotkey_thread_if_enabled():
     if not CFG.get("global_hotkey_enabled", True): return
-    global _hotkey_thread
-    if _hotkey_thread and _hotkey_thread.is_alive(): return
-    _hotkey_stop_evt.clear()
-    _hotkey_thread = threading.Thread(target=hotkey_message_loop, daemon=True)
-    _hotkey_thread.start()
+    backend = get_input_backend()
+    if backend.start_hotkey(_toggle_record_hotkey_threadsafe) and backend.name != "win32":
+        print(f"[INFO] Глобальный хоткей активен: Ctrl+Пробел ({backend.name})")
 
 def stop_hotkey_thread():
-    _hotkey_stop_evt.set()
-    try:
-        if PostQuitMessage: PostQuitMessage(0)
-    except Exception:
-        pass
+    get_input_backend().stop_hotkey()
 
 # ------------ GUI (settings only) -------------
 STYLE_CHOICES = ["нейтральный", "официальный", "дружелюбный", "разговорный", "лаконичный", "академический"]
-STT_CHOICES = ["gpt-4o-mini-transcribe", "gpt-4o-transcribe"]
+STT_CHOICES = ["gpt-4o-mini-transcribe", "gpt-4o-transcribe", "local:small", "local:large-v3-turbo"]
 STYLE_MODEL_CHOICES = ["gpt-4o-mini", "gpt-5-mini", "gpt-5-nano"]
 OUTPUT_MODE_CHOICES = ["Английский (перевод и стиль)", "Русский (без перевода)"]
+PIPELINE_CHOICES = ["Два запроса (STT → стиль)", "Один запрос (перевод в STT)"]
 
 def _mode_label(v: str) -> str:
     return "Английский (перевод и стиль)" if v == "english" else "Русский (без перевода)"
 
+def _pipeline_label(v: str) -> str:
+    return PIPELINE_CHOICES[1] if v == "one_shot" else PIPELINE_CHOICES[0]
+
 INSTR_TEXT = (
     "Как пользоваться:\n"
     "1) Откройте чат и поставьте курсор в поле ввода.\n"
@@ -453,14 +2928,14 @@ INSTR_TEXT = (
     "Важно: некоторые чаты блокируют автоматику. Тогда используйте ручной Ctrl+V."
 )
 
-class App(tk.Tk):
+class App(tk.Tk if tk else object):
     def __init__(self):
         super().__init__()
         global ROOT, GUI_HWND
         ROOT = self
 
         self.title("RU→EN / RU→RU (OpenAI) — хоткей-режим")
-        self.geometry("780x560"); self.resizable(False, False)
+        self.geometry("780x665"); self.resizable(False, False)
         try: self.tk.call('tk','scaling',1.2)
         except Exception: pass
 
@@ -469,6 +2944,8 @@ class App(tk.Tk):
 
         pad={'padx':10,'pady':6}
         self.status_var=tk.StringVar(value="Готов. Горячая клавиша: Ctrl+Пробел")
+        self.timings_var=tk.StringVar(value="")
+        self._timings_runs=0
 
         r=0
         ttk.Label(self,text="Режим вывода:").grid(column=0,row=r,sticky="w",**pad)
@@ -487,12 +2964,16 @@ class App(tk.Tk):
         self.cb_style=ttk.Combobox(self,values=STYLE_CHOICES,state="readonly",width=32)
         self.cb_style.set(CFG["style_profile"]); self.cb_style.grid(column=1,row=r+3,sticky="w",**pad)
 
+        ttk.Label(self,text="Конвейер (для EN):").grid(column=0,row=r+4,sticky="w",**pad)
+        self.cb_pipeline=ttk.Combobox(self,values=PIPELINE_CHOICES,state="readonly",width=32)
+        self.cb_pipeline.set(_pipeline_label(CFG.get("pipeline_mode","two_hop"))); self.cb_pipeline.grid(column=1,row=r+4,sticky="w",**pad)
+
         # --- OpenAI API ключ ---
-        ttk.Label(self,text="OpenAI API ключ:").grid(column=0,row=r+4,sticky="w",**pad)
+        ttk.Label(self,text="OpenAI API ключ:").grid(column=0,row=r+5,sticky="w",**pad)
 
         self.key_var = tk.StringVar(value=CFG.get("openai_api_key",""))
         self.entry_key = ttk.Entry(self, textvariable=self.key_var, width=44, show="•")
-        self.entry_key.grid(column=1,row=r+4,sticky="w",**pad)
+        self.entry_key.grid(column=1,row=r+5,sticky="w",**pad)
 
         # Контекстное меню «Вставить»
         self._key_menu = tk.Menu(self, tearoff=0)
@@ -504,34 +2985,42 @@ class App(tk.Tk):
 
         # Кнопка «Вставить из буфера»
         self.btn_paste_key = ttk.Button(self, text="Вставить из буфера", command=self.paste_key_from_clipboard)
-        self.btn_paste_key.grid(column=1,row=r+5,sticky="w",**pad)
+        self.btn_paste_key.grid(column=1,row=r+6,sticky="w",**pad)
 
         # Показать/скрыть ключ
         self.var_show_key = tk.BooleanVar(value=False)
         ttk.Checkbutton(self, text="Показать ключ", variable=self.var_show_key, command=self.toggle_key_visibility)\
-            .grid(column=1,row=r+6,sticky="w",**pad)
+            .grid(column=1,row=r+7,sticky="w",**pad)
 
         # Индикатор длины/хвоста
         self.key_info_var = tk.StringVar(value=self._format_key_info(self.key_var.get()))
         ttk.Label(self, textvariable=self.key_info_var, foreground="#444")\
-            .grid(column=1,row=r+7,sticky="w",**pad)
+            .grid(column=1,row=r+8,sticky="w",**pad)
         self.key_var.trace_add("write", lambda *_: self.key_info_var.set(self._format_key_info(self.key_var.get())))
 
         # Инструкция
-        ttk.Label(self,text="Краткая инструкция:").grid(column=0,row=r+8,sticky="nw",**pad)
+        ttk.Label(self,text="Краткая инструкция:").grid(column=0,row=r+9,sticky="nw",**pad)
         self.instr=tk.Text(self,height=10,width=70,wrap="word")
         self.instr.insert("1.0", INSTR_TEXT); self.instr.config(state="disabled")
-        self.instr.grid(column=0,row=r+9,columnspan=2,sticky="we",padx=10,pady=(0,6))
+        self.instr.grid(column=0,row=r+10,columnspan=2,sticky="we",padx=10,pady=(0,6))
 
         # Кнопки
         self.btn_save=ttk.Button(self,text="Сохранить настройки",command=self.save_settings)
-        self.btn_save.grid(column=0,row=r+10,sticky="w",**pad)
+        self.btn_save.grid(column=0,row=r+11,sticky="w",**pad)
 
         self.btn_quit=ttk.Button(self,text="Выход",command=self.on_quit)
-        self.btn_quit.grid(column=1,row=r+10,sticky="e",**pad)
+        self.btn_quit.grid(column=1,row=r+11,sticky="e",**pad)
+
+        self.btn_restyle=ttk.Button(self,text="Перестилизовать последнюю запись",command=self.restyle_last)
+        self.btn_restyle.grid(column=0,row=r+12,sticky="w",**pad)
+
+        self.btn_cancel=ttk.Button(self,text="Отменить",command=self.cancel_jobs)
+        self.btn_cancel.grid(column=1,row=r+12,sticky="e",**pad)
 
         ttk.Label(self,textvariable=self.status_var,foreground="#006400")\
-            .grid(column=0,row=r+11,columnspan=2,sticky="w",**pad)
+            .grid(column=0,row=r+13,columnspan=2,sticky="w",**pad)
+        ttk.Label(self,textvariable=self.timings_var,foreground="#555555")\
+            .grid(column=0,row=r+14,columnspan=2,sticky="w",**pad)
 
         # хоткей
         self.after(200, self._start_hotkey)
@@ -541,11 +3030,23 @@ class App(tk.Tk):
     def _start_hotkey(self):
         CFG["global_hotkey_enabled"]=True
         start_hotkey_thread_if_enabled()
+        prewarm_client()
+        prewarm_transcriber()
+        prewarm_translator()
+        start_metrics_server()
+        self._refresh_timings()
+
+    def _refresh_timings(self):
+        # задания завершаются в потоке PIPELINE — строку этапов обновляем опросом из цикла Tk
+        if METRICS.runs != self._timings_runs:
+            self._timings_runs = METRICS.runs
+            self.timings_var.set(f"Последний запуск ({METRICS.last_label}): {format_timings(METRICS.last)}")
+        self.after(500, self._refresh_timings)
 
     def print_banner(self):
         print("RU→EN / RU→RU — хоткей-режим")
         print("Hotkey: Ctrl+Пробел", "(вкл)" if CFG.get("global_hotkey_enabled",True) else "(выкл)")
-        print(f"Mode={CFG.get('output_mode','english')} | STT={CFG['stt_model']} | StyleModel={CFG['style_model']} | Style={CFG['style_profile']} | AutoPaste={CFG.get('auto_paste',True)}")
+        print(f"Mode={CFG.get('output_mode','english')} | Pipeline={CFG.get('pipeline_mode','two_hop')} | STT={CFG['stt_model']} | StyleModel={CFG['style_model']} | Style={CFG['style_profile']} | AutoPaste={CFG.get('auto_paste',True)}")
 
     def status(self,msg): 
         self.status_var.set(msg); self.update_idletasks()
@@ -577,32 +3078,55 @@ class App(tk.Tk):
         CFG["stt_model"]       = self.cb_stt.get()
         CFG["style_model"]     = self.cb_style_model.get()
         CFG["style_profile"]   = self.cb_style.get()
+        CFG["pipeline_mode"]   = "one_shot" if self.cb_pipeline.get() == PIPELINE_CHOICES[1] else "two_hop"
         CFG["auto_paste"]      = True
         CFG["global_hotkey_enabled"]= True
-        CFG["openai_api_key"]  = self.key_var.get().strip()
+        key = self.key_var.get().strip()
+        if key != CFG.get("openai_api_key"): invalidate_clients()
+        CFG["openai_api_key"]  = key
 
     def save_settings(self):
         self._pull_cfg(); save_cfg(CFG)
         messagebox.showinfo("Сохранено", f"Настройки сохранены в {CFG_PATH}")
 
+    def restyle_last(self):
+        self._pull_cfg()
+        PIPELINE.submit(restyle_async(self.status, self.on_done))
+
+    def cancel_jobs(self):
+        n = cancel_jobs()
+        self.status(f"Отменено заданий: {n}." if n else "Нет активных заданий.")
+
     def on_quit(self):
         try: stop_hotkey_thread()
         except Exception: pass
+        PIPELINE.stop()
+        stop_metrics_server()
+        if _armed_input is not None: _armed_input.close()
         self.destroy()
 
     def on_done(self, text): pass  # совместимость с коллбеком
 
 # ------------- Main -------------
-def main():
-    if platform.system().lower() == "windows":
-        pass
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "batch":
+        return batch_main(argv[1:])
+    if tk is None:
+        print("[ERR] tkinter недоступен: окно настроек не запустить (пакетный режим работает: ru2en batch).")
+        return 1
+    # хоткей живой сразу; openai/numpy/звук догружаются в фоне, пока строится окно
+    start_hotkey_thread_if_enabled()
+    preload_modules()
+    if CFG.get("prearm_stream"):
+        threading.Thread(target=arm_input, daemon=True).start()
     app = App()
     app.protocol("WM_DELETE_WINDOW", app.on_quit)
     app.mainloop()
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         try: stop_hotkey_thread()
         except Exception: pass
\ No newline at end of file
@@ -1,9 +1,24 @@
+import asyncio
+import contextvars
 import json
 import importlib
+import subprocess
 import sys
 import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import CancelledError
 from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+try:
+    import soundfile  # noqa: F401 — кодирование и пакетный режим; остальным тестам не нужен
+    HAS_SOUNDFILE = True
+except (ImportError, OSError):
+    HAS_SOUNDFILE = False
 
 
 class Ru2EnConfigTests(unittest.TestCase):
@@ -53,5 +68,1248 @@ class Ru2EnTextTests(unittest.TestCase):
         self.assertFalse(self.module.looks_like_russian("Hello world"))
 
 
+class Ru2EnStreamingTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_streaming_stt_segments_and_joins_in_order(self):
+        sr = self.module.SAMPLE_RATE
+        seen = []
+
+        async def fake_stt(audio):
+            seen.append(len(audio))
+            return f"seg{len(seen)}"
+
+        buf = self.module.AudioBuffer(initial_sec=1.0)
+        streamer = self.module.StreamingSTT(buf, segment_sec=1.0, transcribe=fake_stt)
+        rng = np.random.default_rng(0)
+        block = (rng.standard_normal(sr // 10) * 3000).astype(np.int16)
+        for _ in range(25):  # 2.5 s живой речи блоками по 100 мс
+            buf.write(block)
+            streamer.pump()
+        buf.close()
+        n = streamer.submitted
+        self.assertGreaterEqual(n, 2)
+        self.assertEqual(streamer.finish(), " ".join(f"seg{i}" for i in range(1, n + 2)))
+        self.assertEqual(sum(seen), 25 * len(block))
+
+    def test_audio_buffer_grows_and_keeps_views_valid(self):
+        buf = self.module.AudioBuffer(initial_sec=0.001)
+        first = np.arange(10, dtype=np.int16)
+        buf.write(first)
+        early = buf.view()
+        for _ in range(100):
+            buf.write(np.ones(160, dtype=np.int16))
+        self.assertEqual(len(buf), 10 + 100 * 160)
+        np.testing.assert_array_equal(early, first)
+        np.testing.assert_array_equal(buf.view(0, 10), first)
+        self.assertFalse(buf.view().flags.writeable)
+        buf.close()
+        buf.write(first)
+        self.assertEqual(len(buf), 10 + 100 * 160)
+        self.assertFalse(buf.wait_for(10 ** 9))
+
+    def test_quiet_cut_prefers_silence(self):
+        sr = self.module.SAMPLE_RATE
+        audio = np.full(sr, 5000, dtype=np.int16)
+        audio[int(sr * 0.8):int(sr * 0.85)] = 0
+        cut = self.module._quiet_cut(audio, int(sr * 0.6))
+        self.assertTrue(int(sr * 0.8) <= cut <= int(sr * 0.85))
+
+    def test_audio_buffer_discard_keeps_absolute_positions(self):
+        buf = self.module.AudioBuffer(initial_sec=0.001)
+        buf.write(np.arange(100, dtype=np.int16))
+        early = buf.view(90, 100)
+        buf.discard(80)
+        buf.write(np.arange(100, 110, dtype=np.int16))
+        self.assertEqual((len(buf), buf.start), (110, 80))
+        np.testing.assert_array_equal(buf.view(), np.arange(80, 110, dtype=np.int16))
+        np.testing.assert_array_equal(buf.view(95, 105), np.arange(95, 105, dtype=np.int16))
+        np.testing.assert_array_equal(early, np.arange(90, 100, dtype=np.int16))
+
+
+class Ru2EnChunkingTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_stitch_drops_words_repeated_across_overlap(self):
+        stitch = self.module._stitch_transcripts
+        self.assertEqual(stitch(["мы поедем завтра утром", "Завтра утром, на поезде."], [False, True]),
+                         "мы поедем завтра утром на поезде.")
+        # без перекрытия совпадения не трогаем
+        self.assertEqual(stitch(["да да", "да нет"], [False, False]), "да да да нет")
+
+    def test_plan_chunks_cuts_in_silence_under_limit(self):
+        sr = self.module.SAMPLE_RATE
+        audio = np.full(sr * 25, 5000, dtype=np.int16)
+        for t in (8.5, 17.0):
+            audio[int(sr * t):int(sr * (t + 0.2))] = 0
+        chunks = self.module.plan_chunks(audio, sr, max_sec=10.0)
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual((chunks[0][0], chunks[-1][1]), (0, len(audio)))
+        for (a, b, ov), (c, _, _) in zip(chunks, chunks[1:]):
+            self.assertLessEqual(b - a, sr * 10)
+            self.assertEqual(b, c)  # тишина найдена — перекрытия нет
+        # сплошная речь: куски перекрываются
+        chunks = self.module.plan_chunks(np.full(sr * 25, 5000, dtype=np.int16), sr, max_sec=10.0)
+        self.assertTrue(all(ov for _, _, ov in chunks[1:]))
+        self.assertLess(chunks[1][0], chunks[0][1])
+
+    def test_long_recording_is_discarded_as_chunks_are_submitted(self):
+        sr = self.module.SAMPLE_RATE
+
+        seen = []
+
+        async def fake_stt(audio):
+            seen.append(len(audio))
+            return f"w{len(seen)}"
+
+        buf = self.module.AudioBuffer(initial_sec=1.0)
+        chunker = self.module.StreamingSTT(buf, 2.0, fake_stt, discard_after_sec=2.0)
+        block = np.full(sr // 10, 5000, dtype=np.int16)
+        for _ in range(100):  # 10 с записи
+            buf.write(block)
+            chunker.pump()
+        buf.close()
+        self.assertTrue(chunker.discarded)
+        self.assertLessEqual(len(buf.view()), 3 * sr)
+        text = chunker.finish()
+        self.assertEqual(text, " ".join(f"w{i}" for i in range(1, len(seen) + 1)))
+
+    def test_chunked_stt_runs_concurrently_and_tolerates_a_failed_chunk(self):
+        sr = self.module.SAMPLE_RATE
+        self.module.CFG.update({"stt_chunk_sec": 5.0, "stt_chunk_concurrency": 2})
+        audio = np.full(sr * 14, 5000, dtype=np.int16)
+        for t in (4.5, 9.0):
+            audio[int(sr * t):int(sr * (t + 0.2))] = 0
+        active, peak, calls = 0, 0, []
+
+        async def fake_stt(chunk, sr=None, pipeline="two_hop"):
+            nonlocal active, peak
+            active += 1; peak = max(peak, active)
+            calls.append(len(chunk))
+            n = len(calls)
+            await asyncio.sleep(0.05)
+            active -= 1
+            if n == 2:
+                raise RuntimeError("boom")
+            return f"part{n}"
+
+        self.module.stt_pcm_async = fake_stt
+        text = asyncio.run(self.module.stt_chunked_async(audio, sr))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(peak, 2)
+        self.assertEqual(text, "part1 […] part3")
+        self.assertEqual(self.module.METRICS._counters.get(("stt_chunk_errors_total", ()), 0), 1)
+
+    def test_partial_transcript_is_not_cached(self):
+        sr = self.module.SAMPLE_RATE
+        self.module.CFG.update({"stt_chunk_sec": 5.0, "stt_cache": True, "cache_persist": False})
+        audio = np.full(sr * 14, 5000, dtype=np.int16)
+        for t in (4.5, 9.0):
+            audio[int(sr * t):int(sr * (t + 0.2))] = 0
+        calls, fail = [], [True]
+
+        async def fake_stt(chunk, sr=None, pipeline="two_hop"):
+            calls.append(len(chunk))
+            if fail[0] and len(calls) == 2:
+                raise RuntimeError("boom")
+            return f"part{len(calls)}"
+
+        self.module.stt_pcm_async = fake_stt
+        first = asyncio.run(self.module.stt_cached_async(audio, "two_hop", sr))
+        self.assertIsInstance(first, self.module.PartialTranscript)
+        self.assertIn("[…]", first)
+        fail[0] = False
+        second = asyncio.run(self.module.stt_cached_async(audio, "two_hop", sr))
+        self.assertEqual(len(calls), 6)                     # упавший кусок распознан заново
+        self.assertNotIn("[…]", second)
+        third = asyncio.run(self.module.stt_cached_async(audio, "two_hop", sr))
+        self.assertEqual(third, second)                     # полный результат уже из кэша
+        self.assertEqual(len(calls), 6)
+
+
+class _FakeInputStream:
+    def __init__(self, callback=None, **kwargs):
+        self.callback = callback
+        self.closed = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def feed(self, block):
+        self.callback(block.tobytes(), len(block), None, None)
+
+
+class Ru2EnPrearmTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.streams = []
+        self.module.sd = SimpleNamespace(RawInputStream=lambda **kw: self.streams.append(_FakeInputStream(**kw))
+                                         or self.streams[-1])
+        self.module.CFG.update(prearm_stream=True, prearm_preroll_sec=0.3, prearm_idle_sec=0.3, stream_stt=False)
+
+    def test_hotkey_start_includes_preroll_without_reopening_device(self):
+        sr = self.module.SAMPLE_RATE
+        self.module.arm_input()
+        stream = self.streams[0]
+        before = (np.arange(sr // 2) % 20000).astype(np.int16)
+        for i in range(0, len(before), 1600):
+            stream.feed(before[i:i + 1600])
+        job = self.module.RecordingJob()
+        threading.Thread(target=self.module.start_recording, kwargs={"job": job}, daemon=True).start()
+        deadline = time.time() + 5
+        while len(job.buffer) < int(0.3 * sr) and time.time() < deadline:
+            time.sleep(0.01)
+        after = np.full(1600, 7, dtype=np.int16)
+        stream.feed(after)
+        job.stop()
+        tail = np.full(800, 9, dtype=np.int16)
+        stream.feed(tail)                                   # блок, пришедший уже после нажатия «стоп»
+        self.assertTrue(job.rec_done.wait(5))
+        expected = np.concatenate((before[-int(0.3 * sr):], after, tail))
+        np.testing.assert_array_equal(job.buffer.view(), expected)
+        self.assertEqual(len(self.streams), 1)
+        stream.feed(after)                                  # после стопа — снова в кольцо
+        self.assertEqual(len(job.buffer), len(expected))
+        time.sleep(0.6)
+        self.assertTrue(stream.closed)                      # простой дольше prearm_idle_sec
+
+
+class Ru2EnVadTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.sr = self.module.SAMPLE_RATE
+        self.rng = np.random.default_rng(1)
+
+    def _speech(self, sec):
+        return (self.rng.standard_normal(int(sec * self.sr)) * 3000).astype(np.int16)
+
+    def _silence(self, sec):
+        return (self.rng.standard_normal(int(sec * self.sr)) * 20).astype(np.int16)
+
+    def test_trim_silence_trims_ends_and_shrinks_pauses(self):
+        audio = np.concatenate([self._silence(1.0), self._speech(1.0), self._silence(3.0),
+                                self._speech(0.5), self._silence(1.0)])
+        trimmed, segs = self.module.trim_silence(audio)
+        self.assertEqual(len(segs), 2)
+        self.assertAlmostEqual(segs[0][0], 1.0, delta=0.05)
+        self.assertAlmostEqual(segs[1][0], 5.0, delta=0.05)
+        max_len = (1.5 + self.module.CFG["vad_max_pause_sec"] + 2 * self.module.CFG["vad_pad_sec"]) * self.sr
+        self.assertLessEqual(len(trimmed), max_len)
+        self.assertGreater(len(trimmed), 1.5 * self.sr)
+
+    def test_single_click_is_not_speech(self):
+        audio = self._silence(2.0)
+        audio[self.sr:self.sr + 40] = 30000
+        self.assertEqual(self.module.vad_segments(audio), [])
+        trimmed, segs = self.module.trim_silence(audio)
+        self.assertEqual(segs, [])
+        self.assertEqual(len(trimmed), 0)
+
+
+@unittest.skipUnless(HAS_SOUNDFILE, "нужен soundfile")
+class Ru2EnEncodeTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_encode_audio_roundtrip_in_memory(self):
+        import io
+        import soundfile as sf
+        sr = self.module.SAMPLE_RATE
+        audio = (np.sin(np.arange(sr) / 8.0) * 8000).astype(np.int16)
+        wav_name, wav_bytes = self.module.encode_audio(audio, "wav")
+        flac_name, flac_bytes = self.module.encode_audio(audio, "flac")
+        self.assertEqual(wav_name, "audio.wav")
+        self.assertEqual(flac_name, "audio.flac")
+        self.assertLess(len(flac_bytes), len(wav_bytes))
+        decoded, decoded_sr = sf.read(io.BytesIO(flac_bytes), dtype="int16")
+        self.assertEqual(decoded_sr, sr)
+        np.testing.assert_array_equal(decoded, audio)
+
+    def test_encode_audio_unknown_format_falls_back_to_wav(self):
+        name, data = self.module.encode_audio(np.zeros(160, dtype=np.int16), "mp9")
+        self.assertEqual(name, "audio.wav")
+        self.assertTrue(data.startswith(b"RIFF"))
+
+
+class Ru2EnClientTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_client_is_cached_per_key_and_invalidated(self):
+        cfg = self.module.CFG
+        cfg["openai_api_key"] = "sk-one"
+        first = self.module.get_async_client()
+        self.assertIs(self.module.get_async_client(), first)
+        cfg["openai_api_key"] = "sk-two"
+        second = self.module.get_async_client()
+        self.assertIsNot(second, first)
+        self.module.invalidate_clients()
+        self.assertIsNot(self.module.get_async_client(), second)
+
+    def test_get_async_client_requires_key(self):
+        self.module.CFG["openai_api_key"] = ""
+        old = self.module.os.environ.pop("OPENAI_API_KEY", None)
+        try:
+            with self.assertRaises(RuntimeError):
+                self.module.get_async_client()
+        finally:
+            if old is not None:
+                self.module.os.environ["OPENAI_API_KEY"] = old
+
+
+class Ru2EnPipelineTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.module.CFG.update(output_mode="english", auto_paste=False, stream_stt=False, cache_persist=False)
+        rng = np.random.default_rng(2)
+        self.audio = (rng.standard_normal(self.module.SAMPLE_RATE) * 3000).astype(np.int16)
+        self.calls = []
+        self.transcript = "Привет"
+
+        async def fake_stt(a, sr=None, pipeline="two_hop"):
+            if pipeline == "one_shot":
+                self.calls.append("translate"); return "Hello"
+            self.calls.append("stt"); return self.transcript
+
+        async def fake_style(t, p, force_english, on_piece=None):
+            self.calls.append("style"); return "Hi"
+
+        self.module.stt_pcm_async = fake_stt
+        self.module.style_pass_async = fake_style
+
+    def _job(self):
+        job = self.module.RecordingJob()
+        job.buffer.write(self.audio)
+        job.buffer.close()
+        job.rec_done.set()
+        return job
+
+    def _run(self):
+        done = []
+        self.module.stop_and_process(on_done=done.append, job=self._job())
+        return done
+
+    def test_one_shot_neutral_skips_style_pass(self):
+        self.module.CFG.update(pipeline_mode="one_shot", style_profile="нейтральный")
+        self.assertEqual(self._run(), ["Hello"])
+        self.assertEqual(self.calls, ["translate"])
+        self.assertIn("stt", self.module.LAST_TIMINGS)
+        self.assertNotIn("style", self.module.LAST_TIMINGS)
+
+    def test_one_shot_styled_profile_runs_style_pass(self):
+        self.module.CFG.update(pipeline_mode="one_shot", style_profile="официальный")
+        self.assertEqual(self._run(), ["Hi"])
+        self.assertEqual(self.calls, ["translate", "style"])
+
+    def test_repeated_audio_skips_stt_and_restyle_reuses_transcript(self):
+        self.module.CFG.update(pipeline_mode="two_hop", style_profile="нейтральный")
+        self.assertEqual(self._run(), ["Hi"])
+        self._run()
+        self.assertEqual(self.calls.count("stt"), 1)
+        self.module.CFG["style_profile"] = "официальный"
+        done = []
+        self.module.restyle_last_clip(on_done=done.append)
+        self.assertEqual(done, ["Hi"])
+        self.assertEqual(self.calls, ["stt", "style", "style"])
+
+    def test_paste_order_follows_hotkey_order(self):
+        self.module.CFG.update(pipeline_mode="two_hop", auto_paste=True)
+        pasted = []
+        self.module.paste_text = lambda text, restore_focus=True, hwnd_win=None: pasted.append(text)
+        release_first = threading.Event()
+
+        async def slow_style(text, profile, force_english, on_piece=None):
+            if text == "первая":
+                await asyncio.to_thread(release_first.wait, 5)
+            return text.upper()
+
+        self.module.style_pass_async = slow_style
+        first = self._job()
+        self.audio = self.audio[::-1].copy()  # другой отпечаток — мимо STT-кэша
+        second = self._job()
+        self.transcript = "первая"
+        t1 = threading.Thread(target=self.module.stop_and_process, kwargs={"job": first})
+        t1.start()
+        time.sleep(0.1)
+        self.transcript = "вторая"
+        t2 = threading.Thread(target=self.module.stop_and_process, kwargs={"job": second})
+        t2.start()
+        time.sleep(0.2)
+        self.assertEqual(pasted, [])  # вторая готова, но ждёт очереди первой
+        release_first.set()
+        t1.join(5); t2.join(5)
+        self.assertEqual(pasted, ["ПЕРВАЯ", "ВТОРАЯ"])
+
+    def test_deadline_and_cancel_stop_hung_jobs(self):
+        statuses = []
+
+        async def hung_stt(a, sr=None, pipeline="two_hop"):
+            await asyncio.sleep(30)
+
+        self.module.stt_pcm_async = hung_stt
+        self.module.CFG["job_deadline_sec"] = 0.2
+        t0 = time.perf_counter()
+        self.module.stop_and_process(status_cb=statuses.append, job=self._job())
+        self.assertLess(time.perf_counter() - t0, 5)
+        self.assertIn("[ERR]", statuses[-1])
+
+        self.module.CFG["job_deadline_sec"] = 60
+        job = self._job()
+        job.status_cb = statuses.append
+        job.future = self.module.PIPELINE.submit(self.module.process_job_async(job))
+        time.sleep(0.2)
+        self.assertEqual(self.module.cancel_jobs(), 1)
+        self.assertRaises(CancelledError, job.future.result, 5)
+        time.sleep(0.1)
+        self.assertEqual(statuses[-1], "Отменено.")
+        self.assertEqual(self.module.PASTE_ORDER._next, job.seq + 1)
+
+    def test_two_hop_runs_stt_then_style(self):
+        self.module.CFG.update(pipeline_mode="two_hop", style_profile="нейтральный")
+        self.assertEqual(self._run(), ["Hi"])
+        self.assertEqual(self.calls, ["stt", "style"])
+        self.assertIn("style", self.module.LAST_TIMINGS)
+        self.assertTrue({"queue", "rec_stop", "vad", "stt", "total"} <= set(self.module.METRICS.last))
+
+
+
+def _chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _FakeStreamingClient:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.requests.append(kwargs)
+
+        async def chunks():
+            for t in self.tokens:
+                yield _chunk(t)
+        return chunks()
+
+
+class Ru2EnStreamingStyleTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_split_complete_sentences_waits_for_following_space(self):
+        split = self.module.split_complete_sentences
+        self.assertEqual(split("Pi is 3.14"), ([], "Pi is 3.14"))
+        self.assertEqual(split("Done. Next one"), (["Done."], " Next one"))
+        self.assertEqual(split("Is it? Yes!\nAnd"), (["Is it? Yes!"], "\nAnd"))
+
+    def test_stream_flushes_pieces_as_sentences_complete(self):
+        client = _FakeStreamingClient(["Hello", " there.", " How", " are you?", " Fine"])
+        self.module.get_async_client = lambda: client
+        pieces = []
+        text = self.module.literal_rewrite_or_translate_stream("Привет", "нейтральный", True, pieces.append)
+        self.assertEqual(pieces, ["Hello there.", " How are you?", " Fine"])
+        self.assertEqual(text, "Hello there. How are you? Fine")
+        self.assertTrue(client.requests[0]["stream"])
+        self.assertEqual(client.requests[0]["stream_options"], {"include_usage": True})
+
+
+class Ru2EnPromptTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+
+    def test_registry_keeps_static_prefix_and_puts_text_last(self):
+        m = self.module
+        self.assertEqual(set(m.PROMPT_TEMPLATES), set(m.STYLE_MAP))
+        a = m._style_request("Первый текст.", "официальный", True)["messages"]
+        b = m._style_request("Совсем другой.", "официальный", True, context="Перед ним.")["messages"]
+        self.assertEqual(a[0]["content"], b[0]["content"])
+        self.assertIn(m.STYLE_MAP["официальный"], a[0]["content"])
+        self.assertTrue(a[1]["content"].endswith("Первый текст."))
+        for tpl in m.PROMPT_TEMPLATES.values():
+            self.assertTrue(tpl.system(True).startswith(m.PROMPT_RULES))
+        self.assertEqual(m.get_prompt("нет такого").profile, "нейтральный")
+
+    def test_cached_tokens_are_counted(self):
+        usage = SimpleNamespace(prompt_tokens=1200, prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+        resp = SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=" Hi. "))])
+        requests = []
+
+        async def create(**kwargs):
+            requests.append(kwargs)
+            return resp
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        self.module.get_async_client = lambda: client
+        self.module.CFG["style_model"] = "gpt-4o-mini"
+        self.assertEqual(self.module.literal_rewrite_or_translate("Привет.", "нейтральный", True), "Hi.")
+        counters = self.module.METRICS._counters
+        self.assertEqual(counters[("prompt_cached_tokens_total", (("model", "gpt-4o-mini"),))], 1024)
+        self.assertEqual(counters[("prompt_tokens_total", (("model", "gpt-4o-mini"),))], 1200)
+
+    def test_stream_usage_is_dropped_for_servers_that_reject_it(self):
+        requests = []
+
+        async def create(**kwargs):
+            requests.append(kwargs)
+            if "stream_options" in kwargs:
+                raise _ApiError(400)
+
+            async def chunks():
+                yield _chunk("Hi. ")
+            return chunks()
+
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        self.module.get_async_client = lambda: client
+        stream = self.module.literal_rewrite_or_translate_stream
+        self.assertEqual(stream("Привет.", "нейтральный", True, lambda p: None), "Hi.")
+        self.assertEqual(stream("Пока.", "нейтральный", True, lambda p: None), "Hi.")
+        self.assertEqual(["stream_options" in r for r in requests], [True, False, False])
+        self.module.CFG["stream_usage"] = False
+        self.module._no_stream_usage.clear()
+        self.assertEqual(self.module._stream_usage_kwargs(), {})
+
+    def test_prompt_version_is_part_of_translation_cache_key(self):
+        key = self.module.translation_cache_key
+        self.assertNotEqual(key("Привет", "нейтральный", "m", True, "нейтральный@v2"),
+                            key("Привет", "нейтральный", "m", True, "нейтральный@v3"))
+
+
+class Ru2EnParallelTranslationTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.module.CFG.update({"parallel_translation": True, "translate_group_chars": 20,
+                                "translate_concurrency": 2, "translate_context_sentences": 1,
+                                "translation_cache": False})
+
+    def test_sentence_groups_keep_order_separators_and_context(self):
+        groups = self.module.sentence_groups("Раз два. Три четыре.\nПять шесть семь. Восемь.", 20, 1)
+        self.assertEqual(groups, [("", "Раз два. Три четыре.", ""),
+                                  ("\n", "Пять шесть семь.", "Три четыре."),
+                                  (" ", "Восемь.", "Пять шесть семь.")])
+
+    def test_paragraph_breaks_and_closing_quotes_survive_splitting(self):
+        text = "Один абзац.\n\nОн сказал «да.» Второй абзац."
+        self.assertEqual(self.module.split_sentences(text),
+                         [("", "Один абзац."), ("\n\n", "Он сказал «да.»"), (" ", "Второй абзац.")])
+        groups = self.module.sentence_groups(text, 100)
+        self.assertEqual(groups, [("", text, "")])
+        groups = self.module.sentence_groups(text, 12)
+        self.assertEqual("".join(sep + body for sep, body, _ in groups), text)
+
+    def test_groups_are_translated_concurrently_and_reassembled_in_order(self):
+        active, peak, seen = 0, 0, []
+
+        async def fake_style(text, style, force_english, on_piece=None, context=""):
+            nonlocal active, peak
+            active += 1; peak = max(peak, active)
+            seen.append((text, context))
+            await asyncio.sleep(0.08 if text.startswith("Раз") else 0.01)  # первая группа — самая долгая
+            active -= 1
+            out = text.upper()
+            if on_piece: on_piece(out)
+            return out
+
+        self.module.style_pass_async = fake_style
+        pieces = []
+        text = "Раз два. Три четыре.\nПять шесть семь. Восемь."
+        out = self.module.translate_cached(text, "официальный", True, pieces.append)
+        self.assertEqual(out, text.upper())
+        self.assertEqual("".join(pieces), text.upper())
+        self.assertEqual(peak, 2)
+        self.assertEqual(len(seen), 3)
+        self.assertIn(("Восемь.", "Пять шесть семь."), seen)
+
+    def test_context_goes_into_prompt_but_not_into_text(self):
+        req = self.module._style_request("Восемь.", "нейтральный", True, context="Семь.")
+        prompt = req["messages"][1]["content"]
+        self.assertIn("Семь.", prompt)
+        self.assertTrue(prompt.endswith("Text:\nВосемь."))
+
+
+class Ru2EnSpeculationTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.calls = []
+
+        async def fake_translate(text, style, force_english, on_piece=None):
+            self.calls.append(text)
+            out = f"<{text}>"
+            if on_piece: on_piece(out)
+            return out
+
+        self.module.translate_cached_async = fake_translate
+
+    def test_stable_sentences_are_translated_early_and_only_tail_at_stop(self):
+        spec = self.module.SpeculativeTranslation("нейтральный")
+        spec.update("Раз. Два")
+        spec.update("Раз. Два. Три")
+        pieces = []
+        out = self.module.PIPELINE.run(spec.finish_async("Раз. Два. Три четыре.", "нейтральный", True, pieces.append))
+        self.assertEqual(self.calls, ["Раз.", "Два.", "Три четыре."])
+        self.assertEqual(out, "<Раз.> <Два.> <Три четыре.>")
+        self.assertEqual("".join(pieces), out)
+
+    def test_changed_prefix_is_discarded(self):
+        spec = self.module.SpeculativeTranslation("нейтральный")
+        spec.update("Раз. Два.")
+        out = self.module.PIPELINE.run(spec.finish_async("Раз. Десять.", "нейтральный", True))
+        self.assertEqual(out, "<Раз. Десять.>")
+        self.assertEqual(self.module.METRICS._counters[("speculation_total", (("result", "discarded"),))], 1)
+        # сменили стиль во время записи — заготовки не годятся
+        spec = self.module.SpeculativeTranslation("нейтральный")
+        spec.update("Раз.")
+        self.assertEqual(self.module.PIPELINE.run(spec.finish_async("Раз.", "официальный", True)), "<Раз.>")
+
+    def test_streamer_reports_text_of_segments_done_in_order(self):
+        sr = self.module.SAMPLE_RATE
+        release = threading.Event()
+        seen = []
+
+        async def fake_stt(audio):
+            n = len(seen) + 1
+            seen.append(n)
+            if n == 1:
+                await asyncio.to_thread(release.wait, 5)   # первый сегмент отвечает последним
+            return f"Сегмент {n}."
+
+        buf = self.module.AudioBuffer(initial_sec=1.0)
+        streamer = self.module.StreamingSTT(buf, segment_sec=1.0, transcribe=fake_stt)
+        texts = []
+        streamer.on_text = texts.append
+        rng = np.random.default_rng(0)
+        for _ in range(25):
+            buf.write((rng.standard_normal(sr // 10) * 3000).astype(np.int16))
+            streamer.pump()
+        time.sleep(0.2)
+        self.assertEqual(texts, [])     # второй готов, но первый ещё нет
+        release.set()
+        buf.close()
+        streamer.finish()
+        self.assertTrue(texts[0].startswith("Сегмент 1. Сегмент 2."))
+        self.assertTrue(texts[-1].endswith(f"Сегмент {len(seen)}."))
+
+
+class _ApiError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+class Ru2EnRequestPolicyTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.module.CFG.update({"openai_max_retries": 2, "retry_backoff_sec": 0.001, "retry_backoff_max_sec": 0.01})
+
+    def run_policy(self, call, models=("m1",), **kw):
+        return asyncio.run(self.module.call_with_policy("stt_request", list(models), call, 1.0, **kw))
+
+    def test_retries_rate_limit_then_succeeds(self):
+        calls = []
+
+        async def call(model):
+            calls.append(model)
+            if len(calls) < 3:
+                raise _ApiError(429, retry_after="0")
+            return "ok"
+
+        self.assertEqual(self.run_policy(call), "ok")
+        self.assertEqual(calls, ["m1"] * 3)
+
+    def test_client_error_is_not_retried(self):
+        calls = []
+
+        async def call(model):
+            calls.append(model)
+            raise _ApiError(400)
+
+        with self.assertRaises(_ApiError):
+            self.run_policy(call, ("m1", "m2"))
+        self.assertEqual(calls, ["m1"])
+
+    def test_falls_back_to_next_model_after_retries(self):
+        calls = []
+
+        async def call(model):
+            calls.append(model)
+            if model == "m1":
+                raise _ApiError(503)
+            return model
+
+        self.assertEqual(self.run_policy(call, ("m1", "m2")), "m2")
+        self.assertEqual(calls, ["m1", "m1", "m1", "m2"])
+
+    def test_attempt_timeout_is_reported_as_stage_error(self):
+        self.module.CFG["openai_max_retries"] = 0
+
+        async def call(model):
+            await asyncio.sleep(5)
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(self.module.call_with_policy("stt_request", ["m1"], call, 0.05))
+
+    def test_hedge_fires_after_p95_and_takes_first_answer(self):
+        self.module.CFG.update({"hedge_requests": True, "hedge_min_samples": 5})
+        for _ in range(10):
+            self.module.METRICS.observe("stt_request", 20.0, "m1")
+        calls = []
+
+        async def call(model):
+            calls.append(model)
+            await asyncio.sleep(1.0 if len(calls) == 1 else 0.01)
+            return f"answer{len(calls)}"
+
+        t0 = time.perf_counter()
+        self.assertEqual(self.run_policy(call), "answer2")
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertEqual(self.module.METRICS._counters[("hedged_requests_total", (("stage", "stt_request"),))], 1)
+
+    @unittest.skipUnless(HAS_SOUNDFILE, "нужен soundfile")
+    def test_failed_audio_is_saved_next_to_config(self):
+        with tempfile.TemporaryDirectory() as d:
+            self.module.CFG_PATH = Path(d) / "ru2en.json"
+            audio = np.full(1600, 1000, dtype=np.int16)
+            first = self.module.save_failed_audio(audio)
+            second = self.module.save_failed_audio(audio)
+            self.assertEqual(first.parent, Path(d) / "ru2en_failed")
+            self.assertNotEqual(first, second)
+            self.assertTrue(first.exists() and second.exists())
+            self.module.CFG["save_failed_audio"] = False
+            self.assertIsNone(self.module.save_failed_audio(audio))
+
+    def test_stream_is_not_retried_after_first_piece(self):
+        calls, out = [], []
+
+        async def call(model):
+            calls.append(model)
+            out.append("Hello.")
+            raise _ApiError(502)
+
+        with self.assertRaises(_ApiError):
+            self.run_policy(call, retry_if=lambda: not out)
+        self.assertEqual(calls, ["m1"])
+
+    def _stream_client(self, delays):
+        async def create(**kwargs):
+            async def chunks():
+                for i, d in enumerate(delays):
+                    await asyncio.sleep(d)
+                    yield _chunk(f"Part{i}. ")
+            return chunks()
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    def test_stream_deadline_applies_to_gaps_not_to_whole_generation(self):
+        self.module.CFG["style_timeout_sec"] = 0.2
+        self.module.get_async_client = lambda: self._stream_client([0.1] * 5)   # 0.5 с всего
+        pieces = []
+        text = self.module.literal_rewrite_or_translate_stream("Привет", "нейтральный", True, pieces.append)
+        self.assertEqual(len(pieces), 5)
+        self.assertTrue(text.startswith("Part0."))
+        # поток встал после первого предложения: ошибка этапа, не дедлайн задания
+        self.module.get_async_client = lambda: self._stream_client([0.01, 0.01, 1.0])
+        pieces = []
+        with self.assertRaises(RuntimeError) as cm:
+            self.module.literal_rewrite_or_translate_stream("Привет", "нейтральный", True, pieces.append)
+        self.assertNotIsInstance(cm.exception, asyncio.TimeoutError)
+        self.assertEqual(pieces, ["Part0.", " Part1."])
+
+    def test_deadlines_scale_with_input_and_hedge_series_skip_failures(self):
+        stt = self.module.OpenAITranscriber()
+        self.assertGreater(stt.timeout(300.0), stt.timeout(5.0) + 60)
+
+        async def call(model):
+            with self.module._timed(None, "stt_request", model, only_ok=True):
+                await asyncio.sleep(0.01)
+                if len(calls) < 2:
+                    calls.append(model)
+                    raise _ApiError(503)
+            return "ok"
+
+        calls = []
+        self.assertEqual(self.run_policy(call), "ok")
+        self.assertEqual(self.module.METRICS.series("stt_request", "m1")["count"], 1)
+
+
+class _FakeWhisperModel:
+    instances = []
+
+    def __init__(self, ref, **kwargs):
+        self.ref, self.kwargs, self.calls = ref, kwargs, []
+        _FakeWhisperModel.instances.append(self)
+
+    def transcribe(self, pcm, **kwargs):
+        self.calls.append((pcm, kwargs))
+        return iter([SimpleNamespace(text=" Привет,"), SimpleNamespace(text=" мир. ")]), None
+
+
+class Ru2EnTranscriberTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        _FakeWhisperModel.instances = []
+        self._saved = sys.modules.get("faster_whisper")
+        sys.modules["faster_whisper"] = SimpleNamespace(WhisperModel=_FakeWhisperModel)
+
+    def tearDown(self):
+        if self._saved is None:
+            sys.modules.pop("faster_whisper", None)
+        else:
+            sys.modules["faster_whisper"] = self._saved
+
+    def test_engine_is_selected_by_stt_model(self):
+        get = self.module.get_transcriber
+        self.assertIsInstance(get("gpt-4o-transcribe"), self.module.OpenAITranscriber)
+        self.assertIs(get("gpt-4o-transcribe"), get("gpt-4o-mini-transcribe"))
+        local = get("local:small")
+        self.assertIsInstance(local, self.module.FasterWhisperTranscriber)
+        self.assertIs(get("local:small"), local)
+        self.assertIsNot(get("local:base"), local)
+        self.assertIsNone(local.timeout(600))
+        with self.assertRaises(TypeError):
+            self.module.Transcriber()
+        self.assertFalse(hasattr(self.module, "stt_transcribe"))
+
+    def test_local_model_loads_once_and_runs_off_the_loop(self):
+        self.module.CFG.update({"stt_model": "local:small", "translate_model": "local:small"})
+        sr = 8000
+        audio = np.full(sr, 1000, dtype=np.int16)
+        first = self.module.PIPELINE.run(self.module.stt_pcm_async(audio, sr))
+        self.module.PIPELINE.run(self.module.stt_pcm_async(audio, sr, "one_shot"))
+        self.assertEqual(first, "Привет, мир.")
+        self.assertEqual(len(_FakeWhisperModel.instances), 1)
+        model = _FakeWhisperModel.instances[0]
+        self.assertEqual((model.ref, model.kwargs["compute_type"]), ("small", "int8"))
+        (pcm, kw), (_, kw2) = model.calls
+        self.assertEqual((pcm.dtype, len(pcm)), (np.float32, 16000))  # пересэмплировано в 16 кГц
+        self.assertEqual((kw["task"], kw["language"], kw2["task"]), ("transcribe", "ru", "translate"))
+
+    def test_api_outage_falls_back_to_local_engine(self):
+        self.module.CFG.update({"stt_fallback_models": ["local:small"], "openai_max_retries": 0})
+
+        async def outage(self, inp, model, translate=False):
+            raise _ApiError(503)
+
+        self.module.OpenAITranscriber.transcribe = outage
+        text = self.module.PIPELINE.run(self.module.stt_pcm_async(np.full(16000, 1000, dtype=np.int16)))
+        self.assertEqual(text, "Привет, мир.")
+
+
+class _FakeCT2Translator:
+    calls = []
+
+    def __init__(self, path, **kwargs):
+        self.kwargs = kwargs
+
+    def translate_batch(self, batch, **kwargs):
+        _FakeCT2Translator.calls.append((batch, kwargs))
+        return [SimpleNamespace(hypotheses=[["en:" + t for t in toks if t != "</s>"]]) for toks in batch]
+
+
+class _FakeSentencePiece:
+    def __init__(self, model_file):
+        self.model_file = model_file
+
+    def encode(self, text, out_type=str):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+class Ru2EnTranslatorTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        _FakeCT2Translator.calls = []
+        self._saved = {k: sys.modules.get(k) for k in ("ctranslate2", "sentencepiece")}
+        sys.modules["ctranslate2"] = SimpleNamespace(Translator=_FakeCT2Translator)
+        sys.modules["sentencepiece"] = SimpleNamespace(SentencePieceProcessor=_FakeSentencePiece)
+        self.module.CFG.update({"local_mt_model": "/models/opus-mt-ru-en", "translation_cache": False})
+        self.chat_calls = []
+
+        async def fake_style(text, style, force_english, on_piece=None):
+            self.chat_calls.append(style)
+            return "llm"
+
+        self.module.style_pass_async = fake_style
+
+    def tearDown(self):
+        for k, v in self._saved.items():
+            if v is None: sys.modules.pop(k, None)
+            else: sys.modules[k] = v
+
+    def test_neutral_translation_is_local_and_batched_by_sentence(self):
+        pieces = []
+        text = self.module.translate_cached("Привет мир. Как дела?\n\nПока.", "нейтральный", True, pieces.append)
+        self.assertEqual(text, "en:Привет en:мир. en:Как en:дела?\n\nen:Пока.")
+        self.assertEqual(pieces, ["en:Привет en:мир.", " en:Как en:дела?", "\n\nen:Пока."])
+        self.assertEqual(len(_FakeCT2Translator.calls), 1)
+        batch, kwargs = _FakeCT2Translator.calls[0]
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(kwargs["max_batch_size"], 32)
+        self.assertEqual(self.chat_calls, [])
+
+    def test_other_styles_and_english_input_go_to_llm(self):
+        self.assertEqual(self.module.translate_cached("Привет.", "официальный", True), "llm")
+        self.assertEqual(self.module.translate_cached("Hello.", "нейтральный", False), "llm")
+        self.assertEqual(self.chat_calls, ["официальный", "нейтральный"])
+        self.assertEqual(_FakeCT2Translator.calls, [])
+
+    def test_missing_runtime_falls_back_to_llm(self):
+        sys.modules["ctranslate2"] = None   # import ctranslate2 → ImportError
+        self.module.CFG.update({"translation_cache": True, "cache_persist": False})
+        self.assertEqual(self.module.translate_cached("Привет.", "нейтральный", True), "llm")
+        self.assertIsInstance(self.module.get_translator("нейтральный", True), self.module.ChatTranslator)
+        # ответ LLM лежит под ключом LLM, а не локальной модели
+        m, prompt = self.module, self.module.get_prompt("нейтральный").id
+        cache = m.get_translation_cache()
+        self.assertEqual(cache.get(m.translation_cache_key("Привет.", "нейтральный", m.CFG["style_model"], True, prompt)),
+                         "llm")
+        self.assertIsNone(cache.get(m.translation_cache_key("Привет.", "нейтральный", "local:opus-mt-ru-en", True,
+                                                            prompt)))
+        with self.assertRaises(TypeError):
+            m.Translator()
+
+
+class Ru2EnCacheTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+        self.module.CFG_PATH = Path(self.td.name) / "ru2en.json"
+
+    def test_result_cache_lru_eviction_and_counters(self):
+        cache = self.module.ResultCache("t", max_entries=2)
+        cache.put("a", "1"); cache.put("b", "2")
+        self.assertEqual(cache.get("a"), "1")
+        cache.put("c", "3")  # вытесняет b — к нему дольше всех не обращались
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 2})
+
+    def test_result_cache_persists_and_expires(self):
+        db = self.module.cache_db_path()
+        cache = self.module.ResultCache("t", max_entries=8, ttl_sec=60, db_path=db)
+        cache.put("k", "v")
+        cache.close()
+        reopened = self.module.ResultCache("t", max_entries=8, ttl_sec=60, db_path=db)
+        self.assertEqual(reopened.get("k"), "v")
+        reopened.ttl = 1e-9
+        reopened._mem.clear()
+        self.assertIsNone(reopened.get("k"))
+        reopened.close()
+
+    def test_translate_cached_skips_llm_on_repeat(self):
+        calls = []
+
+        async def fake_style(t, p, force_english, on_piece=None):
+            calls.append(t); return "Status: done"
+
+        self.module.style_pass_async = fake_style
+        first = self.module.translate_cached("Статус:  готово ", "нейтральный", True)
+        second = self.module.translate_cached("Статус: готово", "нейтральный", True)
+        other_style = self.module.translate_cached("Статус: готово", "официальный", True)
+        self.assertEqual((first, second, other_style), ("Status: done",) * 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.module.get_translation_cache().stats()["hits"], 1)
+        self.module.get_translation_cache().close()
+
+
+class Ru2EnPasteEngineTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+        self.fake = self.module.FakeInputBackend(activate_delay=0.03, focus_delay=0.02, clipboard_delay=0.01)
+        self.fake.add_window(1, "editor", ctrl=11)
+        self.fake.add_window(2, "ru2en")
+        self.fake.set_foreground(2)
+        self.profiles = Path(self.td.name) / "profiles.json"
+        self.engine = self.module.set_input_backend(self.fake, self.profiles)
+
+    def test_paste_waits_for_readiness_instead_of_fixed_sleeps(self):
+        t0 = time.perf_counter()
+        self.assertTrue(self.module.paste_text("Hello", hwnd_win=1))
+        self.assertLess(time.perf_counter() - t0, 0.3)
+        self.assertEqual(self.fake.pasted, [(1, 11, "Hello")])
+        self.assertTrue({"activate", "focus", "clipboard"} <= set(self.engine.profiles["editor"]))
+
+    def test_slow_app_profile_is_learned_and_persisted(self):
+        self.module.CFG["paste_focus_timeout_sec"] = 0.05
+        self.fake.windows[1]["activate_delay"] = 0.12
+        self.assertFalse(self.engine.paste("one", 1))       # дедлайн истёк — Ctrl+V ушёл не туда
+        self.assertNotEqual(self.fake.pasted[-1][0], 1)
+        time.sleep(0.15)                                    # запоздалая активация доходит…
+        self.fake.set_foreground(2)                         # …и фокус снова уходит
+        self.assertTrue(self.engine.paste("two", 1))        # ожидание растянуто по профилю
+        self.assertEqual(self.fake.pasted[-1], (1, 11, "two"))
+        self.assertEqual(self.engine.profiles["editor"]["timeouts"], 1)
+        self.engine.save_profiles(force=True)
+        reloaded = self.module.PasteEngine(self.fake, self.profiles)
+        self.assertGreater(reloaded.profiles["editor"]["activate"], 40)
+
+
+    def test_incremental_paste_timings_reach_the_job(self):
+        timings = {}
+
+        def run():
+            self.module._stage_timings.set(timings)
+            paster = self.module.IncrementalPaster(window_hwnd=1)
+            paster.put("One.")
+            paster.put(" Two.")
+            paster.close()
+
+        contextvars.copy_context().run(run)
+        self.assertEqual([p[2] for p in self.fake.pasted], ["One.", " Two."])
+        self.assertTrue({"paste_focus", "paste_clipboard", "paste_keys"} <= set(timings))
+
+
+class Ru2EnInputBackendTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.module.CFG.update(output_mode="english", pipeline_mode="two_hop", auto_paste=True,
+                               stream_stt=False, cache_persist=False, paste_profiles=False)
+
+    def test_backend_selection_follows_config(self):
+        self.module.CFG["input_backend"] = "clipboard"
+        self.assertIs(type(self.module.get_input_backend()), self.module.InputBackend)
+        self.module._input_backend = None
+        self.module.CFG["input_backend"] = "x11"
+        backend = self.module.get_input_backend()
+        self.assertEqual(backend.name, "x11")
+        if not backend.xdotool:
+            self.assertIsNone(backend.foreground())
+
+    def test_fake_hotkey_records_and_pastes_into_start_window(self):
+        fake = self.module.FakeInputBackend(activate_delay=0.01, clipboard_delay=0.005)
+        fake.add_window(1, "editor", ctrl=11)
+        fake.add_window(2, "other")
+        fake.set_foreground(1)
+        self.module.set_input_backend(fake)
+        audio = (np.random.default_rng(4).standard_normal(self.module.SAMPLE_RATE) * 3000).astype(np.int16)
+
+        def fake_recording(status_cb=None, job=None):
+            job.buffer.write(audio)
+            job.buffer.wait_stopped()
+            job.buffer.close()
+            job.rec_done.set()
+
+        async def fake_stt(a, sr=None, pipeline="two_hop"):
+            return "Привет"
+
+        async def fake_style(t, p, force_english, on_piece=None):
+            return "Hi"
+
+        self.module.start_recording = fake_recording
+        self.module.stt_pcm_async = fake_stt
+        self.module.style_pass_async = fake_style
+        self.module.start_hotkey_thread_if_enabled()
+        fake.press_hotkey()
+        job = self.module._active_job
+        self.assertEqual(job.window_hwnd, 1)
+        fake.set_foreground(2)          # пользователь переключился, пока говорил
+        fake.press_hotkey()
+        self.assertIsNone(self.module._active_job)
+        job.future.result(5)
+        self.assertEqual(fake.pasted, [(1, 11, "Hi")])
+        self.module.stop_hotkey_thread()
+
+
+class Ru2EnStartupTests(unittest.TestCase):
+    def test_import_does_not_load_heavy_modules(self):
+        code = ("import sys, ru2en; heavy = ['openai', 'numpy', 'sounddevice', 'soundfile', 'pyperclip', 'pynput']; "
+                "print(','.join(m for m in heavy if m in sys.modules))")
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=str(Path(__file__).resolve().parents[1]), timeout=60)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip(), "")
+
+    def test_lazy_module_replaces_itself_on_first_use(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        module = importlib.import_module('ru2en')
+        self.assertIsInstance(module.np, module._LazyModule)
+        self.assertEqual(module.frame_rms(np.ones(320, dtype=np.int16), 160).shape, (2,))
+        self.assertIs(module.np, np)
+
+
+class Ru2EnMetricsTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+
+    def test_histogram_percentiles_and_prometheus_text(self):
+        m = self.module.Metrics()
+        for ms in range(1, 101):
+            m.observe("stt", float(ms), "gpt-4o-mini-transcribe")
+        m.inc("audio_seconds_total", 2.5, kind="speech")
+        stt = m.snapshot()["stages"]["stt"]["gpt-4o-mini-transcribe"]
+        self.assertEqual(stt["count"], 100)
+        self.assertAlmostEqual(stt["p50_ms"], 50.5, places=1)
+        self.assertGreaterEqual(stt["p99_ms"], 99)
+        text = m.to_prometheus()
+        self.assertIn('ru2en_stage_duration_seconds_bucket{stage="stt",model="gpt-4o-mini-transcribe",le="0.05"} 50', text)
+        self.assertIn('ru2en_stage_duration_seconds_count{stage="stt",model="gpt-4o-mini-transcribe"} 100', text)
+        self.assertIn('ru2en_audio_seconds_total{kind="speech"} 2.5', text)
+
+    def test_timed_stages_feed_job_dict_and_exports(self):
+        timings = {}
+        token = self.module._stage_timings.set(timings)
+        try:
+            with self.module._timed(None, "encode"):
+                pass
+        finally:
+            self.module._stage_timings.reset(token)
+        self.assertIn("encode", timings)
+        dump = Path(self.td.name) / "m.json"
+        self.module.CFG["metrics_dump_path"] = str(dump)
+        self.module._record_run({"stt": 12.0, "total": 20.0}, "two_hop")
+        data = json.loads(dump.read_text(encoding="utf-8"))
+        self.assertEqual(data["counters"]["jobs_total"]["pipeline=two_hop,status=ok"], 1)
+        self.assertEqual(data["last"]["total"], 20.0)
+
+        server = self.module.start_metrics_server(port=0)
+        self.addCleanup(self.module.stop_metrics_server)
+        self.assertIsNotNone(server)
+        host, port = server.server_address[:2]
+        import urllib.request
+        body = urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5).read().decode("utf-8")
+        self.assertIn('ru2en_stage_duration_seconds_count{stage="total"} 1', body)
+
+
+@unittest.skipUnless(HAS_SOUNDFILE, "нужен soundfile")
+class Ru2EnBatchTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.module.CFG.update(output_mode="english", pipeline_mode="two_hop", cache_persist=False)
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+        import soundfile as sf
+        rng = np.random.default_rng(3)
+        root = Path(self.td.name)
+        sf.write(root / "a.wav", (rng.standard_normal(16000) * 3000).astype(np.int16), 16000)
+        sf.write(root / "b.flac", (rng.standard_normal(8000) * 3000).astype(np.int16), 8000)
+        sf.write(root / "quiet.wav", np.zeros(16000, dtype=np.int16), 16000)
+        (root / "notes.txt").write_text("не аудио", encoding="utf-8")
+        self.stt_calls = []
+
+        async def fake_stt(a, sr=None, pipeline="two_hop"):
+            self.stt_calls.append(sr); return f"текст {len(a) // sr}"
+
+        async def fake_style(t, p, force_english, on_piece=None):
+            return "text"
+
+        self.module.stt_pcm_async = fake_stt
+        self.module.style_pass_async = fake_style
+
+    def test_batch_writes_jsonl_and_resumes(self):
+        out = Path(self.td.name) / "out.jsonl"
+        counts = self.module.run_batch(self.td.name, out, concurrency=2, progress=None)
+        self.assertEqual((counts["ok"], counts["silence"], counts["error"]), (2, 1, 0))
+        recs = {Path(r["file"]).name: r for r in map(json.loads, out.read_text(encoding="utf-8").splitlines())}
+        self.assertEqual(set(recs), {"a.wav", "b.flac", "quiet.wav"})
+        self.assertEqual(recs["a.wav"]["text"], "text")
+        self.assertEqual(recs["quiet.wav"]["status"], "silence")
+        self.assertEqual(sorted(self.stt_calls), [8000, 16000])
+
+        again = self.module.run_batch(self.td.name, out, progress=None)
+        self.assertEqual(again["skipped"], 3)
+        self.assertEqual(len(self.stt_calls), 2)
+
+    def test_partial_transcript_is_redone_on_rerun(self):
+        import soundfile as sf
+        sr = 16000
+        self.module.CFG.update(stt_chunk_sec=5.0, stt_cache=True)
+        src = Path(self.td.name) / "long"
+        src.mkdir()
+        audio = (np.random.default_rng(5).standard_normal(sr * 14) * 3000).astype(np.int16)
+        for t in (4.5, 9.0):
+            audio[int(sr * t):int(sr * (t + 0.3))] = 0
+        sf.write(src / "long.wav", audio, sr)
+        fail = [True]
+
+        async def flaky_stt(a, sr=None, pipeline="two_hop"):
+            self.stt_calls.append(sr)
+            if fail[0] and len(self.stt_calls) == 2:
+                raise RuntimeError("boom")
+            return f"кусок{len(self.stt_calls)}"
+
+        self.module.stt_pcm_async = flaky_stt
+        out = src / "out.jsonl"
+        counts = self.module.run_batch(src, out, progress=None)
+        self.assertEqual((counts["ok"], counts["partial"]), (0, 1))
+        self.assertIn("[…]", json.loads(out.read_text(encoding="utf-8"))["raw"])
+        fail[0] = False
+        again = self.module.run_batch(src, out, progress=None)
+        self.assertEqual((again["ok"], again["skipped"]), (1, 0))
+
+
+@unittest.skipUnless(HAS_SOUNDFILE, "нужен soundfile")
+class Ru2EnBenchTests(unittest.TestCase):
+    def setUp(self):
+        if 'ru2en' in sys.modules:
+            importlib.reload(sys.modules['ru2en'])
+        self.module = importlib.import_module('ru2en')
+        self.bench = importlib.import_module('bench_ru2en')
+
+    def test_e2e_against_mock_server_and_baseline_check(self):
+        clip = ("synth", self.bench.synth_speech(1.5))
+        mock = self.bench.MockOpenAI(stt_latency=0.01, stt_rtf=0.0, chat_ttft=0.01, chat_tps=2000)
+        with mock:
+            res = self.bench.bench_e2e([clip], mock, repeat=2)
+        self.assertTrue({"vad", "encode", "stt_request", "style", "total"} <= set(res["stages"]))
+        self.assertIn("/v1/audio/transcriptions", mock.requests)
+        self.assertIn("/v1/chat/completions", mock.requests)
+        self.assertGreater(res["peak_mib"], 0)
+        self.assertEqual(self.bench.compare_baseline(res, res), [])
+        slower = json.loads(json.dumps(res))
+        slower["stages"]["total"]["median_ms"] += 500
+        self.assertEqual([r[0] for r in self.bench.compare_baseline(slower, res)], ["total"])
+
+
 if __name__ == "__main__":  # pragma: no cover
     unittest.main()